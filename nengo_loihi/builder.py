@@ -807,7 +807,8 @@ def conn_probe(model, probe):
         scale = probe.target.radius
         w = np.diag(scale * np.ones(d))
         weights = np.vstack([w, -w])
-    cx_probe = CxProbe(key='v', weights=weights, synapse=probe.synapse)
+    cx_probe = CxProbe(key='v', weights=weights, synapse=probe.synapse,
+                       sample_every=probe.sample_every)
     model.objs[target]['in'] = cx_probe
     model.objs[target]['out'] = cx_probe
 
@@ -840,7 +841,8 @@ def signal_probe(model, key, probe):
 
     cx_probe = CxProbe(
         target=target, key=key, slice=probe.slice,
-        synapse=probe.synapse, weights=weights)
+        synapse=probe.synapse, weights=weights,
+        sample_every=probe.sample_every)
     target.add_probe(cx_probe)
     model.objs[probe]['in'] = target
     model.objs[probe]['out'] = cx_probe
@@ -0,0 +1,98 @@
+"""Saving simulator state to disk, and loading it back.
+
+A checkpoint is a directory holding each array of the state as a ``.npy``
+file, which is memory-mapped when loaded, and all other values in a
+single pickle file. Arrays are therefore only read from disk as they are
+used.
+"""
+
+import os
+import pickle
+import shutil
+
+import numpy as np
+from nengo.exceptions import SimulationError
+
+VALUES_FILE = 'values.pkl'
+OLD_SUFFIX = '.old'
+
+
+def save_state(path, state):
+    """Write the dictionary ``state`` to the checkpoint directory ``path``.
+
+    Each NumPy array in ``state`` is written to its own ``.npy`` file; all
+    other values are pickled together. The checkpoint is first written to
+    a temporary directory. Any existing checkpoint at ``path`` is then
+    moved aside (to ``path + '.old'``), the new one is moved to ``path``,
+    and only then is the old one deleted. If the save is interrupted, the
+    old checkpoint is therefore either still at ``path`` or at
+    ``path + '.old'``, where `.load_state` finds it. Arrays that were
+    memory-mapped from the replaced checkpoint stay valid.
+
+    Parameters
+    ----------
+    path : str
+        The checkpoint directory.
+    state : dict
+        The values to save, by name. Names are used as file names.
+    """
+    path = os.path.abspath(path)
+    tmp_path = path + '.tmp'
+    old_path = path + OLD_SUFFIX
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    values = {}
+    for name, value in state.items():
+        if isinstance(value, np.ndarray) and value.dtype != object:
+            np.save(os.path.join(tmp_path, name + '.npy'),
+                    np.ascontiguousarray(value), allow_pickle=False)
+        else:
+            values[name] = value
+    with open(os.path.join(tmp_path, VALUES_FILE), 'wb') as f:
+        pickle.dump(values, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    if os.path.exists(path):
+        if os.path.exists(old_path):
+            shutil.rmtree(old_path)
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+
+
+def load_state(path):
+    """Read the state saved to the checkpoint directory ``path``.
+
+    Arrays are memory-mapped copy-on-write, so they can be modified in
+    memory without changing the checkpoint. If there is no checkpoint at
+    ``path`` because a save was interrupted after moving the previous one
+    aside, the previous one is loaded.
+
+    Parameters
+    ----------
+    path : str
+        The checkpoint directory (see `.save_state`).
+
+    Returns
+    -------
+    state : dict
+        The saved values, by name.
+    """
+    values_path = os.path.join(path, VALUES_FILE)
+    if not os.path.exists(values_path):
+        old_path = os.path.abspath(path) + OLD_SUFFIX
+        if not os.path.exists(os.path.join(old_path, VALUES_FILE)):
+            raise SimulationError("No checkpoint found at %r" % (path,))
+        path = old_path
+        values_path = os.path.join(path, VALUES_FILE)
+
+    with open(values_path, 'rb') as f:
+        state = pickle.load(f)
+    for filename in os.listdir(path):
+        name, ext = os.path.splitext(filename)
+        if ext == '.npy':
+            state[name] = np.load(os.path.join(path, filename),
+                                  mmap_mode='c', allow_pickle=False)
+    return state
@@ -12,6 +12,12 @@ def add_params(network):
         on a Loihi chip. Marking specific ensembles for simulation
         off of a Loihi chip can help with debugging.
 
+    `nengo.Probe`
+      * ``on_disk``: Whether the probe should keep its data in a file
+        rather than in memory (see the ``probe_dir`` argument of
+        `.Simulator`). Only applies to probes of objects on the chip.
+        If None, probes are kept on disk if ``probe_dir`` is given.
+
     Examples
     --------
 
@@ -30,6 +36,11 @@ def add_params(network):
         cfg.set_param("on_chip",
                       Parameter('on_chip', default=None, optional=True))
 
+    cfg = config[nengo.Probe]
+    if 'on_disk' not in cfg._extra_params:
+        cfg.set_param("on_disk",
+                      Parameter('on_disk', default=None, optional=True))
+
 
 def set_defaults():
     """Modify Nengo's default parameters for better performance with Loihi.
@@ -606,8 +606,7 @@ def build_conv2d_connection(model, conn):
 
     ax = CxAxons(input_shape.n_pixels, label="conv2d_weights")
     ax.target = synapses
-    ax.cx_to_axon_map = input_shape.pixel_idxs()
-    ax.cx_atoms = input_shape.channel_idxs()
+    ax.set_axon_map(input_shape.pixel_idxs(), input_shape.channel_idxs())
     pre_cx.add_axons(ax)
 
     post_cx.configure_filter(tau_s, dt=model.dt)
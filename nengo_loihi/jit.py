@@ -0,0 +1,303 @@
+"""A compiled engine for the emulator.
+
+`.JitEngine` runs a `.CxSimulator` for many steps in a single loop that
+is compiled with Numba, rather than calling NumPy functions for each group,
+synapses and probe on every step. Results are identical to those of the
+NumPy engine. If Numba is not installed, the loop runs as (slow) Python.
+"""
+
+import numpy as np
+
+from nengo_loihi.loihi_api import Q_BITS, U_BITS
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def _njit(func):
+    """Compile ``func`` with Numba, if it is installed."""
+    return func if numba is None else numba.njit(cache=True)(func)
+
+
+@_njit
+def _overflow(x, bits, stage, group, t, counts, first_steps):
+    """Wrap ``x`` to ``bits`` bits plus sign, and count any overflow.
+
+    See ``CxSimulator._overflow``.
+    """
+    limit = 1 << bits
+    if x < -limit or x >= limit:
+        counts[group, stage] += 1
+        if first_steps[group, stage] < 0:
+            first_steps[group, stage] = t
+        x = ((x + limit) & (2 * limit - 1)) - limit
+    return x
+
+
+@_njit
+def _deliver(q, t, trial, src, src_ptr, targets, weights, delays):
+    """Add the weights of a spike from source ``src`` to ``q``."""
+    n_delays = q.shape[0]
+    slot = t % n_delays
+    for e in range(src_ptr[src], src_ptr[src + 1]):
+        i = slot + delays[e]
+        q[i - n_delays if i >= n_delays else i, trial, targets[e]] += (
+            weights[e])
+
+
+@_njit  # noqa: C901
+def _run(t0, q, u, v, s, c, w, bias, vth, vmin, vmax, ref,
+         retain_u, retain_v, n_core, src_ptr, targets, weights, delays,
+         input_ptr, input_trials, input_srcs, noise, dend_noise, vm_noise,
+         check_overflow, stop_on_overflow, cx_groups, overflow_counts,
+         overflow_steps, u_idxs, v_idxs, s_idxs, u_out, v_out, s_out):
+    """Run ``len(input_ptr) - 1`` steps of a discretized model.
+
+    This follows ``CxSimulator.step`` (with ``CxSimulator._update`` and
+    ``CxSimulator._decay_int``) operation by operation, for one
+    compartment at a time. If ``stop_on_overflow``, the run stops after
+    the first step with a new overflow. Returns the number of steps run.
+    """
+    n_trials, n_cx = u.shape
+    for k in range(len(input_ptr) - 1):
+        t = t0 + k + 1
+
+        # --- deliver spikes from the last step, and from inputs
+        for trial in range(n_trials):
+            for i in range(n_cx):
+                if s[trial, i]:
+                    _deliver(q, t, trial, i, src_ptr, targets, weights,
+                             delays)
+        for j in range(input_ptr[k], input_ptr[k + 1]):
+            _deliver(q, t, input_trials[j], input_srcs[j], src_ptr, targets,
+                     weights, delays)
+
+        # --- update compartments
+        slot = t % q.shape[0]
+        for trial in range(n_trials):
+            for i in range(n_cx):
+                group = cx_groups[i]
+                x = np.int64(q[slot, trial, i])
+                q[slot, trial, i] = 0
+                if dend_noise[i] >= 0:
+                    x += noise[k, trial, dend_noise[i]]
+                if check_overflow:
+                    x = _overflow(x, Q_BITS, 0, group, t, overflow_counts,
+                                  overflow_steps)
+
+                # products with the decay multipliers are exact in float64
+                # and truncated toward zero, as in `_decay_int`
+                ui = np.int64(u[trial, i] * retain_u[i]) + x
+                if check_overflow:
+                    ui = _overflow(ui, U_BITS, 1, group, t, overflow_counts,
+                                   overflow_steps)
+                u[trial, i] = ui
+
+                u2 = ui + bias[i]
+                if vm_noise[i] >= 0:
+                    u2 += noise[k, trial, vm_noise[i]]
+                if check_overflow:
+                    u2 = _overflow(u2, U_BITS, 2, group, t, overflow_counts,
+                                   overflow_steps)
+
+                vi = np.int64(v[trial, i] * retain_v[i]) + u2
+                vi = min(max(vi, vmin[i]), vmax[i])
+                if w[trial, i] > 0:
+                    vi = 0
+
+                wi = w[trial, i]
+                spiked = vi > vth[i]
+                if spiked:
+                    vi = 0 if i < n_core else vi - vth[i]
+                    wi = ref[i]
+                v[trial, i] = vi
+                s[trial, i] = spiked
+                w[trial, i] = max(wi - 1, 0)
+                c[trial, i] += spiked
+
+            # --- probes
+            for j in range(len(u_idxs)):
+                u_out[k, trial, j] = u[trial, u_idxs[j]]
+            for j in range(len(v_idxs)):
+                v_out[k, trial, j] = v[trial, v_idxs[j]]
+            for j in range(len(s_idxs)):
+                s_out[k, trial, j] = s[trial, s_idxs[j]]
+
+        if stop_on_overflow and np.any(overflow_steps == t):
+            return k + 1
+    return len(input_ptr) - 1
+
+
+class JitEngine(object):
+    """Runs a `.CxSimulator` for many steps in one compiled loop.
+
+    At construction, the axons and synapses of the simulator are compiled
+    into a single table listing, for each group compartment and input, the
+    target compartment, weight and delay of each synapse it reaches. The
+    state arrays of the simulator are updated in place, so runs of the
+    engine can be mixed with `.CxSimulator.step`.
+
+    With `.CxSimulator.strict`, a run stops after the first step with a
+    new overflow and raises the error then. Unlike `.CxSimulator.step`,
+    which raises partway through that step, the engine completes the step
+    (including its probe data) before raising.
+
+    Parameters
+    ----------
+    sim : CxSimulator
+        The simulator to run. It must be supported (see `.unsupported`).
+
+    Attributes
+    ----------
+    src_ptr : (n_sources + 1,) ndarray
+        Pointer to the first synapse of each source, where sources are the
+        simulator compartments followed by the inputs of each input object.
+    targets : (n_synapses,) ndarray
+        The target compartment of each synapse.
+    weights : (n_synapses,) ndarray
+        The weight of each synapse.
+    delays : (n_synapses,) ndarray
+        The delay of each synapse.
+    """
+
+    max_steps = 1024  # the most steps run (and probe data kept) at once
+    probe_keys = ('u', 'v', 's')
+
+    def __init__(self, sim):
+        reason = self.unsupported(sim)
+        assert reason is None, reason
+        self.sim = sim
+
+        table = sim._source_table([
+            sim._source_synapses(obj, axons)
+            for obj in sim.inputs + sim.groups for axons in obj.axons
+            if axons.target in sim.synapse_tables])
+        self.src_ptr = table.row_ptr
+        self.targets = table.indices
+        self.weights = table.weights.astype(np.int32)
+        self.delays = (np.zeros(len(self.targets), dtype=np.int64)
+                       if table.delays is None else table.delays)
+
+        self.cx_groups = np.zeros(sim.n_cx, dtype=np.int64)
+        for k, group in enumerate(sim.groups):
+            self.cx_groups[sim.group_cxs[group]] = k
+
+        self.dend_noise = np.full(sim.n_cx, -1, dtype=np.int64)
+        self.dend_noise[sim.noise_cxs[sim.noise_dend]] = sim.noise_dend
+        self.vm_noise = np.full(sim.n_cx, -1, dtype=np.int64)
+        self.vm_noise[sim.noise_cxs[sim.noise_vm]] = sim.noise_vm
+
+        # the compartments recorded for each key, and the columns of
+        # those for each probe
+        self.probe_idxs = {key: [] for key in self.probe_keys}
+        self.probe_columns = {}
+        for group in sim.groups:
+            for probe in group.probes:
+                idxs = self.probe_idxs[probe.key]
+                cxs = np.arange(sim.n_cx)[sim.group_cxs[group]][
+                    sim._probe_cxs.get(probe, probe.slice)]
+                n = sum(len(x) for x in idxs)
+                self.probe_columns[probe] = (probe.key, slice(n, n + len(cxs)))
+                idxs.append(cxs)
+        self.probe_idxs = {
+            key: np.concatenate(idxs + [np.zeros(0)]).astype(np.int64)
+            for key, idxs in self.probe_idxs.items()}
+
+    @classmethod
+    def unsupported(cls, sim):
+        """The reason that ``sim`` cannot be run by the engine, or None."""
+        if sim.u.dtype != np.int32:
+            return "only discretized models are supported"
+        if len(sim.z) > 0:
+            return "learning is not supported"
+        if sim.event_driven:
+            return "event-driven updates are not supported"
+        for group in sim.groups:
+            for probe in group.probes:
+                if probe.key not in cls.probe_keys:
+                    return "cannot probe %r" % (probe.key,)
+        return None
+
+    def run_steps(self, steps):
+        """Run the simulator for the given number of steps."""
+        while steps > 0:
+            n = min(steps, self.max_steps)
+            self._run_steps(n)
+            steps -= n
+
+    def _run_steps(self, steps):
+        sim = self.sim
+        t0 = sim.t
+        n_trials = sim.u.shape[0]
+
+        # input spikes sent on the step before each step, since input
+        # spikes take one step to arrive
+        spikes = [(np.zeros(0, dtype=np.int32),) * 3]
+        for input in sim.inputs:
+            ks, trials, idxs = input.trial_spike_steps(
+                t0, t0 + steps, n_trials)
+            spikes.append((ks, trials, sim._input_starts[input] + idxs))
+        ks, input_trials, input_srcs = (
+            np.concatenate(x) for x in zip(*spikes))
+        order = np.argsort(ks, kind='mergesort')  # by step, then input
+        input_ptr = np.zeros(steps + 1, dtype=np.int64)
+        np.cumsum(np.bincount(ks, minlength=steps), out=input_ptr[1:])
+        input_trials = input_trials[order].astype(np.int64)
+        input_srcs = input_srcs[order].astype(np.int64)
+
+        # draw the noise for all steps, in the same order as `step`
+        noise_states = [gen.get_state() for gen in sim.noise_generators]
+        noise = (sim.noiseGen(steps).astype(np.int64)
+                 if len(sim.noise_cxs) > 0 else
+                 np.zeros((steps, n_trials, 0), dtype=np.int64))
+
+        out = {key: np.zeros((steps, n_trials, len(idxs)),
+                             dtype=getattr(sim, key).dtype)
+               for key, idxs in self.probe_idxs.items()}
+        first_steps = sim._overflow_steps.copy()
+
+        # in strict mode, stop at the first step with a new overflow, so
+        # that the error is raised on that step as with `step`
+        n = _run(t0, sim.q, sim.u, sim.v, sim.s, sim.c, sim.w, sim.bias,
+                 sim.vth, np.broadcast_to(sim.vmin, sim.n_cx),
+                 np.broadcast_to(sim.vmax, sim.n_cx), sim.ref,
+                 sim._retainU, sim._retainV, sim.cx_slice.stop, self.src_ptr,
+                 self.targets, self.weights, self.delays, input_ptr,
+                 input_trials, input_srcs, noise, self.dend_noise,
+                 self.vm_noise, sim._check_overflow,
+                 sim._check_overflow and sim.strict, self.cx_groups,
+                 sim._overflow_counts, sim._overflow_steps,
+                 self.probe_idxs['u'], self.probe_idxs['v'],
+                 self.probe_idxs['s'], out['u'], out['v'], out['s'])
+        sim.t = t0 + n
+        if n < steps:
+            # only use the noise of the steps that were run
+            for gen, state in zip(sim.noise_generators, noise_states):
+                gen.set_state(state)
+                gen.next_steps(n)
+
+        self._record_input_probes(t0, n)
+        for probe, (key, columns) in self.probe_columns.items():
+            sim.probe_outputs[probe].extend(out[key][:n, :, columns])
+
+        # report new overflow in the order `step` would have
+        new = (first_steps < 0) & (sim._overflow_steps >= 0)
+        for t, i, k in sorted((sim._overflow_steps[k, i], i, k)
+                              for k, i in zip(*new.nonzero())):
+            sim.error("Overflow in %s of %s on step %d" % (
+                sim.overflow_stages[i], sim.groups[k], t))
+
+    def _record_input_probes(self, t0, steps):
+        """Record the probes of inputs for the ``steps`` steps after
+        ``t0``, like `.CxSimulator._record_probes` on each step."""
+        sim = self.sim
+        n_trials = sim.u.shape[0]
+        for input in sim._probed_inputs:
+            s = np.zeros((steps, n_trials, input.n), dtype=bool)
+            s[input.trial_spike_steps(t0 + 1, t0 + steps + 1, n_trials)] = (
+                True)
+            for probe in input.probes:
+                assert probe.key == 's'
+                sim.probe_outputs[probe].extend(s[:, :, probe.slice])
@@ -0,0 +1,489 @@
+"""A pool of worker processes that run many short emulator jobs.
+
+Starting Python, importing Nengo, and building and discretizing a model can
+take much longer than a short emulator run. A `.JobServer` keeps a pool of
+worker processes alive across jobs, so these costs are only paid once per
+worker: each worker keeps the simulators it has built, and resets them for
+later jobs with the same model and options.
+
+Models are written to a directory once, with the arrays of their synapses
+(weights, indices and delays) as ``.npy`` files (see `.save_state`), which
+all workers memory-map. The operating system then keeps one copy of these
+arrays in memory, shared by all workers.
+"""
+
+import collections
+import importlib
+import io
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+from nengo.exceptions import SimulationError, ValidationError
+
+from nengo_loihi.checkpoint import load_state, save_state
+from nengo_loihi.loihi_cx import CxSimulator
+from nengo_loihi.simulator import Simulator
+
+logger = logging.getLogger(__name__)
+
+
+class _ModelPickler(pickle.Pickler):
+    """Pickles a model, referring to the given arrays by name."""
+
+    def __init__(self, f, array_names):
+        super(_ModelPickler, self).__init__(
+            f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.array_names = array_names
+
+    def persistent_id(self, obj):
+        if isinstance(obj, np.ndarray):
+            return self.array_names.get(id(obj))
+        return None
+
+
+class _ModelUnpickler(pickle.Unpickler):
+    """Unpickles a model, taking the named arrays from ``arrays``."""
+
+    def __init__(self, f, arrays):
+        super(_ModelUnpickler, self).__init__(f)
+        self.arrays = arrays
+
+    def persistent_load(self, pid):
+        return self.arrays[pid]
+
+
+def save_model(path, model):
+    """Write ``model`` to the directory ``path``, with the synapse arrays
+    as separate ``.npy`` files (see `.save_state`).
+
+    Returns
+    -------
+    n_bytes : int
+        The size of the synapse arrays that were written.
+    """
+    arrays = collections.OrderedDict()
+    for group in model.cx_groups:
+        for synapses in group.synapses:
+            for x in (synapses.weights, synapses.indices,
+                      synapses.delays or ()):
+                for array in x:
+                    arrays.setdefault(id(array), array)
+
+    array_names = {key: 'a%d' % i for i, key in enumerate(arrays)}
+    f = io.BytesIO()
+    _ModelPickler(f, array_names).dump(model)
+    state = {array_names[key]: array for key, array in arrays.items()}
+    state['model'] = f.getvalue()
+    save_state(path, state)
+    return sum(array.nbytes for array in arrays.values())
+
+
+def load_model(path):
+    """Read a model written by `.save_model`.
+
+    The synapse arrays are memory-mapped, and read-only.
+    """
+    state = load_state(path)
+    for value in state.values():
+        if isinstance(value, np.ndarray):
+            value.setflags(write=False)
+    return _ModelUnpickler(io.BytesIO(state.pop('model')), state).load()
+
+
+def _cached(cache, key, max_size, close=True):
+    """Move ``key`` to the end of ``cache``, and return its value (or None).
+
+    If the cache is full, the least recently used item is removed to make
+    room for a new one. If ``close``, the first element of each item is a
+    simulator, which is closed when it is removed.
+    """
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    while len(cache) >= max_size:
+        _, value = cache.popitem(last=False)
+        if close:
+            value[0].close()
+    return None
+
+
+def _run_model_job(path, models, sims, max_sims, model_id, steps, seed,
+                   spikes, kwargs):
+    """Run a job on a model written by `.JobServer.add_model`."""
+    key = pickle.dumps(('model', model_id, sorted(kwargs.items())))
+    cached = _cached(sims, key, max_sims)
+    if cached is None:
+        loaded = _cached(models, model_id, max_sims, close=False)
+        if loaded is None:
+            model = load_model(os.path.join(path, 'model%d' % model_id))
+            built_spikes = [
+                (dict(input.spikes),
+                 {t: dict(x) for t, x in input.trial_spikes.items()})
+                for input in model.cx_inputs]
+            loaded = models[model_id] = (model, built_spikes)
+        model, built_spikes = loaded
+        sim = CxSimulator(model, seed=seed, **kwargs)
+        sims[key] = (sim, model, built_spikes)
+    else:
+        sim, model, built_spikes = cached
+        sim.reset(seed=seed)
+    inputs = list(model.cx_inputs)
+
+    # `reset` clears the spikes of the inputs, including those in the model
+    for input, (input_spikes, trial_spikes) in zip(inputs, built_spikes):
+        input.clear_spikes()
+        input.spikes.update(input_spikes)
+        input.trial_spikes.update(
+            {t: dict(x) for t, x in trial_spikes.items()})
+    for i, t, idxs in spikes:
+        inputs[i].add_spikes(t, idxs)
+
+    sim.run_steps(steps)
+    return [sim.get_probe_output(probe).copy()
+            for probe in model.cx_probes]
+
+
+def _run_network_job(sims, max_sims, factory, args, run_time, seed, kwargs):
+    """Run a job on the network made by ``factory(*args)``."""
+    key = pickle.dumps(('network', factory, args, sorted(kwargs.items())))
+    cached = _cached(sims, key, max_sims)
+    if cached is None:
+        if isinstance(factory, str):
+            module, _, name = factory.partition(':')
+            factory = getattr(importlib.import_module(module), name)
+        network = factory(*args)
+        sim = Simulator(network, seed=seed, target='sim', **kwargs)
+        probes = list(network.all_probes)
+        sims[key] = (sim, probes)
+    else:
+        sim, probes = cached
+
+    # simulators are seeded the same way whether or not they were cached
+    sim.reset(seed=seed)
+    sim.run(run_time)
+    return [np.asarray(sim.data[probe]) for probe in probes]
+
+
+def _serve(tasks, results, path, max_sims):
+    """Main loop of a worker process."""
+    # least recently used first
+    models = collections.OrderedDict()
+    sims = collections.OrderedDict()
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        job_id, kind, args = task
+        try:
+            if kind == 'model':
+                value = _run_model_job(path, models, sims, max_sims, *args)
+            else:
+                value = _run_network_job(sims, max_sims, *args)
+        except Exception as e:
+            try:
+                pickle.dumps(e)
+            except Exception:
+                e = SimulationError("%s: %s" % (type(e).__name__, e))
+            results.put((job_id, 'error', e))
+        else:
+            results.put((job_id, 'ok', value))
+
+    for value in sims.values():
+        value[0].close()
+
+
+class Job(object):
+    """A job submitted to a `.JobServer`.
+
+    Attributes
+    ----------
+    seed : int
+        The seed the job is run with.
+    """
+
+    def __init__(self, server, job_id, seed, probes):
+        self.server = server
+        self.job_id = job_id
+        self.seed = seed
+        self.probes = probes
+        self._result = None
+
+    def done(self):
+        """Whether the job has finished."""
+        if self._result is not None:
+            return True
+        self.server._collect(block=False)
+        return self.job_id in self.server._results
+
+    def result(self):
+        """Wait for the job to finish, and return the probe data.
+
+        Returns
+        -------
+        data : dict or list
+            For jobs on a `.CxModel`, the output of each `.CxProbe` of the
+            model (see `.CxSimulator.get_probe_output`). For jobs on a
+            network, the data of each probe of the network, in the order of
+            ``network.all_probes``.
+
+        Raises
+        ------
+        Exception
+            Any error raised while running the job.
+        """
+        if self._result is None:
+            while self.job_id not in self.server._results:
+                self.server._collect(block=True)
+            # the server only keeps results until they are retrieved
+            self._result = self.server._results.pop(self.job_id)
+        status, value = self._result
+        if status == 'error':
+            raise value
+        if self.probes is None:
+            return value
+        return collections.OrderedDict(zip(self.probes, value))
+
+
+class JobServer(object):
+    """A pool of worker processes that run emulator jobs.
+
+    Jobs are run by the first idle worker, so that all workers are busy as
+    long as there are jobs waiting. Each worker keeps up to
+    ``max_cached_sims`` simulators, and reuses them (after a reset) for
+    jobs with the same model or network and options, so that each model is
+    only built once per worker. Workers also keep up to as many loaded
+    models, for building simulators with other options.
+
+    The server does not keep submitted models alive. The files of a model
+    are removed once the model has been garbage collected and all of its
+    jobs have finished, so a long-running server only keeps the models
+    that are still in use.
+
+    Worker processes are started with ``fork``, so this is not available
+    on Windows.
+
+    Parameters
+    ----------
+    n_workers : int, optional (Default: None)
+        The number of worker processes. If None, use the number of CPUs.
+    path : str, optional (Default: None)
+        The directory to write models to (see `.add_model`). It should be
+        in memory (e.g. on ``/dev/shm``) for the model arrays not to be
+        read from disk. If None, a temporary directory is made (on
+        ``/dev/shm`` if it exists), which is removed by `.close`.
+    max_cached_sims : int, optional (Default: 8)
+        The most simulators each worker keeps for later jobs.
+
+    Examples
+    --------
+    >>> with JobServer(n_workers=4) as server:
+    ...     jobs = [server.submit(model, 1000, seed=seed)
+    ...             for seed in range(100)]
+    ...     outputs = [job.result()[probe] for job in jobs]
+    """
+
+    poll_interval = 1.0  # seconds between checks that workers are alive
+
+    def __init__(self, n_workers=None, path=None, max_cached_sims=8):
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+        if n_workers < 1:
+            raise ValidationError("Must be positive (got %s)" % n_workers,
+                                  attr="n_workers")
+        self.remove_path = path is None
+        if path is None:
+            path = tempfile.mkdtemp(
+                dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+        self.path = path
+        self.closed = False
+
+        self.models = weakref.WeakKeyDictionary()  # model ids, by model
+        self._model_dirs = set()  # ids of the models written to `path`
+        self._model_jobs = collections.Counter()  # unfinished, by model id
+        self._job_models = {}  # model ids, by job id
+        self._next_model = 0
+        self._next_job = 0
+        self._results = {}
+
+        context = multiprocessing.get_context('fork')
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.workers = [
+            context.Process(target=_serve, args=(
+                self.tasks, self.results, self.path, max_cached_sims),
+                daemon=True)
+            for _ in range(n_workers)]
+        for process in self.workers:
+            process.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_model(self, model):
+        """Write ``model`` for the workers to load (see `.save_model`).
+
+        This is done by `.submit` the first time it is given a model, and
+        only needs to be called to write a model before submitting jobs.
+        The model must be discretized, and must not be changed afterwards.
+
+        Returns
+        -------
+        model_id : int
+            The index of the model.
+        """
+        if model in self.models:
+            return self.models[model]
+
+        self._remove_unused_models()
+        model_id = self._next_model
+        self._next_model += 1
+        n_bytes = save_model(self._model_path(model_id), model)
+        logger.debug("JobServer model %d: %d bytes of synapses",
+                     model_id, n_bytes)
+        self.models[model] = model_id
+        self._model_dirs.add(model_id)
+        return model_id
+
+    def _model_path(self, model_id):
+        return os.path.join(self.path, 'model%d' % model_id)
+
+    def _remove_unused_models(self):
+        """Remove the files of models that have been garbage collected and
+        have no unfinished jobs."""
+        live = set(self.models.values())
+        for model_id in list(self._model_dirs):
+            if model_id not in live and self._model_jobs[model_id] == 0:
+                shutil.rmtree(self._model_path(model_id), ignore_errors=True)
+                self._model_dirs.remove(model_id)
+                del self._model_jobs[model_id]
+
+    def _submit(self, kind, args, seed, probes, model_id=None):
+        if self.closed:
+            raise SimulationError("Cannot submit jobs to a closed JobServer")
+        job_id = self._next_job
+        self._next_job += 1
+        if model_id is not None:
+            self._job_models[job_id] = model_id
+            self._model_jobs[model_id] += 1
+        self.tasks.put((job_id, kind, args))
+        return Job(self, job_id, seed, probes)
+
+    def submit(self, model, steps, seed=None, spikes=(), **kwargs):
+        """Run a discretized `.CxModel` for ``steps`` steps.
+
+        Parameters
+        ----------
+        model : CxModel
+            The model to run (see `.add_model`).
+        steps : int
+            The number of steps to run.
+        seed : int, optional (Default: None)
+            The seed of the simulator. If None, a random seed is chosen.
+        spikes : list of (CxSpikeInput, int, array_like), optional
+            Spikes to add to inputs of the model for this job only, as
+            ``(input, t, spike_idxs)`` tuples (see `.CxSpikeInput`).
+        **kwargs
+            Other arguments to `.CxSimulator`.
+
+        Returns
+        -------
+        job : Job
+            The submitted job; `.Job.result` gives the probe outputs.
+        """
+        model_id = self.add_model(model)
+        if seed is None:
+            seed = np.random.randint(2**31 - 1)
+        input_idxs = {input: i for i, input in enumerate(model.cx_inputs)}
+        spikes = [(input_idxs[input], t, np.asarray(idxs))
+                  for input, t, idxs in spikes]
+        return self._submit(
+            'model', (model_id, steps, seed, spikes, kwargs), seed,
+            model.cx_probes, model_id=model_id)
+
+    def submit_network(self, factory, run_time, args=(), seed=None,
+                       **kwargs):
+        """Build and run the network made by ``factory(*args)``.
+
+        Each worker builds the network once for each factory, arguments
+        and options, and resets the simulator with the seed of each later
+        job with the same ones (see `.Simulator.reset`). Every job,
+        including the first, is run after such a reset, so that the
+        results of a seed do not depend on whether the simulator was
+        reused. Build-time randomness (e.g. encoders) therefore comes from
+        the seed of the network, not from ``seed``.
+
+        Parameters
+        ----------
+        factory : callable or str
+            A function returning a `nengo.Network`, which must be picklable
+            (e.g. defined at the top level of a module), or a reference to
+            one as ``'module:function'``.
+        run_time : float
+            The time to run the network for, in seconds.
+        args : tuple, optional (Default: ())
+            Arguments to ``factory``.
+        seed : int, optional (Default: None)
+            The seed of the simulator (see `.Simulator`). If None, a random
+            seed is chosen.
+        **kwargs
+            Other arguments to `.Simulator` (which always targets the
+            emulator).
+
+        Returns
+        -------
+        job : Job
+            The submitted job; `.Job.result` gives the data of each probe
+            in ``network.all_probes``.
+        """
+        if seed is None:
+            seed = np.random.randint(2**31 - 1)
+        return self._submit(
+            'network', (factory, tuple(args), run_time, seed, kwargs), seed,
+            None)
+
+    def map(self, model, steps, seeds, **kwargs):
+        """Run ``model`` once with each of ``seeds``, and return the probe
+        outputs of each run (see `.submit`)."""
+        jobs = [self.submit(model, steps, seed=seed, **kwargs)
+                for seed in seeds]
+        return [job.result() for job in jobs]
+
+    def _collect(self, block):
+        """Receive the result of a job, if one is ready or ``block``."""
+        try:
+            job_id, status, value = self.results.get(
+                block=block, timeout=self.poll_interval)
+        except queue.Empty:
+            if not all(process.is_alive() for process in self.workers):
+                raise SimulationError(
+                    "Worker processes stopped unexpectedly")
+            return
+        self._results[job_id] = (status, value)
+        if job_id in self._job_models:
+            model_id = self._job_models.pop(job_id)
+            self._model_jobs[model_id] -= 1
+            if self._model_jobs[model_id] == 0:
+                self._remove_unused_models()
+
+    def close(self):
+        """Stop the worker processes, and remove any temporary files."""
+        if self.closed:
+            return
+        self.closed = True
+        for _ in self.workers:
+            self.tasks.put(None)
+        for process in self.workers:
+            process.join()
+        self.workers = []
+        if self.remove_path:
+            shutil.rmtree(self.path, ignore_errors=True)
@@ -373,13 +373,13 @@ class SpikeInput(object):
             tchip_idx, tcore_idx, tsyn_ids = board.find_synapses(axons.target)
             tchip = n2board.n2Chips[tchip_idx]
             tcore = tchip.n2Cores[tcore_idx]
-            spikes = axons.map_cx_spikes(cx_idxs)
-            for cx_idx, spike in zip(cx_idxs, spikes):
-                if spike is not None:
-                    taxon_idx = int(spike.axon_id)
-                    taxon_id = int(tsyn_ids[taxon_idx])
-                    self.axon_map.setdefault(cx_idx, []).append(self.LoihiAxon(
-                        chip_id=tchip.id, core_id=tcore.id, axon_id=taxon_id))
+            axon_cx_idxs = cx_idxs[axons.map_cx_axons(cx_idxs) >= 0]
+            axon_ids, _ = axons.map_cx_spikes(axon_cx_idxs)
+            for cx_idx, taxon_idx in zip(axon_cx_idxs, axon_ids):
+                taxon_id = int(tsyn_ids[taxon_idx])
+                self.axon_map.setdefault(int(cx_idx), []).append(
+                    self.LoihiAxon(chip_id=tchip.id, core_id=tcore.id,
+                                   axon_id=taxon_id))
 
     def spikes_to_loihi(self, t, cx_idxs):
         for cx_idx in cx_idxs:
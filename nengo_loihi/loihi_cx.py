@@ -1,7 +1,12 @@
 from __future__ import division
 
 import collections
+import hashlib
 import logging
+import os
+import shutil
+import tempfile
+import timeit
 import warnings
 
 import numpy as np
@@ -9,6 +14,7 @@ import nengo
 from nengo.exceptions import BuildError, SimulationError
 from nengo.utils.compat import is_integer, is_iterable
 
+from nengo_loihi.jit import JitEngine, numba
 from nengo_loihi.loihi_api import (
     BIAS_MAX,
     bias_to_manexp,
@@ -322,10 +328,27 @@ class CxGroup(object):
             if p.key == 'v' and p.weights is not None:
                 p.weights /= v_scale[0]
 
-    def validate(self):
+    def validate(self, hardware_limits=True):
+        """Check that the group is valid.
+
+        Parameters
+        ----------
+        hardware_limits : bool, optional (Default: True)
+            Whether to check that the group fits on one Loihi core. If
+            False, only checks that do not depend on its size are done.
+        """
         if self.location == 'cpu':
             return  # none of these checks currently apply to Lakemont
 
+        for axons in self.axons:
+            axons.validate()
+
+        for probe in self.probes:
+            probe.validate()
+
+        if not hardware_limits:
+            return
+
         N_CX_MAX = 1024
         if self.n > N_CX_MAX:
             raise BuildError("Number of compartments (%d) exceeded max (%d)" %
@@ -352,12 +375,6 @@ class CxGroup(object):
         for synapses in self.synapses:
             synapses.validate()
 
-        for axons in self.axons:
-            axons.validate()
-
-        for probe in self.probes:
-            probe.validate()
-
 
 class CxSynapses(object):
     """A group of Loihi synapses that share some properties.
@@ -375,6 +392,9 @@ class CxSynapses(object):
         can have a different number of target compartments.
     indices : (population, axon, compartment) ndarray
         The synapse indices.
+    delays : (n_axons,) list of (n_populations, n_compartments) ndarray
+        The synapse delays, in timesteps, organized like ``weights``.
+        None if no synapse has a delay.
     tracing : bool
         Whether synaptic tracing is enabled for these synapses.
     tracing_tau : float
@@ -389,6 +409,7 @@ class CxSynapses(object):
         self.synapse_fmt = None
         self.weights = None
         self.indices = None
+        self.delays = None
         self.axon_cx_bases = None
         self.axon_to_weight_map = None
         self.tracing = False
@@ -411,16 +432,24 @@ class CxSynapses(object):
         return max(np.abs(w).max() if w.size > 0 else -np.inf
                    for w in self.weights)
 
+    def max_delay(self):
+        if self.delays is None:
+            return 0
+        return max(d.max() if d.size > 0 else 0 for d in self.delays)
+
+    def dly_bits(self):
+        return int(np.ceil(np.log2(self.max_delay() + 1)))
+
     def max_ind(self):
         return max(i.max() if len(i) > 0 else -1 for i in self.indices)
 
     def idx_bits(self):
+        """The index of the number of bits needed to store the indices in
+        `.SynapseFmt.INDEX_BITS_MAP` (or of the most bits available, if more
+        are needed; see `.validate`)."""
         idxBits = int(np.ceil(np.log2(self.max_ind() + 1)))
-        assert idxBits <= SynapseFmt.INDEX_BITS_MAP[-1], (
-            "idxBits out of range, ensemble too large?")
-        idxBits = next(i for i, v in enumerate(SynapseFmt.INDEX_BITS_MAP)
-                       if v >= idxBits)
-        return idxBits
+        return next((i for i, v in enumerate(SynapseFmt.INDEX_BITS_MAP)
+                     if v >= idxBits), len(SynapseFmt.INDEX_BITS_MAP) - 1)
 
     def idxs_per_synapse(self):
         return 2 if self.tracing else 1
@@ -521,6 +550,34 @@ class CxSynapses(object):
                     numSynapses=63,
                     wgtBits=7)
 
+    def set_delays(self, delays):
+        """Set the delay of each synapse, in timesteps.
+
+        Must be called after the weights are set.
+
+        Parameters
+        ----------
+        delays : int or (n_axons,) list of (n_populations, n_compartments) \
+                ndarray
+            A delay for all synapses, or delays organized like ``weights``.
+        """
+        assert self.weights is not None, "Weights must be set first"
+        if is_integer(delays):
+            delays = [np.full(w.shape, delays, dtype=np.int32)
+                      for w in self.weights]
+        delays = [np.array(d, copy=False, dtype=np.int32, ndmin=2)
+                  for d in delays]
+        assert len(delays) == len(self.weights)
+        assert all(d.shape == w.shape for d, w in zip(delays, self.weights)), (
+            "Delays shapes must match weights shapes")
+        assert all(np.all(d >= 0) for d in delays), (
+            "Delays must be non-negative")
+        self.delays = delays
+
+        dlyBits = self.dly_bits()
+        assert dlyBits < 8, "Delays must be < %d" % (2**7)
+        self.format(dlyBits=dlyBits)
+
     def set_learning(self, tracing_tau=2, tracing_mag=1.0):
         assert tracing_tau == int(tracing_tau), "tracing_tau must be integer"
         self.tracing = True
@@ -538,6 +595,9 @@ class CxSynapses(object):
         self.synapse_fmt.set(**kwargs)
 
     def validate(self):
+        idxBits = int(np.ceil(np.log2(self.max_ind() + 1)))
+        assert idxBits <= SynapseFmt.INDEX_BITS_MAP[-1], (
+            "idxBits out of range, ensemble too large?")
         if self.axon_cx_bases is not None:
             assert np.all(self.axon_cx_bases < 256), "CxBase cannot be > 256"
         if self.pop_type == 16:
@@ -545,15 +605,550 @@ class CxSynapses(object):
                 assert np.all(self.axon_cx_bases % 4 == 0)
 
 
+def share_arrays(arrays, shared):
+    """Replace arrays by read-only arrays shared with identical ones.
+
+    Arrays are identified by their data type, shape and a hash of their
+    contents, so that all identical arrays are replaced by the same array,
+    and only use memory once. Shared arrays that are views are copied, so
+    that they do not keep the memory of the arrays they view.
+
+    Parameters
+    ----------
+    arrays : list of ndarray
+        The arrays to replace.
+    shared : dict
+        The shared arrays, by identity. Arrays not in it are made read-only
+        and added to it.
+
+    Returns
+    -------
+    arrays : list of ndarray
+        The shared array identical to each given array.
+    """
+    result = []
+    for x in arrays:
+        key = (x.dtype.str, x.shape, hashlib.sha1(x.tobytes()).digest())
+        if key not in shared:
+            x = np.array(x) if x.base is not None else x
+            x.setflags(write=False)
+            shared[key] = x
+        result.append(shared[key])
+    return result
+
+
+def csr_gather(starts, lengths):
+    """Compute flat indices for the concatenation of several CSR rows.
+
+    Parameters
+    ----------
+    starts : (n,) ndarray
+        Starting pointer of each row.
+    lengths : (n,) ndarray
+        Number of entries in each row.
+
+    Returns
+    -------
+    ptrs : (lengths.sum(),) ndarray
+        Pointers to the entries of all rows, concatenated in order.
+    """
+    n = lengths.sum()
+    offsets = np.cumsum(lengths) - lengths
+    return np.arange(n) + np.repeat(starts - offsets, lengths)
+
+
+def concat_spikes(spikes, n_arrays=2):
+    """Concatenate a list of tuples of spike arrays (e.g. axon_ids, atoms).
+
+    Parameters
+    ----------
+    spikes : list of tuples
+        Each tuple contains ``n_arrays`` arrays of the same length.
+    n_arrays : int, optional (Default: 2)
+        The number of arrays in each tuple; used when ``spikes`` is empty.
+    """
+    if len(spikes) == 0:
+        return tuple(np.zeros(0, dtype=np.int32) for _ in range(n_arrays))
+    elif len(spikes) == 1:
+        return spikes[0]
+    return tuple(np.concatenate(arrays) for arrays in zip(*spikes))
+
+
+def locality_order(n, tables):
+    """An order of compartments in which the targets of each axon are close.
+
+    Compartments are ordered by the first axon (of the given tables, in
+    order) that targets them with a nonzero weight of its first atom.
+    Compartments with the same first axon, and those that no axon targets,
+    keep their order.
+
+    Parameters
+    ----------
+    n : int
+        The number of compartments.
+    tables : list of SynapseTable
+        The synapses targeting the compartments.
+
+    Returns
+    -------
+    order : (n,) ndarray
+        The index of the compartment to store at each position.
+    """
+    first = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+    offset = 0
+    for table in tables:
+        axon_ids = table.axon_valid.nonzero()[0]
+        ptrs, lengths, targets = table.gather(
+            axon_ids, np.zeros_like(axon_ids))
+        nonzero = table.weights[ptrs] != 0
+        axons = np.repeat(axon_ids, lengths)[nonzero]
+        # axons are in order, so the first weight for each target is from
+        # its first axon
+        targets, idxs = np.unique(targets[nonzero], return_index=True)
+        first[targets] = np.minimum(first[targets], offset + axons[idxs])
+        offset += len(table.axon_valid)
+    return np.argsort(first, kind='mergesort')
+
+
+class SynapseTable(object):
+    """A `.CxSynapses` object compiled for fast delivery in the emulator.
+
+    Weights and indices are stored in compressed sparse row (CSR) format,
+    with one row for each population (atom) of each weight index. Spikes
+    can then be delivered for many axons at once, by gathering their rows
+    and accumulating the weights with ``np.bincount``.
+
+    Tables compiled from synapses with the same weights, indices and
+    delays (the same arrays, e.g. as shared by `.CxModel.share_weights`)
+    and axon maps can share their read-only arrays, including their
+    `.dense_weights`. Learning copies the weights of a table before
+    changing them (copy-on-write).
+
+    Parameters
+    ----------
+    synapses : CxSynapses
+        The synapses to compile. The weights are copied, so changes made
+        to ``synapses.weights`` after compilation will not be reflected.
+    shared : dict, optional (Default: None)
+        The arrays of the tables compiled so far, by the synapse arrays
+        they were compiled from. If given, the arrays of this table are
+        taken from it if possible, and added to it otherwise.
+
+    Attributes
+    ----------
+    axon_row : (n_axons,) ndarray
+        The first row used by each axon; the row for a spike is
+        ``axon_row[axon_id] + atom``.
+    axon_cx_base : (n_axons,) ndarray
+        The compartment offset (``cx_base``) of each axon.
+    axon_valid : (n_axons,) ndarray
+        False for dummy axons (i.e. those with no weights).
+    row_ptr : (n_rows + 1,) ndarray
+        Pointer to the start of each row in ``indices`` and ``weights``.
+    indices : (n_entries,) ndarray
+        Target compartment indices (before adding ``cx_base``).
+    weights : (n_entries,) ndarray
+        Synapse weights (read-only; see `.update_weights`).
+    delays : (n_entries,) ndarray or None
+        Synapse delays, or None if no synapse has a delay.
+    weight_matrix : (n_axons, n_compartments) ndarray or None
+        For learning (tracing) synapses, a 2-D view of ``weights`` with one
+        row per axon, so that learning can update all weights at once.
+    n_atoms : int
+        The largest number of populations (atoms) of any axon.
+    n_sparse, n_dense : int
+        The number of steps on which spikes have been delivered by summing
+        the weights of each spike, and by multiplying spike counts by the
+        dense weights (see `.deliver`), respectively.
+    target_map : (n_compartments,) ndarray or None
+        The position in memory of each compartment of the target group, if
+        they are not stored in order (see `.set_target_map`).
+    """
+
+    # The most weights that `.dense_weights` may have. Dense weights are
+    # used if that needs at most ``dense_ratio`` times as many products as
+    # there are weights to sum, plus ``dense_offset`` (for the overhead of
+    # finding the weights to sum).
+    max_dense_size = 2**22
+    dense_ratio = 32
+    dense_offset = 1024
+    # Weights summed for spikes are only added to the entries of ``q`` that
+    # they reach if there are fewer than ``1 / touch_ratio`` as many of
+    # them as entries, rather than summed into a dense array.
+    touch_ratio = 16
+
+    _array_names = ('axon_row', 'axon_valid', 'axon_cx_base', 'row_ptr',
+                    'indices', 'weights', 'delays')
+
+    def __init__(self, synapses, shared=None):
+        self.synapses = synapses
+        n_axons = synapses.n_axons
+
+        weight_idxs = (np.arange(n_axons)
+                       if synapses.axon_to_weight_map is None else
+                       np.asarray(synapses.axon_to_weight_map, dtype=np.int32))
+        cx_bases = (np.zeros(n_axons, dtype=np.int32)
+                    if synapses.axon_cx_bases is None else
+                    np.asarray(synapses.axon_cx_bases, dtype=np.int32))
+
+        # tables of the same synapse arrays are the same (the arrays are
+        # alive, so their ids are unique)
+        key = (tuple(map(id, synapses.weights)),
+               tuple(map(id, synapses.indices)),
+               None if synapses.delays is None else
+               tuple(map(id, synapses.delays)),
+               weight_idxs.tobytes(), cx_bases.tobytes())
+        if shared is None or key not in shared:
+            arrays = self._compile(synapses, weight_idxs, cx_bases)
+            if shared is not None:
+                shared[key] = arrays
+        else:
+            arrays = shared[key]
+        for name in self._array_names:
+            setattr(self, name, arrays[name])
+        self._built_weights = self.weights
+        self._shared_dense = arrays['dense']
+
+        n_populations = np.array([w.shape[0] for w in synapses.weights])
+        self.n_atoms = n_populations.max()
+        self.n_keys = n_axons * self.n_atoms
+        self.n_delays = 1 + synapses.max_delay()
+        self.target_map = None
+        self._dense_weights = None
+        self.reset_stats()
+
+        self.weight_matrix = None
+        if synapses.tracing:
+            assert np.array_equal(weight_idxs, np.arange(n_axons))
+            assert np.all(n_populations == 1), "Learning needs 1 population"
+            assert np.all(np.diff(self.row_ptr, n=2) == 0)
+            self.weight_matrix = self.weights.reshape(n_axons, -1)
+
+    @classmethod
+    def from_sources(cls, n_sources, srcs, targets, weights, delays):
+        """A table with one axon (and row) for each source of spikes.
+
+        Such a table can hold the synapses of many `.CxSynapses` objects at
+        once, by indexing them by the compartment or input that sends the
+        spikes, rather than by axon (see ``CxSimulator(fuse=True)``).
+
+        Parameters
+        ----------
+        n_sources : int
+            The number of sources.
+        srcs : (n_entries,) ndarray
+            The source of each synapse.
+        targets : (n_entries,) ndarray
+            The target compartment of each synapse.
+        weights : (n_entries,) ndarray
+            The weight of each synapse.
+        delays : (n_entries,) ndarray
+            The delay of each synapse.
+        """
+        order = np.argsort(srcs, kind='mergesort')
+        row_ptr = np.zeros(n_sources + 1, dtype=np.int64)
+        np.cumsum(np.bincount(srcs, minlength=n_sources), out=row_ptr[1:])
+        arrays = dict(
+            axon_row=np.arange(n_sources, dtype=np.int32),
+            axon_valid=np.ones(n_sources, dtype=bool),
+            axon_cx_base=np.zeros(n_sources, dtype=np.int32),
+            row_ptr=row_ptr,
+            indices=targets[order].astype(np.int64),
+            weights=weights[order],
+            delays=(delays[order].astype(np.int64) if np.any(delays > 0)
+                    else None),
+        )
+        for x in arrays.values():
+            if x is not None:
+                x.setflags(write=False)
+
+        self = cls.__new__(cls)
+        self.synapses = None
+        for name in self._array_names:
+            setattr(self, name, arrays[name])
+        self._built_weights = self.weights
+        self._shared_dense = {}
+        self.n_atoms = 1
+        self.n_keys = n_sources
+        self.n_delays = 1 + (0 if len(delays) == 0 else int(delays.max()))
+        self.target_map = None
+        self._dense_weights = None
+        self.reset_stats()
+        self.weight_matrix = None
+        return self
+
+    def _compile(self, synapses, weight_idxs, cx_bases):
+        """Compile the read-only arrays of the table (see `._array_names`)
+        and an empty cache for its dense weights."""
+        n_populations = np.array([w.shape[0] for w in synapses.weights])
+        row_start = np.cumsum(n_populations) - n_populations
+        row_lengths = np.hstack([
+            np.full(w.shape[0], w.shape[1], dtype=np.int32)
+            for w in synapses.weights])
+
+        axon_valid = cx_bases > -1024
+        row_ptr = np.zeros(len(row_lengths) + 1, dtype=np.int64)
+        np.cumsum(row_lengths, out=row_ptr[1:])
+        arrays = dict(
+            axon_row=row_start[weight_idxs].astype(np.int32),
+            axon_valid=axon_valid,
+            axon_cx_base=np.where(axon_valid, cx_bases, 0),
+            row_ptr=row_ptr,
+            indices=np.hstack([i.ravel() for i in synapses.indices]),
+            weights=np.hstack([w.ravel() for w in synapses.weights]),
+            delays=(None if synapses.max_delay() == 0 else
+                    np.hstack([d.ravel() for d in synapses.delays])),
+        )
+        for x in arrays.values():
+            if x is not None:
+                x.setflags(write=False)
+        arrays['dense'] = {}  # dense weights, by number of compartments
+        return arrays
+
+    def _set_weights(self, weights):
+        self.weights = weights
+        if self.weight_matrix is not None:
+            self.weight_matrix = weights.reshape(self.weight_matrix.shape)
+        self._dense_weights = None
+
+    def update_weights(self, delta):
+        """Add ``delta`` to the ``weight_matrix`` (e.g. for learning).
+
+        The weights are copied the first time they are changed, since they
+        may be shared with other tables.
+        """
+        if not self.weights.flags.writeable:
+            self._set_weights(self.weights.copy())
+        self.weight_matrix += delta
+        self._dense_weights = None
+
+    def reset_weights(self):
+        """Restore the weights compiled from the synapses (e.g. after
+        learning has changed them)."""
+        self._set_weights(self._built_weights)
+
+    def set_target_map(self, target_map):
+        """Deliver the input for each compartment ``i`` of the target group
+        to position ``target_map[i]``, rather than ``i``."""
+        self.target_map = target_map
+        self._dense_weights = None
+
+    def row_weights(self, row):
+        """A view of the weights in the given row."""
+        return self.weights[self.row_ptr[row]:self.row_ptr[row + 1]]
+
+    def deliver(self, q, axon_ids, atoms, trials=None, t=0,
+                allow_dense=False):
+        """Accumulate the weights for the given spikes into ``q``.
+
+        Parameters
+        ----------
+        q : (n_delays, n) or (n_delays, n_trials, n) ndarray
+            Input accumulators for the target group's compartments, used as
+            a ring buffer: spikes with delay ``d`` go to
+            ``q[(t + d) % n_delays]``.
+        axon_ids : (n_spikes,) ndarray
+            The axon targeted by each spike.
+        atoms : (n_spikes,) ndarray
+            The atom (population index) of each spike.
+        trials : (n_spikes,) ndarray, optional (Default: None)
+            The trial of each spike, if ``q`` has a trial axis.
+        t : int, optional (Default: 0)
+            The current timestep.
+        allow_dense : bool, optional (Default: False)
+            Whether the spikes may be counted and multiplied by a dense
+            weight matrix (see `.dense_weights`), if that is faster. The
+            weights are then summed in a different order, so this only
+            gives the same result for integer weights.
+        """
+        valid = self.axon_valid[axon_ids]
+        axon_ids, atoms = axon_ids[valid], atoms[valid]
+        if len(axon_ids) == 0:
+            return
+        trials = None if trials is None else trials[valid]
+
+        n_trials = 1 if trials is None else q.shape[1]
+        if allow_dense and self._dense_faster(
+                axon_ids, atoms, n_trials, q.shape[-1]):
+            self.n_dense += 1
+            keys = axon_ids * self.n_atoms + atoms
+            if trials is not None:
+                keys = keys + trials * self.n_keys
+            counts = np.bincount(keys, minlength=n_trials * self.n_keys)
+            counts = counts.reshape(n_trials, self.n_keys).astype(np.float64)
+            for d, w in enumerate(self.dense_weights(q.shape[-1])):
+                qt = q[(t + d) % len(q)]
+                x = np.dot(counts, w)
+                np.add(qt, x.reshape(qt.shape), out=qt, casting='unsafe')
+            return
+
+        self.n_sparse += 1
+        ptrs, lengths, targets = self.gather(axon_ids, atoms)
+        if trials is not None:
+            targets += np.repeat(trials * q.shape[-1], lengths)
+
+        qt = q[t % len(q)]
+        if self.delays is None and len(targets) * self.touch_ratio >= qt.size:
+            x = np.bincount(
+                targets, weights=self.weights[ptrs], minlength=qt.size)
+            np.add(qt, x.reshape(qt.shape), out=qt, casting='unsafe')
+        else:
+            # only touch the entries of `q` that receive input
+            slots = (t if self.delays is None else
+                     t + self.delays[ptrs]) % len(q)
+            targets += slots * q[0].size
+            targets, inverse = np.unique(targets, return_inverse=True)
+            x = np.bincount(inverse, weights=self.weights[ptrs])
+            idxs = np.unravel_index(targets, q.shape)
+            q[idxs] = q[idxs] + x
+
+    def deliver_steps(self, shape, steps, axon_ids, atoms, trials,
+                      allow_dense=False):
+        """The summed weights for spikes delivered on many steps.
+
+        Parameters
+        ----------
+        shape : (n_steps, n_trials, n) tuple
+            The shape of the output. It must have room for the delays of
+            the last steps (i.e. ``n_steps`` must exceed the largest step
+            index by at least the largest delay).
+        steps : (n_spikes,) ndarray
+            The index of the step on which each spike is delivered.
+        axon_ids : (n_spikes,) ndarray
+            The axon targeted by each spike.
+        atoms : (n_spikes,) ndarray
+            The atom (population index) of each spike.
+        trials : (n_spikes,) ndarray
+            The trial of each spike.
+        allow_dense : bool, optional (Default: False)
+            See `.deliver`.
+
+        Returns
+        -------
+        x : ndarray
+            The input to each trial and compartment of the target group on
+            each step, as floats. Spikes delivered on step ``k`` with delay
+            ``d`` are part of ``x[k + d]``.
+        """
+        valid = self.axon_valid[axon_ids]
+        steps, axon_ids = steps[valid], axon_ids[valid]
+        atoms, trials = atoms[valid], trials[valid]
+
+        n_steps = shape[0] - self.n_delays + 1
+        n_delivered = len(np.unique(steps))
+        if allow_dense and self._dense_faster(
+                axon_ids, atoms, n_steps * shape[1], shape[2]):
+            self.n_dense += n_delivered
+            # count the spikes of each axon and atom on each step and trial
+            counts = np.bincount(
+                (steps.astype(np.int64) * shape[1] + trials) * self.n_keys
+                + axon_ids * self.n_atoms + atoms,
+                minlength=n_steps * shape[1] * self.n_keys)
+            counts = counts.reshape(-1, self.n_keys).astype(np.float64)
+            x = np.zeros(shape)
+            for d, w in enumerate(self.dense_weights(shape[2])):
+                x[d:d + n_steps] += np.dot(counts, w).reshape(
+                    (n_steps,) + shape[1:])
+            return x
+
+        self.n_sparse += n_delivered
+        ptrs, lengths, targets = self.gather(axon_ids, atoms)
+        step_size = shape[1] * shape[2]
+        offsets = steps.astype(np.int64) * step_size + trials * shape[2]
+        targets = targets + np.repeat(offsets, lengths)
+        if self.delays is not None:
+            targets += self.delays[ptrs] * step_size
+        x = np.bincount(targets, weights=self.weights[ptrs],
+                        minlength=np.prod(shape))
+        return x.reshape(shape)
+
+    def dense_weights(self, n):
+        """The weights as dense matrices, one for each delay.
+
+        Parameters
+        ----------
+        n : int
+            The number of compartments in the target group.
+
+        Returns
+        -------
+        weights : (n_delays, n_axons * n_atoms, n) ndarray
+            The summed weights from each axon and atom (in row
+            ``axon_id * n_atoms + atom``) to each compartment of the target
+            group, for each delay.
+        """
+        shared = self.target_map is None and (
+            self.weights is self._built_weights)
+        if self._dense_weights is None and shared:
+            self._dense_weights = self._shared_dense.get(n)
+        if self._dense_weights is None:
+            keys = self.axon_valid.repeat(self.n_atoms).nonzero()[0]
+            ptrs, lengths, targets = self.gather(
+                keys // self.n_atoms, keys % self.n_atoms)
+            targets = targets + np.repeat(keys * n, lengths)
+            if self.delays is not None:
+                targets += self.delays[ptrs] * (self.n_keys * n)
+            w = np.bincount(targets, weights=self.weights[ptrs],
+                            minlength=self.n_delays * self.n_keys * n)
+            self._dense_weights = w.reshape(self.n_delays, self.n_keys, n)
+            if shared:
+                self._dense_weights.setflags(write=False)
+                self._shared_dense[n] = self._dense_weights
+        return self._dense_weights
+
+    def reset_stats(self):
+        """Reset the counts of steps delivered with each method."""
+        self.n_sparse = 0
+        self.n_dense = 0
+
+    def _dense_faster(self, axon_ids, atoms, n_counts, n):
+        """Whether delivering the given spikes is expected to be faster by
+        multiplying ``n_counts`` spike count vectors by the dense weights
+        (for ``n`` compartments) than by summing the weights of each."""
+        if self.weight_matrix is not None:
+            return False  # learning changes the weights
+        dense_size = self.n_delays * self.n_keys * n
+        if dense_size > self.max_dense_size:
+            return False
+        rows = self.axon_row[axon_ids] + atoms
+        n_weights = (self.row_ptr[rows + 1] - self.row_ptr[rows]).sum()
+        return n_counts * dense_size <= self.dense_ratio * (
+            n_weights + self.dense_offset)
+
+    def gather(self, axon_ids, atoms):
+        """Find the weights targeted by the given spikes to valid axons.
+
+        Returns
+        -------
+        ptrs : ndarray
+            Pointers to the weights of all spikes, concatenated.
+        lengths : (n_spikes,) ndarray
+            The number of weights of each spike.
+        targets : ndarray
+            The target compartment of each weight.
+        """
+        rows = self.axon_row[axon_ids] + atoms
+        starts = self.row_ptr[rows]
+        lengths = self.row_ptr[rows + 1] - starts
+        ptrs = csr_gather(starts, lengths)
+        targets = np.add(self.indices[ptrs],
+                         np.repeat(self.axon_cx_base[axon_ids], lengths),
+                         dtype=np.int64)
+        if self.target_map is not None:
+            targets = self.target_map[targets]
+        return ptrs, lengths, targets
+
+
 class CxAxons(object):
     """A group of axons, targeting a specific CxSynapses object.
 
     Attributes
     ----------
-    cx_atoms : list of length ``group.n``
+    cx_atoms : (group.n,) ndarray
         Atom (weight index) associated with each group compartment.
-    cx_to_axon_map : list of length ``group.n``
+    cx_to_axon_map : (group.n,) ndarray
         Index of the axon in `target` targeted by each group compartment.
+        Compartments with a negative index do not have an axon.
     group : CxGroup
         Parent CxGroup for this object (set in `CxGroup.add_axons`).
     n_axons : int
@@ -562,31 +1157,6 @@ class CxAxons(object):
         Target synapses for these axons.
     """
 
-    class Spike(object):
-        """A spike, targeting a particular axon within a CxSynapses object.
-
-        The CxSynapses target is implicit, given by the CxAxons object that
-        creates this Spike.
-
-        Parameters
-        ----------
-        axon_id : int
-            The index of the axon within the targeted CxSynapses object.
-        atom : int, optional (Default: 0)
-            An index into the target CxSynapses weights. This allows spikes
-            targeting a particular axon to use different weights.
-        """
-
-        __slots__ = ['axon_id', 'atom']
-
-        def __init__(self, axon_id, atom=0):
-            self.axon_id = axon_id
-            self.atom = atom
-
-        def __repr__(self):
-            return "%s(axon_id=%d, atom=%d)" % (
-                type(self).__name__, self.axon_id, self.atom)
-
     def __init__(self, n_axons, label=None):
         self.n_axons = n_axons
         self.label = label
@@ -614,22 +1184,42 @@ class CxAxons(object):
         return self.slots_per_axon * self.n_axons
 
     def set_axon_map(self, cx_to_axon_map, cx_atoms=None):
-        self.cx_to_axon_map = cx_to_axon_map
-        self.cx_atoms = cx_atoms
+        self.cx_to_axon_map = (None if cx_to_axon_map is None else
+                               np.asarray(cx_to_axon_map, dtype=np.int32))
+        self.cx_atoms = (None if cx_atoms is None else
+                         np.asarray(cx_atoms, dtype=np.int32))
 
     def map_cx_axons(self, cx_idxs):
         return (self.cx_to_axon_map[cx_idxs]
-                if self.cx_to_axon_map is not None else cx_idxs)
+                if self.cx_to_axon_map is not None else
+                np.asarray(cx_idxs, dtype=np.int32))
 
     def map_cx_atoms(self, cx_idxs):
         return (self.cx_atoms[cx_idxs] if self.cx_atoms is not None else
-                [0 for _ in cx_idxs])
+                np.zeros(len(cx_idxs), dtype=np.int32))
 
     def map_cx_spikes(self, cx_idxs):
+        """Map spiking compartments to the axons and atoms they target.
+
+        Parameters
+        ----------
+        cx_idxs : (n,) ndarray
+            Indices of the spiking compartments.
+
+        Returns
+        -------
+        axon_ids : (m,) ndarray
+            The index of the axon in `target` for each spike.
+        atoms : (m,) ndarray
+            The atom (weight index) for each spike.
+
+        Compartments that do not have an axon (i.e. map to a negative axon
+        index) are omitted, so ``m <= n``.
+        """
         axon_ids = self.map_cx_axons(cx_idxs)
         atoms = self.map_cx_atoms(cx_idxs)
-        return [self.Spike(axon_id, atom=atom) if axon_id >= 0 else None
-                for axon_id, atom in zip(axon_ids, atoms)]
+        valid = axon_ids >= 0
+        return axon_ids[valid], atoms[valid]
 
     def validate(self):
         if isinstance(self.target, CxSynapses):
@@ -645,12 +1235,14 @@ class CxProbe(object):
     _slice = slice
 
     def __init__(self, target=None, key=None, slice=None, weights=None,
-                 synapse=None):
+                 synapse=None, sample_every=None):
         self.target = target
         self.key = key
         self.slice = slice if slice is not None else self._slice(None)
         self.weights = weights
         self.synapse = synapse
+        self.sample_every = sample_every  # in seconds, as for nengo.Probe
+        self.on_disk = False  # whether to keep the data in a file
         self.use_snip = False
         self.snip_info = None
 
@@ -658,10 +1250,657 @@ class CxProbe(object):
         pass
 
 
+class ProbeBuffer(object):
+    """Preallocated storage for the data recorded by a probe on each step.
+
+    Data is written into a NumPy array that is grown geometrically as
+    needed (or reserved ahead of time with `.reserve`), so that recording
+    a step does not allocate and reading the recorded data does not copy.
+
+    If ``max_steps`` is given, only the most recent ``max_steps`` steps are
+    kept. The buffer is then a ring in which each step is written twice,
+    so that the kept steps are always contiguous in memory.
+
+    Parameters
+    ----------
+    shape : tuple
+        The shape of the data recorded on each step.
+    dtype : np.dtype, optional (Default: np.float32)
+        The data type of the recorded data.
+    max_steps : int, optional (Default: None)
+        The maximum number of steps to keep. If None, all steps are kept.
+
+    Attributes
+    ----------
+    n_steps : int
+        The total number of steps recorded, including discarded steps.
+    """
+
+    def __init__(self, shape, dtype=np.float32, max_steps=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.max_steps = max_steps
+        self.n_steps = 0
+
+        capacity = 0 if max_steps is None else 2 * max_steps
+        self._data = np.zeros((capacity,) + self.shape, dtype=self.dtype)
+
+    def __len__(self):
+        return (self.n_steps if self.max_steps is None else
+                min(self.n_steps, self.max_steps))
+
+    @property
+    def first_step(self):
+        """The index of the earliest step still kept in the buffer."""
+        return self.n_steps - len(self)
+
+    def _resize(self, capacity):
+        data = np.zeros((capacity,) + self.shape, dtype=self.dtype)
+        data[:self.n_steps] = self._data[:self.n_steps]
+        self._data = data
+
+    def clear(self):
+        """Discard all recorded steps, keeping the allocated memory."""
+        self.n_steps = 0
+
+    def reserve(self, steps):
+        """Make sure there is room to record ``steps`` more steps."""
+        if self.max_steps is None and self.n_steps + steps > len(self._data):
+            self._resize(max(self.n_steps + steps, 2 * len(self._data)))
+
+    def append(self, x, steps=1):
+        """Record the data ``x`` for each of the next ``steps`` steps."""
+        if self.max_steps is None:
+            if self.n_steps + steps > len(self._data):
+                self._resize(max(self.n_steps + steps, 2 * len(self._data),
+                                 16))
+            self._data[self.n_steps:self.n_steps + steps] = x
+        else:
+            # only the last `max_steps` steps are kept
+            end = self.n_steps + steps
+            for j in range(end - min(steps, self.max_steps), end):
+                i = j % self.max_steps
+                self._data[i] = x
+                self._data[i + self.max_steps] = x
+        self.n_steps += steps
+
+    def extend(self, xs):
+        """Record the data ``xs[k]`` for each of the next ``len(xs)`` steps."""
+        steps = len(xs)
+        if self.max_steps is None:
+            self.reserve(steps)
+            self._data[self.n_steps:self.n_steps + steps] = xs
+            self.n_steps += steps
+        else:
+            # steps that would be overwritten are skipped
+            skip = max(steps - self.max_steps, 0)
+            self.n_steps += skip
+            for x in xs[skip:]:
+                i = self.n_steps % self.max_steps
+                self._data[i] = x
+                self._data[i + self.max_steps] = x
+                self.n_steps += 1
+
+    def view(self, start=None):
+        """A read-only view of the recorded data.
+
+        Parameters
+        ----------
+        start : int, optional (Default: None)
+            The index of the first step to return. If None, all kept steps
+            are returned.
+        """
+        first_step = self.first_step
+        start = first_step if start is None else start
+        if start < first_step:
+            raise SimulationError(
+                "Probe data before step %d has been discarded (requested "
+                "step %d)" % (first_step, start))
+
+        i0 = (self.n_steps % self.max_steps
+              if self.max_steps is not None and self.n_steps > self.max_steps
+              else 0)
+        x = self._data[i0 + start - first_step:i0 + len(self)]
+        x.setflags(write=False)
+        return x
+
+    def get_state(self):
+        """The memory holding the kept steps, to be restored with
+        `.set_state` (not a copy)."""
+        return (self._data if self.max_steps is not None else
+                self._data[:self.n_steps])
+
+    def set_state(self, data, n_steps):
+        """Restore the memory returned by `.get_state` after ``n_steps``
+        steps had been recorded.
+
+        ``data`` is used as the memory of the buffer without copying it,
+        so it can be a (copy-on-write) memory-mapped array that is only
+        read as needed.
+        """
+        capacity = n_steps if self.max_steps is None else 2 * self.max_steps
+        if data.shape != (capacity,) + self.shape or data.dtype != self.dtype:
+            raise SimulationError("Probe data does not match the buffer")
+        self._data = data
+        self.n_steps = n_steps
+
+
+class PackedProbeBuffer(ProbeBuffer):
+    """A `.ProbeBuffer` for boolean data, such as spikes, stored as bits.
+
+    Each step is packed along its last axis with ``np.packbits``, taking
+    an eighth of the memory of a boolean array. Data is unpacked when
+    read, so `.view` returns a copy rather than a view.
+
+    Parameters
+    ----------
+    shape : tuple
+        The shape of the (unpacked) data recorded on each step.
+    max_steps : int, optional (Default: None)
+        The maximum number of steps to keep. If None, all steps are kept.
+    """
+
+    def __init__(self, shape, max_steps=None):
+        shape = tuple(shape)
+        self.n_bits = shape[-1]
+        super(PackedProbeBuffer, self).__init__(
+            shape[:-1] + ((self.n_bits + 7) // 8,), dtype=np.uint8,
+            max_steps=max_steps)
+
+    def append(self, x, steps=1):
+        super(PackedProbeBuffer, self).append(
+            np.packbits(x, axis=-1), steps=steps)
+
+    def extend(self, xs):
+        super(PackedProbeBuffer, self).extend(np.packbits(xs, axis=-1))
+
+    def view(self, start=None):
+        x = super(PackedProbeBuffer, self).view(start=start)
+        return np.unpackbits(x, axis=-1)[..., :self.n_bits].astype(bool)
+
+
+class DiskProbeBuffer(ProbeBuffer):
+    """A `.ProbeBuffer` that keeps the recorded data in a file on disk.
+
+    Steps are collected in memory, and appended to the file at ``path``
+    once ``chunk_steps`` steps have been collected or when the data is
+    read; many steps recorded at once are written in whole chunks without
+    being collected, so that at most ``chunk_steps`` steps are in memory.
+    The file holds the steps as raw data in C order, since the header of a
+    ``.npy`` file could not grow with it. `.view` returns a
+    read-only memory-mapped view of the file, which is only read from disk
+    as it is used, so that memory use does not grow with the number of
+    steps. All steps are kept.
+
+    Parameters
+    ----------
+    shape : tuple
+        The shape of the data recorded on each step.
+    path : str
+        The file to keep the data in. Any existing file is replaced.
+    dtype : np.dtype, optional (Default: np.float32)
+        The data type of the recorded data.
+    chunk_steps : int, optional (Default: 1024)
+        The number of steps collected in memory before they are written.
+    """
+
+    def __init__(self, shape, path, dtype=np.float32, chunk_steps=1024):
+        super(DiskProbeBuffer, self).__init__(shape, dtype=dtype)
+        self.path = path
+        self.chunk_steps = chunk_steps
+        self._chunk = ProbeBuffer(self.shape, dtype=self.dtype)
+        self._chunk.reserve(chunk_steps)  # it never grows past this
+        self._map = None
+        self.clear()
+
+    def clear(self):
+        """Discard all recorded steps, emptying the file."""
+        self._chunk.clear()
+        self._map = None
+        self.n_steps = 0
+        # the file is replaced rather than truncated, so that views of the
+        # discarded steps stay valid
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        open(self.path, 'wb').close()
+
+    def _write(self, xs):
+        """Append the steps ``xs`` to the file."""
+        with open(self.path, 'ab') as f:
+            np.ascontiguousarray(xs, dtype=self.dtype).tofile(f)
+
+    def flush(self):
+        """Write the steps collected in memory to the file."""
+        if self._chunk.n_steps > 0:
+            self._write(self._chunk.view())
+            self._chunk.clear()
+
+    def reserve(self, steps):
+        """Does nothing, since the memory for a chunk is allocated up
+        front."""
+
+    def append(self, x, steps=1):
+        """Record the data ``x`` for each of the next ``steps`` steps."""
+        while steps > 0:
+            n = min(steps, self.chunk_steps - self._chunk.n_steps)
+            self._chunk.append(x, n)
+            self.n_steps += n
+            steps -= n
+            if self._chunk.n_steps >= self.chunk_steps:
+                self.flush()
+
+    def extend(self, xs):
+        """Record the data ``xs[k]`` for each of the next ``len(xs)`` steps."""
+        i = 0
+        while i < len(xs):
+            n = min(len(xs) - i, self.chunk_steps - self._chunk.n_steps)
+            if n == self.chunk_steps:
+                self._write(xs[i:i + n])  # a whole chunk, written as is
+            else:
+                self._chunk.extend(xs[i:i + n])
+                if self._chunk.n_steps >= self.chunk_steps:
+                    self.flush()
+            self.n_steps += n
+            i += n
+
+    def view(self, start=None):
+        """A read-only memory-mapped view of the recorded data.
+
+        Parameters
+        ----------
+        start : int, optional (Default: None)
+            The index of the first step to return. If None, all steps are
+            returned.
+        """
+        self.flush()
+        if self._map is None or len(self._map) != self.n_steps:
+            shape = (self.n_steps,) + self.shape
+            if np.prod(shape) * self.dtype.itemsize == 0:
+                # empty files cannot be mapped
+                self._map = np.zeros(shape, dtype=self.dtype)
+                self._map.setflags(write=False)
+            else:
+                self._map = np.memmap(
+                    self.path, dtype=self.dtype, mode='r', shape=shape)
+        return self._map[start:]
+
+    def get_state(self):
+        """The recorded steps (a memory-mapped view of the file), to be
+        restored with `.set_state`."""
+        return self.view()
+
+    def set_state(self, data, n_steps):
+        """Restore the steps returned by `.get_state` after ``n_steps``
+        steps had been recorded, by writing them to the file.
+
+        The file is replaced rather than overwritten, so ``data`` may be
+        mapped from it.
+        """
+        if (data.shape != (n_steps,) + self.shape
+                or data.dtype != self.dtype):
+            raise SimulationError("Probe data does not match the buffer")
+        tmp_path = self.path + '.tmp'
+        np.ascontiguousarray(data).tofile(tmp_path)
+        os.replace(tmp_path, self.path)
+        self._chunk.clear()
+        self._map = None
+        self.n_steps = n_steps
+
+
+class ProbeFiles(object):
+    """The files in which probes keep their data on disk.
+
+    Each key (e.g. a probe) is given its own file in ``directory``,
+    numbered in the order keys are first seen.
+
+    Parameters
+    ----------
+    directory : str or None
+        The directory for the files, which is created if needed. If None,
+        a temporary directory is created when the first file is needed,
+        and removed by `.close`.
+    prefix : str, optional (Default: 'probe')
+        The start of the name of each file.
+    """
+
+    def __init__(self, directory=None, prefix='probe'):
+        self.directory = directory
+        self.prefix = prefix
+        self.paths = {}
+        self._temporary = False
+
+    def path(self, key):
+        """The file for ``key``."""
+        if key not in self.paths:
+            if self.directory is None:
+                self.directory = tempfile.mkdtemp(prefix='nengo_loihi_')
+                self._temporary = True
+            elif not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+            self.paths[key] = os.path.join(self.directory, '%s%d.dat' % (
+                self.prefix, len(self.paths)))
+        return self.paths[key]
+
+    def close(self):
+        """Remove the directory, if it is temporary.
+
+        Data already mapped from its files stays valid on systems that
+        allow removing open files.
+        """
+        if self._temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+            self.paths = {}
+            self._temporary = False
+
+
+def sampled_steps(period, start, stop):
+    """Whether each of the steps after ``start``, up to ``stop``, is sampled
+    by a probe recording every ``period`` steps.
+
+    Steps are numbered from 1, and step ``i`` is sampled if
+    ``i % period < 1``, as in ``nengo.Simulator.trange``.
+
+    Parameters
+    ----------
+    period : float
+        The number of steps between samples (``sample_every / dt``).
+    start : int
+        The number of steps before the first step considered.
+    stop : int
+        The last step considered.
+
+    Returns
+    -------
+    sampled : (stop - start,) ndarray
+        Whether each step is sampled.
+    """
+    return np.arange(start + 1, stop + 1) % period < 1
+
+
+class ProbeFilter(object):
+    """Filters the output of a probe with its synapse, one step at a time,
+    and keeps the sampled steps.
+
+    The kept steps are stored in a `.ProbeBuffer`, so that each step is
+    only filtered once, however often the output is read. Steps are
+    filtered before they are sampled, so that samples are the same as
+    those of the filtered output on every step.
+
+    Parameters
+    ----------
+    synapse : nengo.synapses.Synapse or None
+        The synapse to filter with. If None, steps are only sampled.
+    shape : tuple
+        The shape of the output on each step.
+    dtype : np.dtype
+        The data type of the output.
+    dt : float
+        The length of a timestep, in seconds.
+    max_steps : int, optional (Default: None)
+        The maximum number of kept steps to keep (see `.ProbeBuffer`).
+    sample_every : float, optional (Default: None)
+        The time between samples, in seconds (see `.sampled_steps`).
+        If None, every step is kept.
+    path : str, optional (Default: None)
+        A file in which to keep the kept steps (see `.DiskProbeBuffer`).
+        If None, they are kept in memory.
+
+    Attributes
+    ----------
+    n_steps : int
+        The number of steps filtered so far, including those not kept.
+    """
+
+    def __init__(self, synapse, shape, dtype, dt, max_steps=None,
+                 sample_every=None, path=None):
+        self.synapse = synapse
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.dt = dt
+        self.period = None if sample_every is None else sample_every / dt
+        self.buffer = (
+            ProbeBuffer(shape, dtype=dtype, max_steps=max_steps)
+            if path is None else DiskProbeBuffer(shape, path, dtype=dtype))
+        self.clear()
+
+    def clear(self):
+        """Discard all steps, and reset the state of the synapse."""
+        self.step = (None if self.synapse is None else self.synapse.make_step(
+            self.shape, self.shape, self.dt, None, dtype=self.dtype))
+        self.n_steps = 0
+        self.buffer.clear()
+
+    def _sampled(self, steps):
+        """Index of the next ``steps`` steps that are kept."""
+        return (slice(None) if self.period is None else
+                sampled_steps(self.period, self.n_steps, self.n_steps + steps))
+
+    def _output(self, xs):
+        """The output of the steps ``xs`` (by default, ``xs`` itself)."""
+        return xs
+
+    def reserve(self, steps):
+        """Make sure there is room to keep the next ``steps`` steps."""
+        self.buffer.reserve(
+            steps if self.period is None else
+            np.count_nonzero(self._sampled(steps)))
+
+    def append(self, x, steps=1):
+        """Filter the data ``x`` for each of the next ``steps`` steps."""
+        if self.step is not None:
+            self.extend(np.broadcast_to(x, (steps,) + np.shape(x)))
+            return
+
+        n_kept = (steps if self.period is None else
+                  np.count_nonzero(self._sampled(steps)))
+        if n_kept > 0:
+            self.buffer.append(self._output(np.asarray(x)[None])[0], n_kept)
+        self.n_steps += steps
+
+    def extend(self, xs):
+        """Filter the steps ``xs``, which follow those filtered so far."""
+        sampled = self._sampled(len(xs))
+        if self.step is None:
+            self.buffer.extend(self._output(xs[sampled]))
+        else:
+            xs = self._output(xs)
+            filtered = np.zeros(xs.shape, dtype=self.dtype)
+            for k, x in enumerate(xs):
+                filtered[k] = self.step((self.n_steps + k) * self.dt, x)
+            self.buffer.extend(filtered[sampled])
+        self.n_steps += len(xs)
+
+
+class SampledProbeBuffer(ProbeFilter):
+    """Records the output of a probe with ``sample_every`` on its sampled
+    steps only.
+
+    Used by the emulator in place of a `.ProbeBuffer`, so that memory use
+    is proportional to the number of samples rather than the number of
+    steps. If the probe has a synapse, its weights and synapse are applied
+    to each step as it is recorded, and the filtered output of the sampled
+    steps is kept. Otherwise, the probed data of the sampled steps is kept
+    as is, and weights are applied when it is read.
+
+    Parameters
+    ----------
+    probe : CxProbe
+        The probe, whose ``sample_every`` is not None.
+    shape : tuple
+        The shape of the probed data on each step.
+    dtype : np.dtype
+        The data type of the probed data.
+    dt : float
+        The length of a timestep, in seconds.
+    max_steps : int, optional (Default: None)
+        The maximum number of samples to keep (see `.ProbeBuffer`).
+    path : str, optional (Default: None)
+        A file in which to keep the samples (see `.DiskProbeBuffer`).
+        If None, they are kept in memory.
+    """
+
+    def __init__(self, probe, shape, dtype, dt, max_steps=None, path=None):
+        assert probe.sample_every is not None
+        self.filtered = probe.synapse is not None
+        self.weights = probe.weights
+        self.max_steps = max_steps
+        x = self._output(np.zeros((0,) + tuple(shape), dtype=dtype))
+        super(SampledProbeBuffer, self).__init__(
+            probe.synapse, x.shape[1:], x.dtype, dt, max_steps=max_steps,
+            sample_every=probe.sample_every, path=path)
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def _output(self, xs):
+        if not self.filtered:
+            return xs
+        xs = xs if xs.dtype == np.float32 else xs.astype(np.float32)
+        return xs if self.weights is None else np.dot(xs, self.weights)
+
+    def view(self, start=None):
+        """A read-only view of the kept samples (see `.ProbeBuffer.view`)."""
+        return self.buffer.view(start=start)
+
+    def get_state(self):
+        """The memory holding the kept samples (see `.ProbeBuffer`)."""
+        return self.buffer.get_state()
+
+    def set_state(self, data, n_steps):
+        """Restore the memory returned by `.get_state` after ``n_steps``
+        steps had been recorded.
+
+        The state of the synapse is not restored, and must be set
+        separately (as ``step``).
+        """
+        self.buffer.set_state(data, np.count_nonzero(
+            sampled_steps(self.period, 0, n_steps)))
+        self.n_steps = n_steps
+
+
+def filtered_probe_output(probe_filters, cx_probe, output, dt, start=None,
+                          max_steps=None, path=None):
+    """The output of ``cx_probe`` from step ``start``, filtered by its
+    synapse and sampled every ``sample_every`` if it has them.
+
+    Parameters
+    ----------
+    probe_filters : dict
+        The `.ProbeFilter` of each probe filtered so far, which is added to
+        if needed.
+    cx_probe : CxProbe
+        The probe.
+    output : callable
+        ``output(cx_probe, start)`` returns the unfiltered output on every
+        step from step ``start`` on, or all kept steps if ``start`` is None.
+    dt : float
+        The length of a timestep, in seconds.
+    start : int, optional (Default: None)
+        The first kept step to return. If None, all kept steps are
+        returned.
+    max_steps : int, optional (Default: None)
+        The maximum number of filtered steps to keep.
+    path : str, optional (Default: None)
+        A file in which to keep the filtered steps (see `.DiskProbeBuffer`).
+        If None, they are kept in memory.
+    """
+    probe_filter = probe_filters.get(cx_probe)
+    if cx_probe.synapse is None and cx_probe.sample_every is None:
+        return output(cx_probe, start)
+
+    # only filter the steps that have not been filtered yet
+    x = output(cx_probe, 0 if probe_filter is None else probe_filter.n_steps)
+    if probe_filter is None:
+        if len(x) == 0:
+            return x  # the shape of the output may not be known yet
+        probe_filter = probe_filters[cx_probe] = ProbeFilter(
+            cx_probe.synapse, x.shape[1:], x.dtype, dt, max_steps=max_steps,
+            sample_every=cx_probe.sample_every, path=path)
+    probe_filter.extend(x)
+    return probe_filter.buffer.view(start)
+
+
+class NoiseGenerator(object):
+    """Random draws for noise, generated in blocks covering many steps.
+
+    The values for each step are those of several independent streams,
+    each drawn by its own `numpy.random.RandomState` seeded with ``seed``
+    and the key of the stream, so the values of a stream do not depend on
+    the other streams. RandomState gives the same values for a given seed
+    in all versions of NumPy, and the values do not depend on the block
+    size.
+
+    Parameters
+    ----------
+    seed : int
+        Seed for the random number generators.
+    streams : list of (int, int)
+        The key and the number of values drawn per step of each stream.
+    integer : bool
+        Whether to draw integers in ``[-128, 128)`` (for discretized
+        models) rather than floats in ``[-1, 1)``.
+    block_size : int, optional (Default: 2**16)
+        The approximate number of values generated at once.
+    """
+
+    def __init__(self, seed, streams, integer, block_size=2**16):
+        self.rngs = [np.random.RandomState([seed, key]) for key, _ in streams]
+        self.sizes = [n for _, n in streams]
+        self.integer = integer
+
+        self.n = sum(self.sizes)
+        self.block_steps = max(block_size // max(self.n, 1), 1)
+        self._block = np.zeros((0, self.n))
+        self._i = 0
+
+    def _draw(self, rng, n):
+        size = (self.block_steps, n)
+        return (rng.randint(-128, 128, size=size) if self.integer else
+                rng.uniform(-1, 1, size=size))
+
+    def _next_block(self):
+        blocks = [self._draw(rng, n) for rng, n in zip(self.rngs, self.sizes)]
+        self._block = (np.concatenate(blocks, axis=1) if len(blocks) > 0
+                       else np.zeros((self.block_steps, 0)))
+        self._i = 0
+
+    def next(self):
+        """The values for the next step."""
+        if self._i == len(self._block):
+            self._next_block()
+        self._i += 1
+        return self._block[self._i - 1]
+
+    def next_steps(self, steps):
+        """The values for the next ``steps`` steps, as an array with a
+        leading step axis."""
+        values = [self._block[:0]]
+        while steps > 0:
+            if self._i == len(self._block):
+                self._next_block()
+            n = min(steps, len(self._block) - self._i)
+            values.append(self._block[self._i:self._i + n])
+            self._i += n
+            steps -= n
+        return np.concatenate(values)
+
+    def get_state(self):
+        """The state of the generator, to be restored with `.set_state`."""
+        return [rng.get_state() for rng in self.rngs], self._block, self._i
+
+    def set_state(self, state):
+        """Restore the state returned by `.get_state`."""
+        rng_states, self._block, self._i = state
+        for rng, rng_state in zip(self.rngs, rng_states):
+            rng.set_state(rng_state)
+
+
 class CxSpikeInput(object):
     def __init__(self, n):
         self.n = n
         self.spikes = {}  # map sim timestep index to list of spike inds
+        self.trial_spikes = {}  # map sim timestep index to {trial: inds}
         self.axons = []
         self.probes = []
 
@@ -676,15 +1915,26 @@ class CxSpikeInput(object):
         assert probe.target is self
         self.probes.append(probe)
 
-    def add_spikes(self, ti, spike_idxs):
+    def add_spikes(self, ti, spike_idxs, trial=None):
+        """Add spikes at timestep ``ti``.
+
+        If ``trial`` is given, the spikes only go to that trial of a
+        trial-batched `.CxSimulator`; otherwise they go to all trials.
+        """
         assert is_integer(ti)
         ti = int(ti)
         assert ti > 0, "Spike times must be >= 1 (got %d)" % ti
-        assert ti not in self.spikes
-        self.spikes[ti] = spike_idxs
+        if trial is None:
+            assert ti not in self.spikes
+            self.spikes[ti] = spike_idxs
+        else:
+            trial_spikes = self.trial_spikes.setdefault(ti, {})
+            assert trial not in trial_spikes
+            trial_spikes[int(trial)] = spike_idxs
 
     def clear_spikes(self):
         self.spikes.clear()
+        self.trial_spikes.clear()
 
     def spike_times(self):
         return sorted(self.spikes)
@@ -692,6 +1942,66 @@ class CxSpikeInput(object):
     def spike_idxs(self, ti):
         return self.spikes.get(ti, [])
 
+    def trial_spike_idxs(self, ti, n_trials):
+        """The spikes at timestep ``ti`` for each of ``n_trials`` trials.
+
+        Returns
+        -------
+        trials : (m,) ndarray
+            The trial of each spike.
+        spike_idxs : (m,) ndarray
+            The index of the spiking input for each spike.
+        """
+        idxs = np.asarray(self.spike_idxs(ti), dtype=np.int32)
+        trials = [np.repeat(np.arange(n_trials, dtype=np.int32), len(idxs))]
+        spike_idxs = [np.tile(idxs, n_trials)]
+        for trial, idxs in sorted(self.trial_spikes.get(ti, {}).items()):
+            assert trial < n_trials, "Spikes for trial %d of %d" % (
+                trial, n_trials)
+            idxs = np.asarray(idxs, dtype=np.int32)
+            trials.append(np.full(len(idxs), trial, dtype=np.int32))
+            spike_idxs.append(idxs)
+        return np.concatenate(trials), np.concatenate(spike_idxs)
+
+    def trial_spike_steps(self, t0, t1, n_trials):
+        """The spikes at timesteps ``t0 <= ti < t1`` for each of
+        ``n_trials`` trials.
+
+        Like `.trial_spike_idxs` for all of these timesteps at once, with
+        the spikes of each timestep in the same order.
+
+        Returns
+        -------
+        steps : (m,) ndarray
+            The timestep of each spike, relative to ``t0``.
+        trials : (m,) ndarray
+            The trial of each spike.
+        spike_idxs : (m,) ndarray
+            The index of the spiking input for each spike.
+        """
+        times = sorted(ti for ti in self.spikes if t0 <= ti < t1)
+        idxs = [np.asarray(self.spikes[ti], dtype=np.int32) for ti in times]
+        steps = np.repeat(np.array(times, dtype=np.int32) - t0,
+                          [len(x) for x in idxs]).astype(np.int32)
+        idxs = np.concatenate(idxs + [np.zeros(0, dtype=np.int32)])
+        spikes = [(np.tile(steps, n_trials),
+                   np.repeat(np.arange(n_trials, dtype=np.int32), len(idxs)),
+                   np.tile(idxs, n_trials))]
+
+        for ti in sorted(ti for ti in self.trial_spikes if t0 <= ti < t1):
+            for trial, idxs in sorted(self.trial_spikes[ti].items()):
+                assert trial < n_trials, "Spikes for trial %d of %d" % (
+                    trial, n_trials)
+                idxs = np.asarray(idxs, dtype=np.int32)
+                spikes.append((np.full(len(idxs), ti - t0, dtype=np.int32),
+                               np.full(len(idxs), trial, dtype=np.int32),
+                               idxs))
+
+        # order by timestep, keeping the order within each timestep
+        steps, trials, idxs = concat_spikes(spikes, n_arrays=3)
+        order = np.argsort(steps, kind='mergesort')
+        return steps[order], trials[order], idxs[order]
+
 
 class CxModel(object):
 
@@ -712,17 +2022,57 @@ class CxModel(object):
         assert group not in self.cx_groups
         self.cx_groups[group] = len(self.cx_groups)
 
+    @property
+    def cx_probes(self):
+        """The probes of all inputs and then all groups, in order."""
+        return [probe for obj in list(self.cx_inputs) + list(self.cx_groups)
+                for probe in obj.probes]
+
     def discretize(self):
         for group in self.cx_groups:
             group.discretize()
+        self.share_weights()
 
-    def validate(self):
+    def share_weights(self):
+        """Share one read-only array between identical weight, index and
+        delay arrays of all synapses (see `.share_arrays`).
+
+        Many synapses, e.g. those of the ensembles of an ``EnsembleArray``,
+        have identical weights, which then only use memory once in the
+        model and in the emulator (see `.SynapseTable`).
+
+        Returns
+        -------
+        n_bytes : int
+            The number of bytes by which the arrays were reduced.
+        """
+        shared = {}
+        n_bytes = {}  # of the original arrays, by id
+        for group in self.cx_groups:
+            for synapses in group.synapses:
+                for attr in ('weights', 'indices', 'delays'):
+                    arrays = getattr(synapses, attr)
+                    if arrays is None:
+                        continue
+                    n_bytes.update((id(x), x.nbytes) for x in arrays)
+                    setattr(synapses, attr, share_arrays(arrays, shared))
+        return sum(n_bytes.values()) - sum(x.nbytes for x in shared.values())
+
+    def validate(self, hardware_limits=True):
+        """Check that the model is valid.
+
+        Parameters
+        ----------
+        hardware_limits : bool, optional (Default: True)
+            Whether to check that each group fits on a Loihi core (see
+            `.CxGroup.validate`).
+        """
         if len(self.cx_groups) == 0:
             raise BuildError("No neurons marked for execution on-chip. "
                              "Please mark some ensembles as on-chip.")
 
         for group in self.cx_groups:
-            group.validate()
+            group.validate(hardware_limits=hardware_limits)
 
 
 class CxSimulator(object):
@@ -734,18 +2084,125 @@ class CxSimulator(object):
         Model specification that will be simulated.
     seed : int, optional (Default: None)
         A seed for all stochastic operations done in this simulator.
+    max_probe_steps : int, optional (Default: None)
+        The maximum number of steps of probe data to keep. If given, probes
+        only keep the most recent ``max_probe_steps`` steps, so that memory
+        use does not grow with the length of the run. If None, all steps
+        are kept.
+    n_trials : int, optional (Default: None)
+        The number of independent trials of the model to simulate at once.
+        All state has a leading trial axis, and trial ``k`` uses the seed
+        ``seed + k`` for its noise (see `.NoiseGenerator`), so trial 0
+        matches an unbatched simulation with the same seed. Spikes added
+        to inputs go to all trials unless a ``trial`` is given. Probe
+        outputs have shape ``(n_trials, n_steps, n)``. Learning is not
+        supported. If None, a single trial is simulated and probe outputs
+        have no trial axis.
+    packed_spikes : bool, optional (Default: False)
+        Whether to store the data of spike probes as packed bits (see
+        `.PackedProbeBuffer`), rather than one byte per compartment. This
+        makes reading the data slower.
+    event_driven : bool, optional (Default: False)
+        Whether to only update groups that are not at rest. A group is at
+        rest if its input, current, voltage and refractory state are all
+        zero, it did not spike, and it has no bias or noise; updating it
+        would not change its state. When all groups are at rest and no
+        learning is used, `.run_steps` skips ahead to the next input
+        spike. Results are identical to updating all groups every step.
+    check_overflow : bool, optional (Default: True)
+        Whether to emulate the overflow of compartment input (``q0``) and
+        current (``U`` and ``u2``) in discretized models. Overflowed
+        values are wrapped as on the chip and counted per group and stage
+        (see `.overflow_report`); the first overflow of each is also
+        reported as an error (see `.error`). If False, overflow is not
+        checked at all, which is faster but only gives the same results
+        for models that do not overflow.
+    engine : str, optional (Default: None)
+        How to run the model: ``'numpy'`` for NumPy operations on each
+        step, or ``'numba'`` to compile the loop over all steps with Numba
+        (see `.JitEngine`), which gives the same results. If None,
+        ``'numba'`` is used if Numba is installed and supports the model.
+        Only `.run_steps` uses the compiled loop; it does not support
+        learning, event-driven updates or models that are not discretized,
+        and does not count deliveries for `.delivery_report`.
+    reorder : bool, optional (Default: False)
+        Whether to store the compartments of each group in an order in
+        which the targets of each axon are close together in memory (see
+        `.locality_order`), which can make delivering spikes to large
+        groups with scattered targets faster. Probe outputs and the spikes
+        sent by each group use the original order, so results are the
+        same; only state arrays (such as ``u`` and ``v``) are reordered.
+    hardware_limits : bool, optional (Default: True)
+        Whether to check that the model fits on Loihi, e.g. that each group
+        fits on one core (see `.CxModel.validate`). If False, models of any
+        size can be emulated, with the same discretization as on the chip.
+    fuse : bool, optional (Default: False)
+        Whether to deliver the spikes of all synapses with one table, with
+        a row for each compartment and input that sends spikes (see
+        `.SynapseTable.from_sources`), rather than mapping the spikes of
+        each group through its axons and delivering them to each synapses
+        separately. The Python work on each step then does not grow with
+        the number of groups, which is faster for models with many small
+        groups; results are the same. Only discretized models that are not
+        event-driven are fused. Learning synapses, and those whose weights
+        would take more than ``fuse_ratio`` times as much memory when
+        stored for each source (e.g. weights shared by many axons), are
+        delivered separately. Fused synapses are not counted by
+        `.delivery_report`.
+    probe_dir : str, optional (Default: None)
+        The directory in which probes with ``on_disk`` keep their data
+        (see `.DiskProbeBuffer`), so that memory use does not grow with
+        the length of the run. These probes keep all steps, regardless of
+        ``max_probe_steps``. If None, a temporary directory is used, which
+        is removed by `.close`.
+
+    Notes
+    -----
+    If the groups form no cycles, no learning is used and ``event_driven``
+    is False, `.run_steps` simulates the groups layer by layer: each layer
+    is run for up to ``max_layer_steps`` steps before the next, so that
+    the input to each group can be computed for all of those steps at once
+    from the spikes of the previous layers (fewer steps are run for large
+    groups, so that at most ``max_layer_size`` input values are buffered
+    for each). Results are the same as those
+    of running one step at a time. Since this is only faster for some
+    models (e.g. those with few layers and many spikes), the first steps
+    are timed with both schedules, and the faster one is used.
     """
 
     strict = False
-
-    def __init__(self, model, seed=None):
+    overflow_stages = ('q0', 'U', 'u2')
+    max_layer_steps = 256
+    max_layer_size = 2**24  # the most values per input buffered per layer
+    # synapses are only fused if their table grows at most this much, plus
+    # `SynapseTable.dense_offset` weights (see ``fuse``)
+    fuse_ratio = 4
+
+    def __init__(self, model, seed=None, max_probe_steps=None,
+                 n_trials=None, packed_spikes=False, event_driven=False,
+                 check_overflow=True, engine=None, reorder=False,
+                 hardware_limits=True, fuse=False, probe_dir=None):
+        if engine not in (None, 'numpy', 'numba'):
+            raise BuildError("Unrecognized engine %r" % (engine,))
+        if engine == 'numba' and numba is None:
+            raise BuildError("The 'numba' engine requires Numba")
+        self.engine = engine
+        self.reorder = reorder
+        self.fuse = fuse
+        self.hardware_limits = hardware_limits
         self.closed = False
+        self.check_overflow = check_overflow
+        self.max_probe_steps = max_probe_steps
+        self.packed_spikes = packed_spikes
+        self.event_driven = event_driven
+        assert n_trials is None or n_trials >= 1
+        self.n_trials = n_trials
+        self.probe_files = ProbeFiles(probe_dir, prefix='cx_probe')
 
         self.build(model, seed=seed)
 
         self._chip2host_sent_steps = 0
         self._probe_filters = {}
-        self._probe_filter_pos = {}
 
     def __enter__(self):
         return self
@@ -762,14 +2219,14 @@ class CxSimulator(object):
 
     def build(self, model, seed=None):  # noqa: C901
         """Set up NumPy arrays to emulate chip memory and I/O."""
-        model.validate()
+        model.validate(hardware_limits=self.hardware_limits)
 
         if seed is None:
             seed = np.random.randint(2**31 - 1)
 
         logger.debug("CxSimulator seed: %d", seed)
         self.seed = seed
-        self.rng = np.random.RandomState(seed)
+        n_trials = 1 if self.n_trials is None else self.n_trials
 
         self.t = 0
 
@@ -780,7 +2237,8 @@ class CxSimulator(object):
         self.probe_outputs = {}
         for obj in self.inputs + self.groups:
             for probe in obj.probes:
-                self.probe_outputs[probe] = []
+                self.probe_outputs[probe] = self._probe_buffer(
+                    probe, obj, n_trials)
 
         self.n_cx = sum(group.n for group in self.groups)
         self.group_cxs = {}
@@ -806,13 +2264,28 @@ class CxSimulator(object):
 
         logger.debug("CxSimulator dtype: %s", group_dtype)
 
-        MAX_DELAY = 1  # don't do delay yet
-        self.q = np.zeros((MAX_DELAY, self.n_cx), dtype=group_dtype)
-        self.u = np.zeros(self.n_cx, dtype=group_dtype)
-        self.v = np.zeros(self.n_cx, dtype=group_dtype)
-        self.s = np.zeros(self.n_cx, dtype=bool)  # spiked
-        self.c = np.zeros(self.n_cx, dtype=np.int32)  # spike counter
-        self.w = np.zeros(self.n_cx, dtype=np.int32)  # ref period counter
+        if self.n_trials is not None and any(
+                synapses.tracing for group in self.groups
+                for synapses in group.synapses):
+            raise BuildError("Learning is not supported with multiple trials")
+
+        # state has a leading trial axis (of length 1 if not batched)
+        shape = (n_trials, self.n_cx)
+        # input accumulators are a ring buffer over delays (see `step`)
+        n_delays = 1 + max([synapses.max_delay() for group in self.groups
+                            for synapses in group.synapses] + [0])
+        self.q = np.zeros((n_delays,) + shape, dtype=group_dtype)
+        self.u = np.zeros(shape, dtype=group_dtype)
+        self.v = np.zeros(shape, dtype=group_dtype)
+        self.s = np.zeros(shape, dtype=bool)  # spiked
+        self.c = np.zeros(shape, dtype=np.int32)  # spike counter
+
+        # ref period counter, with the smallest type that fits the delays
+        # (on the chip, delays are at most `.CxProfile.REFRACT_DELAY_MAX`)
+        max_ref = max(group.refractDelay.max() for group in self.groups)
+        ref_dtype = next(dtype for dtype in (np.int8, np.int16, np.int32)
+                         if max_ref <= np.iinfo(dtype).max)
+        self.w = np.zeros(shape, dtype=ref_dtype)
 
         # --- allocate group parameters
         self.decayU = np.hstack([group.decayU for group in self.groups])
@@ -824,81 +2297,581 @@ class CxSimulator(object):
             group.decayV if group.scaleV else np.ones_like(group.decayV)
             for group in self.groups])
 
-        def decay_float(x, u, d, s):
-            return (1 - d)*x + s*u
-
-        def decay_int(x, u, d, s, a=12, b=0):
-            r = (2**a - b - np.asarray(d)).astype(np.int64)
-            x = np.sign(x) * np.right_shift(np.abs(x) * r, a)  # round to zero
-            return x + u  # no scaling on u
+        # scratch memory for `_update`, so that steps do not allocate
+        self._u2 = np.zeros(shape, dtype=group_dtype)
+        self._mask = np.zeros(shape, dtype=bool)
 
         if group_dtype == np.int32:
             assert (self.scaleU == 1).all()
             assert (self.scaleV == 1).all()
-            self.decayU_fn = lambda x, u: decay_int(
-                x, u, d=self.decayU, s=self.scaleU, b=1)
-            self.decayV_fn = lambda x, u: decay_int(
-                x, u, d=self.decayV, s=self.scaleV)
-
-            def overflow(x, bits, name=None):
-                _, o = overflow_signed(x, bits=bits, out=x)
-                if np.any(o):
-                    self.error("Overflow" + (" in %s" % name if name else ""))
+            # Decay multipliers, which have 12 fractional bits. Products
+            # with them are exact in float64, and faster than in int64.
+            self._retainU = (2**12 - 1 - self.decayU) / 2.**12
+            self._retainV = (2**12 - self.decayV) / 2.**12
+            self._decay = self._decay_int
+            self._tmp = np.zeros(shape, dtype=np.float64)
         elif group_dtype == np.float32:
-            self.decayU_fn = lambda x, u: decay_float(
-                x, u, d=self.decayU, s=self.scaleU)
-            self.decayV_fn = lambda x, u: decay_float(
-                x, u, d=self.decayV, s=self.scaleV)
+            self._retainU = 1 - self.decayU
+            self._retainV = 1 - self.decayV
+            self._decay = self._decay_float
+            self._tmp = np.zeros(shape, dtype=np.float32)
 
-            def overflow(x, bits, name=None):
-                pass  # do not do overflow in floating point
-
-        self.overflow = overflow
+        # --- overflow (not done in floating point)
+        self._check_overflow = self.check_overflow and group_dtype == np.int32
+        self._group_starts = np.array(
+            [self.group_cxs[group].start for group in self.groups])
+        self._reset_overflow()
 
         ones = lambda n: np.ones(n, dtype=group_dtype)
+
+        def group_values(attr, groups=self.groups):
+            """Per-compartment values of the per-group scalar ``attr``.
+
+            If all ``groups`` have the same value, it is returned as a
+            single-element array that broadcasts over all compartments.
+            """
+            values = [getattr(group, attr) for group in groups]
+            if all(value == values[0] for value in values):
+                return values[0]*ones(1)
+            return np.hstack([value*ones(group.n)
+                              for value, group in zip(values, groups)])
+
         self.vth = np.hstack([group.vth for group in self.groups])
-        self.vmin = np.hstack([
-            group.vmin*ones(group.n) for group in self.groups])
-        self.vmax = np.hstack([
-            group.vmax*ones(group.n) for group in self.groups])
+        self.vmin = group_values('vmin').astype(group_dtype)
+        self.vmax = group_values('vmax').astype(group_dtype)
 
         self.bias = np.hstack([group.bias for group in self.groups])
-        self.ref = np.hstack([group.refractDelay for group in self.groups])
+        self.ref = np.hstack([
+            group.refractDelay for group in self.groups]).astype(ref_dtype)
 
         # --- allocate synapse memory
         self.axons_in = {synapses: [] for group in self.groups
                          for synapses in group.synapses}
+        shared_tables = {}
+        self.synapse_tables = {
+            synapses: SynapseTable(synapses, shared=shared_tables)
+            for group in self.groups for synapses in group.synapses}
         self.z = {synapses: np.zeros(synapses.n_axons, dtype=np.float64)
                   for group in self.groups for synapses in group.synapses
                   if synapses.tracing}  # synapse traces
 
+        # --- compartment order
+        self._cx_orders = {}  # the compartment at each position, by group
+        self._cx_positions = None  # the position of each compartment
+        self._probe_cxs = {}  # the positions of the probed compartments
+        if self.reorder:
+            self._reorder_cxs()
+
+        # dense weights sum in a different order, which is only exact for
+        # integer weights (see `.SynapseTable.deliver`)
+        self._allow_dense = group_dtype == np.int32
+
+        # the inputs or groups, and their axons, that target each synapses
+        self.synapse_sources = {synapses: [] for synapses in self.axons_in}
+        for obj in self.inputs + self.groups:
+            for axons in obj.axons:
+                if axons.target in self.synapse_sources:
+                    self.synapse_sources[axons.target].append((obj, axons))
+
+        # --- fused delivery
+        # the sources of spikes are the compartments, followed by the
+        # inputs (see `_source_synapses`)
+        self._input_starts = {}
+        self._n_sources = self.n_cx
+        for input in self.inputs:
+            self._input_starts[input] = self._n_sources
+            self._n_sources += input.n
+        self._fused_table = None
+        self._fused_synapses = set()
+        if self.fuse and self._allow_dense and not self.event_driven:
+            self._fuse_synapses()
+
+        # the axons that send spikes to synapses that are not fused, and
+        # the synapses to deliver them to, so that `step` only loops over
+        # those (and over objects with probes)
+        self._axons_out = {
+            obj: [axons for axons in obj.axons
+                  if axons.target in self.axons_in
+                  and axons.target not in self._fused_synapses]
+            for obj in self.inputs + self.groups}
+        self._axon_groups = [
+            group for group in self.groups if len(self._axons_out[group]) > 0]
+        self._step_synapses = [
+            synapses for group in self.groups for synapses in group.synapses
+            if synapses not in self._fused_synapses]
+        self._probed_inputs = [obj for obj in self.inputs if obj.probes]
+        self._probed_groups = [obj for obj in self.groups if obj.probes]
+
         # --- noise
         enableNoise = np.hstack([
             group.enableNoise*ones(group.n) for group in self.groups])
-        noiseExp0 = np.hstack([
-            group.noiseExp0*ones(group.n) for group in self.groups])
-        noiseMantOffset0 = np.hstack([
-            group.noiseMantOffset0*ones(group.n) for group in self.groups])
-        noiseTarget = np.hstack([
-            group.noiseAtDendOrVm*ones(group.n) for group in self.groups])
-        if group_dtype == np.int32:
+
+        # only draw noise for compartments that have it enabled
+        self.noise_cxs = enableNoise.nonzero()[0]
+        if self._cx_positions is not None:
+            self.noise_cxs = self._cx_positions[self.noise_cxs]
+        noise_groups = [group for group in self.groups
+                        if np.any(group.enableNoise)]
+
+        def noise_values(attr):
+            """Like ``group_values``, but only for the noise compartments."""
+            if len(noise_groups) == 0:
+                return ones(0)
+            x = group_values(attr, groups=noise_groups)
+            return x if len(x) == 1 else x[np.hstack([
+                group.enableNoise for group in noise_groups]).nonzero()[0]]
+
+        noiseExp0 = noise_values('noiseExp0')
+        noiseMantOffset0 = noise_values('noiseMantOffset0')
+        noiseTarget = np.broadcast_to(
+            noise_values('noiseAtDendOrVm'), len(self.noise_cxs))
+        self._noise_integer = integer = group_dtype == np.int32
+        self._reset_noise()
+        if integer:
             if np.any(noiseExp0 < 7):
                 warnings.warn("Noise amplitude falls below lower limit")
             noiseExp0[noiseExp0 < 7] = 7
-            noiseMult = np.where(enableNoise, 2**(noiseExp0 - 7), 0)
+            noiseMult = 2**(noiseExp0 - 7)
 
-            def noiseGen(n=self.n_cx, rng=self.rng):
-                x = rng.randint(-128, 128, size=n)
-                return (x + 64*noiseMantOffset0) * noiseMult
-        elif group_dtype == np.float32:
-            noiseMult = np.where(enableNoise, 10.**noiseExp0, 0)
+            def noiseGen(steps=None):
+                return ((self._noise_samples(steps) + 64*noiseMantOffset0)
+                        * noiseMult)
+        else:
+            noiseMult = 10.**noiseExp0
 
-            def noiseGen(n=self.n_cx, rng=self.rng):
-                x = rng.uniform(-1, 1, size=n)
-                return (x + noiseMantOffset0) * noiseMult
+            def noiseGen(steps=None):
+                return ((self._noise_samples(steps) + noiseMantOffset0)
+                        * noiseMult)
 
         self.noiseGen = noiseGen
-        self.noiseTarget = noiseTarget
+        self.noise_dend = (noiseTarget == 0).nonzero()[0]
+        self.noise_vm = (noiseTarget == 1).nonzero()[0]
+        # which compartments get noise on their input or voltage, and
+        # scratch memory for the noise of each compartment (see `_update`)
+        self._noise_at_dend = np.zeros(self.n_cx, dtype=bool)
+        self._noise_at_dend[self.noise_cxs[self.noise_dend]] = True
+        self._noise_at_vm = np.zeros(self.n_cx, dtype=bool)
+        self._noise_at_vm[self.noise_cxs[self.noise_vm]] = True
+        self._cx_noise = None
+
+        # --- event-driven updates
+        # groups that can never be at rest, since updating them changes
+        # their state even when it is zero
+        vmin = np.broadcast_to(self.vmin, self.n_cx)
+        vmax = np.broadcast_to(self.vmax, self.n_cx)
+        self._always_awake = np.array([
+            np.any(self.bias[sl] != 0) or np.any(enableNoise[sl])
+            or np.any(self.vth[sl] < 0)
+            or np.any(vmin[sl] > 0) or np.any(vmax[sl] < 0)
+            for sl in (self.group_cxs[group] for group in self.groups)])
+        self._group_idxs = {group: k for k, group in enumerate(self.groups)}
+        self._reset_awake()
+
+        # --- layer-wise schedule
+        self._layers = self._find_layers()
+        self._step_times = [None, None]  # stepwise and layer-wise
+        self._layer_step_size = n_trials * max(
+            group.n for group in self.groups)
+
+        # --- compiled engine
+        self._jit = None
+        if self.engine != 'numpy' and numba is not None:
+            reason = JitEngine.unsupported(self)
+            if reason is None:
+                self._jit = JitEngine(self)
+            elif self.engine == 'numba':
+                warnings.warn("Using the 'numpy' engine, since the 'numba' "
+                              "engine cannot run this model: %s" % reason)
+
+    def _reorder_cxs(self):
+        """Store the compartments of each group in `.locality_order`."""
+        order = np.arange(self.n_cx)
+        for group in self.groups:
+            group_order = locality_order(
+                group.n, [self.synapse_tables[synapses]
+                          for synapses in group.synapses])
+            if np.array_equal(group_order, np.arange(group.n)):
+                continue
+
+            self._cx_orders[group] = group_order
+            positions = np.argsort(group_order)
+            for synapses in group.synapses:
+                self.synapse_tables[synapses].set_target_map(positions)
+            for probe in group.probes:
+                self._probe_cxs[probe] = positions[
+                    np.arange(group.n)[probe.slice]]
+            order[self.group_cxs[group]] += group_order - np.arange(group.n)
+
+        self._cx_positions = np.argsort(order)
+        for attr in ('decayU', 'decayV', 'scaleU', 'scaleV', '_retainU',
+                     '_retainV', 'vth', 'vmin', 'vmax', 'bias', 'ref'):
+            x = getattr(self, attr)
+            if len(x) > 1:
+                setattr(self, attr, x[order])
+
+    def _fuse_synapses(self):
+        """Compile the synapses that can be fused into one table (see
+        ``fuse``)."""
+        sources = []
+        for synapses, objs in self.synapse_sources.items():
+            if synapses.tracing:
+                continue
+            table = self.synapse_tables[synapses]
+            x = [self._source_synapses(obj, axons) for obj, axons in objs]
+            n = sum(len(srcs) for srcs, _, _, _ in x)
+            if n <= self.fuse_ratio * len(table.weights) + table.dense_offset:
+                sources.extend(x)
+                self._fused_synapses.add(synapses)
+
+        if len(self._fused_synapses) > 0:
+            self._fused_table = self._source_table(sources)
+
+    def _source_table(self, sources):
+        """A `.SynapseTable.from_sources` of the given `._source_synapses`."""
+        sources = [(np.zeros(0, dtype=np.int64),) * 4] + list(sources)
+        return SynapseTable.from_sources(
+            self._n_sources, *(np.concatenate(x) for x in zip(*sources)))
+
+    def _source_synapses(self, obj, axons):
+        """The synapses reached by ``axons`` from each compartment of
+        ``obj``, as source, target compartment, weight and delay arrays.
+
+        Sources are the positions of the compartments in the simulator,
+        followed by the inputs (see ``_input_starts``). Synapses with zero
+        weights are left out.
+        """
+        table = self.synapse_tables[axons.target]
+        start = (self._input_starts[obj] if obj in self._input_starts
+                 else self.group_cxs[obj].start)
+        positions = np.arange(obj.n)
+        cx_idxs = self._original_cxs(obj, positions)
+        axon_ids = axons.map_cx_axons(cx_idxs)
+        valid = axon_ids >= 0
+        valid[valid] = table.axon_valid[axon_ids[valid]]
+        positions, cx_idxs = positions[valid], cx_idxs[valid]
+        axon_ids = axon_ids[valid]
+        atoms = axons.map_cx_atoms(cx_idxs)
+
+        ptrs, lengths, targets = table.gather(axon_ids, atoms)
+        srcs = np.repeat(start + positions, lengths)
+        targets = targets + self.group_cxs[axons.target.group].start
+        delays = (np.zeros(len(ptrs), dtype=np.int64)
+                  if table.delays is None else table.delays[ptrs])
+
+        # zero weights (e.g. in full weight matrices) add nothing
+        nonzero = table.weights[ptrs] != 0
+        return (srcs[nonzero], targets[nonzero], table.weights[ptrs][nonzero],
+                delays[nonzero])
+
+    def _original_cxs(self, group, cx_idxs):
+        """The indices in ``group`` of the compartments stored at the given
+        positions (see ``reorder``)."""
+        order = self._cx_orders.get(group)
+        return cx_idxs if order is None else order[cx_idxs]
+
+    def _find_layers(self):
+        """Split the groups into layers for the layer-wise schedule.
+
+        Returns
+        -------
+        layers : list of lists or None
+            The indices of the groups in each layer. Each group only
+            receives spikes from inputs and groups in earlier layers. None
+            if the groups form a cycle, or use learning or delays that the
+            layer-wise schedule cannot reproduce exactly.
+        """
+        if len(self.z) > 0:
+            return None  # learning needs errors from the host on each step
+        if self.u.dtype != np.int32 and any(
+                synapses.max_delay() > 0 for synapses in self.axons_in):
+            # floating-point input with delays would be summed in a
+            # different order, and round differently
+            return None
+
+        pre = {group: set(obj for synapses in group.synapses
+                          for obj, _ in self.synapse_sources[synapses]
+                          if obj in self._group_idxs)
+               for group in self.groups}
+        depths = {}
+        while len(depths) < len(self.groups):
+            ready = [group for group in self.groups if group not in depths
+                     and all(g in depths for g in pre[group])]
+            if len(ready) == 0:
+                return None
+            for group in ready:
+                depths[group] = 1 + max(
+                    [depths[g] for g in pre[group]] + [-1])
+
+        layers = [[] for _ in range(max(depths.values()) + 1)]
+        for k, group in enumerate(self.groups):
+            layers[depths[group]].append(k)
+        return layers
+
+    def _reset_overflow(self):
+        # overflowed values and first step with overflow, for each group
+        # and stage in `overflow_stages`
+        shape = (len(self.groups), len(self.overflow_stages))
+        self._overflow_counts = np.zeros(shape, dtype=np.int64)
+        self._overflow_steps = np.full(shape, -1, dtype=np.int64)
+
+    def overflow_report(self):
+        """The overflow that has occurred since the last build or reset.
+
+        Returns
+        -------
+        report : list of (group, stage, count, first_step)
+            For each group and stage (see ``overflow_stages``) with
+            overflow, the total number of values that overflowed (over
+            all compartments, trials and steps) and the first step on
+            which one did.
+        """
+        return [(self.groups[k], self.overflow_stages[i],
+                 int(self._overflow_counts[k, i]),
+                 int(self._overflow_steps[k, i]))
+                for k, i in zip(*self._overflow_counts.nonzero())]
+
+    def _overflow(self, x, bits, stage, i0):
+        """Wrap ``x`` to ``bits`` bits plus sign, and count any overflow.
+
+        ``x`` holds the state of the compartments starting at ``i0`` for
+        the stage with index ``stage`` in ``overflow_stages``. The first
+        overflow of each group and stage is reported with `.error`.
+        """
+        limit = 2**bits
+        if x.min() >= -limit and x.max() < limit:
+            return
+
+        _, overflowed = overflow_signed(x, bits=bits, out=x)
+        j0, j1 = np.searchsorted(
+            self._group_starts, [i0, i0 + x.shape[1]])
+        counts = np.add.reduceat(overflowed.sum(axis=0),
+                                 self._group_starts[j0:j1] - i0)
+        self._overflow_counts[j0:j1, stage] += counts
+
+        steps = self._overflow_steps[j0:j1, stage]
+        for k in ((counts > 0) & (steps < 0)).nonzero()[0]:
+            steps[k] = self.t
+            self.error("Overflow in %s of %s on step %d" % (
+                self.overflow_stages[stage], self.groups[j0 + k], self.t))
+
+    def delivery_report(self):
+        """How spikes have been delivered since the last build or reset.
+
+        Synapses of discretized models deliver spikes on each step either
+        by summing the weights of each spike, or by multiplying spike
+        counts by dense weights, whichever is expected to be faster (see
+        `.SynapseTable.deliver`).
+
+        Returns
+        -------
+        report : list of (group, synapses, n_sparse, n_dense)
+            For all synapses of each group, the number of steps on which
+            spikes were delivered by summing weights and by multiplying
+            dense weights.
+        """
+        return [(group, synapses, self.synapse_tables[synapses].n_sparse,
+                 self.synapse_tables[synapses].n_dense)
+                for group in self.groups for synapses in group.synapses]
+
+    def _reset_awake(self):
+        """Mark all groups that can be at rest as being at rest."""
+        # the last step on which each group must be updated
+        self._awake_until = np.where(
+            self._always_awake, np.iinfo(np.int64).max, 0)
+        self._input_times = None
+        self._input_times_key = None
+
+    def _reset_noise(self):
+        """Restart the noise for each trial from the simulator seed."""
+        self.noise_generators = [
+            NoiseGenerator((self.seed + k) % 2**32, self._noise_streams(),
+                           self._noise_integer)
+            for k in range(len(self.u))]
+
+    def reset(self, seed=None):
+        """Reset the simulator state, without rebuilding.
+
+        All compartment state, synapse traces, probe data and input spikes
+        are cleared, learned weights are restored to their built values,
+        and the noise is restarted.
+
+        Parameters
+        ----------
+        seed : int, optional (Default: None)
+            A new seed for the noise. If None, the current seed is reused,
+            so that the noise is the same as in the first run.
+        """
+        if seed is not None:
+            self.seed = seed
+        self.t = 0
+
+        for x in (self.q, self.u, self.v, self.s, self.c, self.w):
+            x[...] = 0
+        for z in self.z.values():
+            z[:] = 0
+        for table in self.synapse_tables.values():
+            if table.weight_matrix is not None:
+                table.reset_weights()
+            table.reset_stats()
+        if self._fused_table is not None:
+            self._fused_table.reset_stats()
+        for axons_in_spikes in self.axons_in.values():
+            axons_in_spikes.clear()
+
+        for input in self.inputs:
+            input.clear_spikes()
+        for probe_output in self.probe_outputs.values():
+            probe_output.clear()
+
+        self._chip2host_sent_steps = 0
+        self._probe_filters.clear()
+
+        self._reset_noise()
+        self._reset_awake()
+        self._reset_overflow()
+
+    def _state_layout(self):
+        """A description of the simulated model, to check that a state
+        given to `.set_state` was saved from the same model."""
+        return (self.n_trials, self.reorder, self.q.shape, self.w.dtype.str,
+                [group.n for group in self.groups],
+                [input.n for input in self.inputs],
+                [(buffer.shape, buffer.dtype.str, buffer.max_steps)
+                 for buffer in self.probe_outputs.values()])
+
+    def get_state(self):
+        """The simulation state, e.g. to save to a checkpoint.
+
+        This includes all compartment state, synapse traces and learned
+        weights, the state of the noise generators, input spikes, probe
+        data and probe filters. Arrays are not copied, so the state is only
+        valid until the simulation is advanced.
+
+        Returns
+        -------
+        state : dict
+            The state by name, to be restored with `.set_state`.
+        """
+        state = dict(
+            layout=self._state_layout(),
+            t=self.t,
+            seed=self.seed,
+            q=self.q, u=self.u, v=self.v, s=self.s, c=self.c, w=self.w,
+            noise=[gen.get_state() for gen in self.noise_generators],
+            awake_until=self._awake_until,
+            overflow_counts=self._overflow_counts,
+            overflow_steps=self._overflow_steps,
+            chip2host_sent_steps=self._chip2host_sent_steps,
+        )
+
+        all_synapses = [synapses for group in self.groups
+                        for synapses in group.synapses]
+        state['deliveries'] = [
+            (self.synapse_tables[synapses].n_sparse,
+             self.synapse_tables[synapses].n_dense)
+            for synapses in all_synapses]
+        for k, synapses in enumerate(all_synapses):
+            if synapses in self.z:
+                state['z%d' % k] = self.z[synapses]
+            if self.synapse_tables[synapses].weight_matrix is not None:
+                state['weights%d' % k] = self.synapse_tables[synapses].weights
+
+        # input spikes, with the spikes for all times in one array
+        for k, input in enumerate(self.inputs):
+            times = sorted(input.spikes)
+            idxs = [np.asarray(input.spikes[ti], dtype=np.int64).ravel()
+                    for ti in times]
+            state['input_times%d' % k] = np.array(times, dtype=np.int64)
+            state['input_counts%d' % k] = np.array(
+                [len(x) for x in idxs], dtype=np.int64)
+            state['input_idxs%d' % k] = np.concatenate(
+                idxs + [np.zeros(0, dtype=np.int64)])
+            state['input_trial_spikes%d' % k] = input.trial_spikes
+
+        probes = list(self.probe_outputs)
+        for k, probe in enumerate(probes):
+            state['probe%d' % k] = self.probe_outputs[probe].get_state()
+        state['probe_steps'] = [
+            self.probe_outputs[probe].n_steps for probe in probes]
+        state['probe_synapse_steps'] = [
+            getattr(self.probe_outputs[probe], 'step', None)
+            for probe in probes]
+        state['probe_filters'] = {}
+        for probe, probe_filter in self._probe_filters.items():
+            k = probes.index(probe)
+            state['probe_filters'][k] = (
+                probe_filter.step, probe_filter.n_steps,
+                probe_filter.buffer.n_steps)
+            state['probe_filtered%d' % k] = probe_filter.buffer.get_state()
+        return state
+
+    def set_state(self, state):  # noqa: C901
+        """Restore a state returned by `.get_state`.
+
+        The state must be from a simulator of the same model, with the same
+        options. Probe data is used without copying it (see
+        `.ProbeBuffer.set_state`); all other arrays are copied.
+
+        Parameters
+        ----------
+        state : dict
+            The state by name, as returned by `.get_state`.
+        """
+        if state['layout'] != self._state_layout():
+            raise SimulationError(
+                "The saved state is from a different model or simulator")
+
+        self.t = state['t']
+        self.seed = state['seed']
+        for name in ('q', 'u', 'v', 's', 'c', 'w'):
+            getattr(self, name)[...] = state[name]
+        for gen, gen_state in zip(self.noise_generators, state['noise']):
+            gen.set_state(gen_state)
+        self._reset_awake()
+        self._awake_until[...] = state['awake_until']
+        self._overflow_counts[...] = state['overflow_counts']
+        self._overflow_steps[...] = state['overflow_steps']
+        self._chip2host_sent_steps = state['chip2host_sent_steps']
+
+        all_synapses = [synapses for group in self.groups
+                        for synapses in group.synapses]
+        for k, synapses in enumerate(all_synapses):
+            table = self.synapse_tables[synapses]
+            table.n_sparse, table.n_dense = state['deliveries'][k]
+            if synapses in self.z:
+                self.z[synapses][...] = state['z%d' % k]
+            if table.weight_matrix is not None:
+                table._set_weights(np.array(state['weights%d' % k]))
+
+        for k, input in enumerate(self.inputs):
+            input.clear_spikes()
+            times = state['input_times%d' % k]
+            counts = state['input_counts%d' % k]
+            idxs = np.split(np.array(state['input_idxs%d' % k]),
+                            np.cumsum(counts)[:-1])
+            for ti, spike_idxs in zip(times, idxs):
+                input.spikes[int(ti)] = spike_idxs
+            input.trial_spikes.update(state['input_trial_spikes%d' % k])
+
+        probes = list(self.probe_outputs)
+        for k, probe in enumerate(probes):
+            self.probe_outputs[probe].set_state(
+                state['probe%d' % k], state['probe_steps'][k])
+            if state['probe_synapse_steps'][k] is not None:
+                self.probe_outputs[probe].step = (
+                    state['probe_synapse_steps'][k])
+        self._probe_filters.clear()
+        for k, (step, n_steps, n_kept) in state['probe_filters'].items():
+            data = state['probe_filtered%d' % k]
+            probe_filter = ProbeFilter(
+                probes[k].synapse, data.shape[1:], data.dtype, self.model.dt,
+                max_steps=self.max_probe_steps,
+                sample_every=probes[k].sample_every,
+                path=self._probe_path(probes[k], 'filtered'))
+            probe_filter.step = step
+            probe_filter.n_steps = n_steps
+            probe_filter.buffer.set_state(data, n_kept)
+            self._probe_filters[probes[k]] = probe_filter
 
     def clear(self):
         """Clear all signals set in `build` (to free up memory)"""
@@ -917,13 +2890,86 @@ class CxSimulator(object):
         self.ref = None
         self.a_in = None
         self.z = None
+        self.synapse_tables = None
+        self._fused_table = None
 
         self.noiseGen = None
-        self.noiseTarget = None
+        self.noise_generators = None
+        self._jit = None
+
+        self._u2 = None
+        self._mask = None
+        self._tmp = None
+        self._cx_noise = None
 
     def close(self):
         self.closed = True
         self.clear()
+        self.probe_files.close()
+
+    def _probe_path(self, probe, kind='data'):
+        """The file in which ``probe`` keeps its ``kind`` of data, or None
+        if it is kept in memory."""
+        return (self.probe_files.path((probe, kind)) if probe.on_disk else
+                None)
+
+    def _probe_buffer(self, probe, obj, n_trials, raw=False):
+        """Make the buffer for the data of ``probe`` on ``obj``.
+
+        Probes with ``sample_every`` only record their sampled steps (see
+        `.SampledProbeBuffer`), and probes with ``on_disk`` keep them in a
+        file. If ``raw`` is True, every step is kept in memory instead.
+        """
+        shape = (n_trials,) + np.arange(obj.n)[probe.slice].shape
+        dtype = bool if probe.key == 's' else np.float32
+        if raw:
+            return ProbeBuffer(shape, dtype=dtype)
+        if probe.sample_every is not None:
+            return SampledProbeBuffer(probe, shape, dtype, self.model.dt,
+                                      max_steps=self.max_probe_steps,
+                                      path=self._probe_path(probe))
+        if probe.on_disk:
+            return DiskProbeBuffer(shape, self._probe_path(probe), dtype=dtype)
+        if probe.key == 's' and self.packed_spikes:
+            return PackedProbeBuffer(shape, max_steps=self.max_probe_steps)
+        return ProbeBuffer(shape, dtype=dtype, max_steps=self.max_probe_steps)
+
+    def _probe_data(self, cx_probe, start=None):
+        """The recorded data of ``cx_probe``, as floats."""
+        x = self.probe_outputs[cx_probe].view(start=start)
+        return x if x.dtype.kind == 'f' else x.astype(np.float32)
+
+    def _noise_streams(self):
+        """The key and number of values of each stream of noise.
+
+        Each group with noise has its own stream (see `.NoiseGenerator`),
+        in the order of `.noise_cxs`, keyed by `._noise_key`.
+        """
+        return [(self._noise_key(group), np.count_nonzero(group.enableNoise))
+                for group in self.groups if np.any(group.enableNoise)]
+
+    def _noise_key(self, group):
+        """The key of the noise stream of ``group``: its index in the
+        model."""
+        return self.model.cx_groups[group]
+
+    def _noise_samples(self, steps=None):
+        """Random values for each noise-enabled compartment and trial.
+
+        If ``steps`` is given, the values for that many steps are drawn
+        at once, with a leading step axis.
+        """
+        if steps is None:
+            return np.array([gen.next() for gen in self.noise_generators])
+        return np.stack([gen.next_steps(steps)
+                         for gen in self.noise_generators], axis=1)
+
+    def _group_spikes(self):
+        """Yield each group with axons to synapses that are not fused, with
+        the trials and indices of its spikes."""
+        for group in self._axon_groups:
+            trials, cx_idxs = self.s[:, self.group_cxs[group]].nonzero()
+            yield group, (trials, self._original_cxs(group, cx_idxs))
 
     def chip2host(self, probes_receivers=None):
         if probes_receivers is None:
@@ -932,7 +2978,9 @@ class CxSimulator(object):
         increment = None
         for cx_probe, receiver in probes_receivers.items():
             # extract the probe data from the simulator
-            x = self.probe_outputs[cx_probe][self._chip2host_sent_steps:]
+            assert self.n_trials is None, "Cannot send multiple trials"
+            x = self._probe_data(
+                cx_probe, start=self._chip2host_sent_steps)[:, 0]
             if len(x) > 0:
                 if increment is None:
                     increment = len(x)
@@ -948,124 +2996,232 @@ class CxSimulator(object):
         if increment is not None:
             self._chip2host_sent_steps += increment
 
-    def host2chip(self, spikes, errors):
+    def host2chip(self, spikes, errors, trial=None):
         for cx_spike_input, t, spike_idxs in spikes:
-            cx_spike_input.add_spikes(t, spike_idxs)
+            cx_spike_input.add_spikes(t, spike_idxs, trial=trial)
 
         learning_rate = 50  # This is set to match hardware
+        errors_by_synapses = collections.OrderedDict()
         for synapses, t, e in errors:
+            errors_by_synapses.setdefault(synapses, []).append(e)
+
+        for synapses, es in errors_by_synapses.items():
             z = self.z[synapses]
-            x = np.hstack([-e, e])
+            x = np.hstack([-np.array(es), np.array(es)])  # (n_errors, 2*d)
 
-            delta_w = np.outer(z, x) * learning_rate
+            # each error's update is truncated separately, as on the chip
+            delta_w = (z[:, None, None] * x) * learning_rate
+            delta_w = delta_w.astype('int32').sum(axis=1, dtype=np.int32)
 
-            for i, w in enumerate(synapses.weights):
-                w += delta_w[i].astype('int32')
+            self.synapse_tables[synapses].update_weights(delta_w)
 
     def step(self):  # noqa: C901
         """Advance the simulation by 1 step (``dt`` seconds)."""
         self.t += 1
 
         # --- connections
-        self.q[:-1] = self.q[1:]  # advance delays
-        self.q[-1] = 0
-
         # --- clear spikes going in to each synapse
         for axons_in_spikes in self.axons_in.values():
             axons_in_spikes.clear()
 
         # --- inputs pass spikes to synapses
+        n_trials = self.s.shape[0]
+        fused_spikes = []  # trials and sources of spikes to fused synapses
         if self.t >= 2:  # input spikes take one time-step to arrive
             for input in self.inputs:
-                cx_idxs = input.spike_idxs(self.t - 1)
-                for axons in input.axons:
-                    spikes = axons.map_cx_spikes(cx_idxs)
-                    self.axons_in[axons.target].extend(spikes)
+                trials, cx_idxs = input.trial_spike_idxs(
+                    self.t - 1, n_trials)
+                if self._fused_table is not None:
+                    fused_spikes.append(
+                        (trials, self._input_starts[input] + cx_idxs))
+                for axons in self._axons_out[input]:
+                    self.axons_in[axons.target].append(
+                        self._map_spikes(axons, trials, cx_idxs))
 
         # --- axons pass spikes to synapses
-        for group in self.groups:
-            cx_idxs = self.s[self.group_cxs[group]].nonzero()[0]
-            for axons in group.axons:
-                spikes = axons.map_cx_spikes(cx_idxs)
-                self.axons_in[axons.target].extend(spikes)
+        for group, (trials, cx_idxs) in self._group_spikes():
+            for axons in self._axons_out[group]:
+                self.axons_in[axons.target].append(
+                    self._map_spikes(axons, trials, cx_idxs))
 
         # --- synapse spikes use weights to modify compartment input
-        for group in self.groups:
-            for synapses in group.synapses:
-                b_slice = self.group_cxs[synapses.group]
-                qb = self.q[:, b_slice]
-                # delays = np.zeros(qb.shape[1], dtype=np.int32)
-
-                for spike in self.axons_in[synapses]:
-                    # qb[0, indices[spike.axon_id]] += weights[spike.axon_id]
-                    cx_base = synapses.axon_cx_base(spike.axon_id)
-                    if cx_base is None:
-                        continue
+        if self._fused_table is not None:
+            fused_spikes.append(self.s.nonzero())
+            trials, srcs = concat_spikes(fused_spikes)
+            self._fused_table.deliver(
+                self.q, srcs, np.zeros_like(srcs), trials=trials, t=self.t,
+                allow_dense=self._allow_dense)
+
+        for synapses in self._step_synapses:
+            b_slice = self.group_cxs[synapses.group]
+            qb = self.q[:, :, b_slice]
+
+            trials, axon_ids, atoms = concat_spikes(
+                self.axons_in[synapses], n_arrays=3)
+            self.synapse_tables[synapses].deliver(
+                qb, axon_ids, atoms, trials=trials, t=self.t,
+                allow_dense=self._allow_dense)
+            if len(axon_ids) > 0:
+                k = self._group_idxs[synapses.group]
+                self._awake_until[k] = max(
+                    self._awake_until[k], self.t + synapses.max_delay())
+
+            if synapses.tracing:
+                z = self.z[synapses]
+                tau = synapses.tracing_tau
+                mag = synapses.tracing_mag
+
+                decay = np.exp(-1.0 / tau)
+                z *= decay
+                z += mag * np.bincount(axon_ids, minlength=len(z))
 
-                    weights, indices = synapses.axon_weights_indices(
-                        spike.axon_id, atom=spike.atom)
-                    qb[0, cx_base + indices] += weights
+        # --- updates
+        q0 = self.q[self.t % len(self.q)]
 
-                if synapses.tracing:
-                    z = self.z[synapses]
-                    tau = synapses.tracing_tau
-                    mag = synapses.tracing_mag
+        noise = (self._scatter_noise(self.noiseGen())
+                 if len(self.noise_cxs) > 0 else None)
 
-                    decay = np.exp(-1.0 / tau)
-                    z *= decay
+        if self.event_driven:
+            awake = (self._awake_until >= self.t).nonzero()[0]
+            for i0, i1 in self._group_ranges(awake):
+                self._update(q0, noise, i0, i1)
+            self._stay_awake(awake)
+        else:
+            self._update(q0, noise, 0, self.n_cx)
 
-                    for spike in self.axons_in[synapses]:
-                        z[spike.axon_id] += mag
+        # --- probes
+        self._record_probes()
+
+    def _group_ranges(self, group_idxs):
+        """Merge the compartments of sorted groups into contiguous ranges."""
+        ranges = []
+        for k in group_idxs:
+            sl = self.group_cxs[self.groups[k]]
+            if len(ranges) > 0 and ranges[-1][1] == sl.start:
+                ranges[-1][1] = sl.stop
+            else:
+                ranges.append([sl.start, sl.stop])
+        return ranges
 
-        # --- updates
-        q0 = self.q[0, :]
+    def _stay_awake(self, group_idxs):
+        """Keep updating those of the given groups that are not at rest."""
+        for k in group_idxs:
+            sl = self.group_cxs[self.groups[k]]
+            if (np.any(self.u[:, sl]) or np.any(self.v[:, sl])
+                    or np.any(self.w[:, sl]) or np.any(self.s[:, sl])):
+                self._awake_until[k] = max(self._awake_until[k], self.t + 1)
+
+    def _decay_int(self, x, u, sl, retain, scale):
+        """Decay ``x`` in place and add ``u``, for discretized models.
 
-        noise = self.noiseGen()
-        q0[self.noiseTarget == 0] += noise[self.noiseTarget == 0]
-        self.overflow(q0, bits=Q_BITS, name="q0")
+        The decay rounds toward zero, and ``u`` is not scaled.
+        """
+        tmp = self._tmp[:, sl]
+        np.multiply(x, retain[sl], out=tmp)
+        np.trunc(tmp, out=tmp)
+        np.add(tmp, u, out=tmp)
+        np.copyto(x, tmp, casting='unsafe')
+
+    def _decay_float(self, x, u, sl, retain, scale):
+        """Decay ``x`` in place and add ``u`` times ``scale``."""
+        tmp = self._tmp[:, sl]
+        np.multiply(x, retain[sl], out=x)
+        np.multiply(scale[sl], u, out=tmp)
+        np.add(x, tmp, out=x)
+
+    def _scatter_noise(self, noise):
+        """Place the noise for one step at the compartments that it is for.
+
+        Returns an array with a column for each compartment (zero for those
+        without noise), in scratch memory that is reused on every step.
+        """
+        if self._cx_noise is None or self._cx_noise.dtype != noise.dtype:
+            self._cx_noise = np.zeros(self.u.shape, dtype=noise.dtype)
+        self._cx_noise[:, self.noise_cxs] = noise
+        return self._cx_noise
 
-        self.u[:] = self.decayU_fn(self.u[:], q0)
-        self.overflow(self.u, bits=U_BITS, name="U")
-        u2 = self.u + self.bias
-        u2[self.noiseTarget == 1] += noise[self.noiseTarget == 1]
-        self.overflow(u2, bits=U_BITS, name="u2")
+    def _update(self, q0, noise, i0, i1):
+        """Update the compartments in ``[i0, i1)`` with the input ``q0``.
 
-        self.v[:] = self.decayV_fn(self.v, u2)
+        ``noise`` is the noise of all compartments (see `._scatter_noise`),
+        or None. All operations are done in place or in preallocated scratch
+        memory, so that updating does not allocate.
+        """
+        sl = slice(i0, i1)
+        q0 = q0[:, sl]
+        u, v, s, w = self.u[:, sl], self.v[:, sl], self.s[:, sl], self.w[:, sl]
+        u2, mask = self._u2[:, sl], self._mask[:, sl]
+        if noise is not None:
+            np.add(q0, noise[:, sl], out=q0, where=self._noise_at_dend[sl],
+                   casting='unsafe')
+        if self._check_overflow:
+            self._overflow(q0, Q_BITS, 0, i0)
+
+        self._decay(u, q0, sl, self._retainU, self.scaleU)
+        q0.fill(0)  # free the slot for input arriving n_delays steps from now
+        if self._check_overflow:
+            self._overflow(u, U_BITS, 1, i0)
+        np.add(u, self.bias[sl], out=u2)
+        if noise is not None:
+            np.add(u2, noise[:, sl], out=u2, where=self._noise_at_vm[sl],
+                   casting='unsafe')
+        if self._check_overflow:
+            self._overflow(u2, U_BITS, 2, i0)
+
+        self._decay(v, u2, sl, self._retainV, self.scaleV)
         # We have not been able to create V overflow on the chip, so we do
         # not include it here. See github.com/nengo/nengo-loihi/issues/130
-        # self.overflow(self.v, bits=V_BIT, name="V")
 
-        np.clip(self.v, self.vmin, self.vmax, out=self.v)
-        self.v[self.w > 0] = 0
+        np.clip(v, self.vmin if len(self.vmin) == 1 else self.vmin[sl],
+                self.vmax if len(self.vmax) == 1 else self.vmax[sl], out=v)
+        np.greater(w, 0, out=mask)
+        np.copyto(v, 0, where=mask)
         # TODO^: don't zero voltage in case neuron is saving overshoot
 
-        self.s[:] = (self.v > self.vth)
+        np.greater(v, self.vth[sl], out=s)
 
-        cx = self.cx_slice
-        cpu = self.cpu_slice
-        self.v[cx][self.s[cx]] = 0
-        self.v[cpu][self.s[cpu]] -= self.vth[cpu][self.s[cpu]]
+        # compartments before `j` are on-core, the rest on the CPU
+        j = min(max(self.cx_slice.stop - i0, 0), i1 - i0)
+        np.copyto(v[:, :j], 0, where=s[:, :j])
+        np.subtract(v[:, j:], self.vth[i0 + j:i1], out=v[:, j:],
+                    where=s[:, j:])
 
-        self.w[self.s] = self.ref[self.s]
-        np.clip(self.w - 1, 0, None, out=self.w)  # decrement w
+        np.copyto(w, self.ref[sl], where=s)
+        np.subtract(w, 1, out=w)  # decrement w
+        np.maximum(w, 0, out=w)
 
-        self.c[self.s] += 1
+        c = self.c[:, sl]
+        np.add(c, s, out=c)
 
-        # --- probes
-        for input in self.inputs:
+    def _record_probes(self, steps=1, inputs=None, groups=None):
+        """Record the current state as the data for the next ``steps``.
+
+        Only the probes of the given ``inputs`` and ``groups`` are recorded
+        (by default, those of all inputs and groups).
+        """
+        n_trials = self.s.shape[0]
+        for input in self._probed_inputs if inputs is None else inputs:
             for probe in input.probes:
                 assert probe.key == 's'
-                p_slice = probe.slice
-                x = input.spikes[self.t][p_slice].copy()
-                self.probe_outputs[probe].append(x)
+                s = np.zeros((n_trials, input.n), dtype=bool)
+                s[input.trial_spike_idxs(self.t, n_trials)] = True
+                self.probe_outputs[probe].append(s[:, probe.slice], steps)
 
-        for group in self.groups:
+        for group in self._probed_groups if groups is None else groups:
             for probe in group.probes:
                 x_slice = self.group_cxs[probe.target]
-                p_slice = probe.slice
+                p_slice = self._probe_cxs.get(probe, probe.slice)
                 assert hasattr(self, probe.key), "probe key not found"
-                x = getattr(self, probe.key)[x_slice][p_slice].copy()
-                self.probe_outputs[probe].append(x)
+                x = getattr(self, probe.key)[:, x_slice][:, p_slice]
+                self.probe_outputs[probe].append(x, steps)
+
+    @staticmethod
+    def _map_spikes(axons, trials, cx_idxs):
+        """Like `.CxAxons.map_cx_spikes`, but keeping the trial of each."""
+        axon_ids = axons.map_cx_axons(cx_idxs)
+        valid = axon_ids >= 0
+        return (trials[valid], axon_ids[valid],
+                axons.map_cx_atoms(cx_idxs)[valid])
 
     def run_steps(self, steps):
         """Simulate for the given number of ``dt`` steps.
@@ -1075,38 +3231,216 @@ class CxSimulator(object):
         steps : int
             Number of steps to run the simulation for.
         """
-        for _ in range(steps):
-            self.step()
-
-    def _filter_probe(self, cx_probe, data):
-        dt = self.model.dt
-        i = self._probe_filter_pos.get(cx_probe, 0)
-        if i == 0:
-            shape = data[0].shape
-            synapse = cx_probe.synapse
-            rng = None
-            step = (synapse.make_step(shape, shape, dt, rng, dtype=data.dtype)
-                    if synapse is not None else None)
-            self._probe_filters[cx_probe] = step
-        else:
-            step = self._probe_filters[cx_probe]
+        if self._jit is not None:
+            self._jit.run_steps(steps)
+            return
 
-        if step is None:
-            self._probe_filter_pos[cx_probe] = i + len(data)
-            return data
-        else:
-            filt_data = np.zeros_like(data)
-            for k, x in enumerate(data):
-                filt_data[k] = step((i + k) * dt, x)
+        for probe_output in self.probe_outputs.values():
+            probe_output.reserve(steps)
+
+        while steps > 0:
+            n, layered = self._next_schedule(steps)
+            start = timeit.default_timer()
+            if layered:
+                self._run_layers(n)
+            else:
+                self._run_stepwise(n)
+            if self._step_times[layered] is None and n > 1:
+                self._step_times[layered] = (
+                    timeit.default_timer() - start) / n
+            steps -= n
+
+    def _next_schedule(self, steps):
+        """The number of steps to run next, and whether to run them with
+        the layer-wise schedule.
+
+        When both schedules can be used, the first steps are run and
+        timed with each, and the faster one is used from then on.
+        """
+        if self._layers is None or self.event_driven or steps < 2:
+            return steps, False
+        stepwise, layered = self._step_times
+        if stepwise is None:
+            return min(steps, 32), False
+        if layered is None or layered < stepwise:
+            return min(steps, self.max_layer_steps,
+                       max(self.max_layer_size // self._layer_step_size, 1)
+                       ), True
+        return steps, False
+
+    def _run_stepwise(self, steps):
+        """Run ``steps`` steps one at a time (see `.step`)."""
+        while steps > 0:
+            idle = self._idle_steps(steps) if self.event_driven else 0
+            if idle > 0:
+                # nothing changes, so we only need to record the probes
+                self.t += idle
+                self._record_probes(idle)
+                steps -= idle
+            else:
+                self.step()
+                steps -= 1
+
+    def _run_layers(self, steps):  # noqa: C901
+        """Run ``steps`` steps with the layer-wise schedule.
+
+        Each layer of groups (see `._find_layers`) is run for all steps
+        before the next, with the input to its groups on all steps
+        delivered at once from the spikes sent by inputs and earlier
+        layers.
+        """
+        t0 = self.t
+        n_trials = self.s.shape[0]
+        n_delays = len(self.q)
+
+        # draw the noise for all steps, in the same order as `step`
+        noise = ([self.noiseGen() for _ in range(steps)]
+                 if len(self.noise_cxs) > 0 else [None] * steps)
+
+        # the (step index, trial, index) of the spikes sent by each input
+        # and group that are delivered on each of the steps
+        sent = {}
+        for input in self.inputs:
+            spikes = []
+            for k in range(steps):
+                if t0 + k >= 1:  # input spikes take one step to arrive
+                    trials, cx_idxs = input.trial_spike_idxs(t0 + k, n_trials)
+                    spikes.append(
+                        (np.full(len(cx_idxs), k, dtype=np.int32), trials,
+                         cx_idxs))
+            sent[input] = concat_spikes(spikes, n_arrays=3)
+
+        for k in range(steps):
+            self.t = t0 + k + 1
+            self._record_probes(groups=())
+
+        # spikes of each group before and on each of the steps
+        rasters = {}
+        for group in self.groups:
+            rasters[group] = np.zeros((steps + 1,) + self.s.shape[:1]
+                                      + (group.n,), dtype=bool)
+            rasters[group][0] = self.s[:, self.group_cxs[group]]
+
+        for layer in self._layers:
+            groups = [self.groups[k] for k in layer]
+            ranges = self._group_ranges(layer)
+
+            inputs = []
+            for group in groups:
+                for synapses in group.synapses:
+                    spikes = []
+                    for obj, axons in self.synapse_sources[synapses]:
+                        ks, trials, cx_idxs = sent[obj]
+                        axon_ids = axons.map_cx_axons(cx_idxs)
+                        valid = axon_ids >= 0
+                        spikes.append((ks[valid], trials[valid],
+                                       axon_ids[valid],
+                                       axons.map_cx_atoms(cx_idxs)[valid]))
+                    ks, trials, axon_ids, atoms = concat_spikes(
+                        spikes, n_arrays=4)
+
+                    # keep the order in which `step` delivers spikes
+                    order = np.argsort(ks, kind='mergesort')
+                    shape = (steps + synapses.max_delay(), n_trials, group.n)
+                    x = self.synapse_tables[synapses].deliver_steps(
+                        shape, ks[order], axon_ids[order], atoms[order],
+                        trials[order], allow_dense=self._allow_dense)
+                    inputs.append((self.group_cxs[group], x))
+
+            for k in range(steps):
+                self.t = t0 + k + 1
+                q0 = self.q[self.t % n_delays]
+                for sl, x in inputs:
+                    np.add(q0[:, sl], x[k], out=q0[:, sl], casting='unsafe')
+
+                cx_noise = (self._scatter_noise(noise[k])
+                            if noise[k] is not None else None)
+                for i0, i1 in ranges:
+                    self._update(q0, cx_noise, i0, i1)
+
+                for group in groups:
+                    rasters[group][k + 1] = self.s[:, self.group_cxs[group]]
+                self._record_probes(inputs=(), groups=groups)
+
+            # input that arrives after these steps, due to delays
+            for sl, x in inputs:
+                for j in range(steps, len(x)):
+                    qj = self.q[(t0 + j + 1) % n_delays]
+                    np.add(qj[:, sl], x[j], out=qj[:, sl], casting='unsafe')
+
+            for group in groups:
+                ks, trials, cx_idxs = rasters[group][:steps].nonzero()
+                sent[group] = (
+                    ks, trials, self._original_cxs(group, cx_idxs))
+
+    def _idle_steps(self, max_steps):
+        """The number of upcoming steps (up to ``max_steps``) on which all
+        groups are at rest and no input spikes are sent or recorded."""
+        if len(self.z) > 0 or np.any(self._awake_until > self.t):
+            return 0  # learning traces decay on every step
+
+        key = [(len(input.spikes), len(input.trial_spikes))
+               for input in self.inputs]
+        if key != self._input_times_key:
+            self._input_times = np.unique(
+                [ti for input in self.inputs
+                 for ti in list(input.spikes) + list(input.trial_spikes)]
+            ).astype(np.int64)
+            self._input_times_key = key
+
+        # spikes at time `ti` are recorded on step `ti` and delivered on
+        # step `ti + 1`, so both steps must be taken
+        k = np.searchsorted(self._input_times, self.t)
+        if k < len(self._input_times) and self._input_times[k] == self.t:
+            return 0
+        if k < len(self._input_times):
+            return min(max_steps, self._input_times[k] - 1 - self.t)
+        return max_steps
 
-            self._probe_filter_pos[cx_probe] = i + k
-            return filt_data
+    def _probe_output(self, cx_probe, start=None):
+        """The unfiltered output of ``cx_probe`` (see `.get_probe_output`).
 
-    def get_probe_output(self, cx_probe):
+        Sampled probes with a synapse record their filtered output as they
+        run, which is returned as is.
+        """
+        x = self._probe_data(cx_probe, start=start)
+        x = x[:, 0] if self.n_trials is None else x
+        if cx_probe.weights is None or getattr(
+                self.probe_outputs[cx_probe], 'filtered', False):
+            return x
+        return np.dot(x, cx_probe.weights)
+
+    def get_probe_output(self, cx_probe, start=None):
+        """The output of ``cx_probe``, filtered by its synapse (if any).
+
+        If the probe has a ``sample_every``, only the sampled steps are
+        returned.
+
+        Parameters
+        ----------
+        cx_probe : CxProbe
+            The probe.
+        start : int, optional (Default: None)
+            The index of the first (sampled) step to return, so that data
+            can be collected incrementally. If None, all kept steps are
+            returned.
+
+        Returns
+        -------
+        x : ndarray
+            The output on each step, with a leading trial axis if
+            ``n_trials`` is given. It may be a read-only view of the
+            recorded data.
+        """
         assert isinstance(cx_probe, CxProbe)
-        x = np.asarray(self.probe_outputs[cx_probe], dtype=np.float32)
-        x = x if cx_probe.weights is None else np.dot(x, cx_probe.weights)
-        return self._filter_probe(cx_probe, x)
+        if isinstance(self.probe_outputs[cx_probe], ProbeFilter):
+            x = self._probe_output(cx_probe, start=start)
+        else:
+            x = filtered_probe_output(
+                self._probe_filters, cx_probe, self._probe_output,
+                self.model.dt, start=start, max_steps=self.max_probe_steps,
+                path=self._probe_path(cx_probe, 'filtered'))
+        return x if self.n_trials is None else np.swapaxes(x, 0, 1)
 
 
 class PESModulatoryTarget(object):
@@ -1151,6 +3485,10 @@ class HostReceiveNode(nengo.Node):
         super(HostReceiveNode, self).__init__(self.update,
                                               size_in=0, size_out=dimensions)
 
+    def clear(self):
+        del self.queue[1:]
+        self.queue_index = 0
+
     def update(self, t):
         while (len(self.queue) > self.queue_index + 1
                and self.queue[self.queue_index][0] < t):
@@ -1,5 +1,6 @@
 from __future__ import division
 
+import collections
 from distutils.version import LooseVersion
 import logging
 import os
@@ -320,6 +321,8 @@ def build_synapses(n2core, core, group, synapses, cx_idxs):  # noqa C901
         if weight_idx not in synapse_map:
             weights = synapses.weights[weight_idx]
             indices = synapses.indices[weight_idx]
+            delays = (None if synapses.delays is None else
+                      synapses.delays[weight_idx])
             weights = weights // synapses.synapse_fmt.scale
             assert weights.ndim == 2
             assert weights.shape == indices.shape
@@ -333,11 +336,14 @@ def build_synapses(n2core, core, group, synapses, cx_idxs):  # noqa C901
             for p in range(n_populations):
                 for q in range(n_cxs):
                     cx_idx = cx_idxs[indices[p, q]]
+                    kwargs = ({} if delays is None else
+                              {'Dly': int(delays[p, q])})
                     n2core.synapses[total_synapse_ptr].configure(
                         CIdx=cx_idx,
                         Wgt=weights[p, q],
                         synFmtId=synapse_fmt_idx,
                         LrnEn=int(synapses.tracing),
+                        **kwargs
                     )
                     target_cxs.add(cx_idx)
                     total_synapse_ptr += 1
@@ -399,13 +405,14 @@ def collect_axons(n2core, core, group, axons, cx_ids):
     tcore_id = n2board.n2Chips[tchip_idx].n2Cores[tcore_idx].id
 
     cx_idxs = np.arange(len(cx_ids))
-    spikes = axons.map_cx_spikes(cx_idxs)
+    axon_ids, atoms = axons.map_cx_spikes(cx_idxs)
+    assert len(axon_ids) == len(cx_ids), "All compartments must have axons"
 
     all_axons = []  # (cx, atom, type, tchip_id, tcore_id, taxon_id)
-    for cx_id, spike in zip(cx_ids, spikes):
-        taxon_idx = int(spike.axon_id)
+    for cx_id, taxon_idx, atom in zip(cx_ids, axon_ids, atoms):
+        taxon_idx = int(taxon_idx)
         taxon_id = int(tsyn_idxs[taxon_idx])
-        atom = int(spike.atom)
+        atom = int(atom)
         n_populations = synapses.axon_populations(taxon_idx)
         all_axons.append((cx_id, atom, synapses.pop_type,
                           tchip_id, tcore_id, taxon_id))
@@ -511,20 +518,29 @@ class LoihiSimulator(object):
 
         .. warning :: Setting the seed has no effect on stochastic
                       operations run on the Loihi board.
+    probe_dir : str, optional (Default: None)
+        The directory in which probes with ``on_disk`` keep the data sent
+        by the snip (see `.DiskProbeBuffer`). Probes recorded without
+        snips keep their data in the NxSDK time series. If None, a
+        temporary directory is used, which is removed by `.close`.
     """
 
-    def __init__(self, cx_model, use_snips=True, seed=None):
+    def __init__(self, cx_model, use_snips=True, seed=None, probe_dir=None):
         self.closed = False
         self.use_snips = use_snips
+        self.probe_files = loihi_cx.ProbeFiles(
+            probe_dir, prefix='loihi_probe')
         self.check_nxsdk_version()
 
         self.n2board = None
         self.nengo_io_h2c = None  # IO snip host-to-chip channel
         self.nengo_io_c2h = None  # IO snip chip-to-host channel
+        self.nengo_io_sample_groups = []  # probes only sent when sampled
         self._probe_filters = {}
-        self._probe_filter_pos = {}
         self._snip_probe_data = {}
+        self._monitor_probe_starts = {}
         self._chip2host_sent_steps = 0
+        self._host2chip_sent_steps = 0
 
         # Maximum number of spikes that can be sent through
         # the nengo_io_h2c channel on one timestep.
@@ -587,7 +603,9 @@ class LoihiSimulator(object):
             # having normal probes at the same time as snips causes problems
             for cx_probe in self._iter_probes():
                 cx_probe.use_snip = True
-                self._snip_probe_data[cx_probe] = []
+                # on-disk buffers are made once the shape is known
+                self._snip_probe_data[cx_probe] = (
+                    None if cx_probe.on_disk else [])
 
         # --- allocate --
         # maps CxModel to cores and chips
@@ -597,6 +615,41 @@ class LoihiSimulator(object):
         # --- build
         self.n2board = build_board(self.board)
 
+    def reset(self, seed=None):
+        """Reset the board to its built state, without rebuilding.
+
+        The board state is not reinitialized in place. Instead, the board
+        is disconnected, and the next run reconnects to it, which loads
+        the built configuration (and initial state) again. The IO snips
+        and their channels made for the first run are reused. Monitor
+        probes keep recording into the same time series, so only their
+        data from after the reset is returned. Probe data from the snips
+        is discarded and input spikes are cleared.
+        """
+        if seed is not None:
+            warnings.warn("Seed will be ignored when running on Loihi")
+
+        if self.is_connected():
+            self.n2board.disconnect()
+
+        for input in self.model.cx_inputs:
+            input.clear_spikes()
+
+        self._chip2host_sent_steps = 0
+        self._host2chip_sent_steps = 0
+        self._probe_filters.clear()
+        for data in self._snip_probe_data.values():
+            if isinstance(data, loihi_cx.ProbeBuffer):
+                data.clear()
+            elif data is not None:
+                del data[:]
+
+        # monitor probes keep recording into the same time series, so we
+        # only return data recorded after the reset
+        for cx_probe, n2probe in self.board.probe_map.items():
+            self._monitor_probe_starts[cx_probe] = len(
+                n2probe[0].timeSeries.data)
+
     def print_cores(self):
         for j, n2chip in enumerate(self.n2board.n2Chips):
             print("Chip %d, id=%d" % (j, n2chip.id))
@@ -616,9 +669,9 @@ class LoihiSimulator(object):
         for cx_probe, receiver in probes_receivers.items():
             assert not cx_probe.use_snip
             n2probe = self.board.probe_map[cx_probe]
-            x = np.column_stack([
-                p.timeSeries.data[self._chip2host_sent_steps:]
-                for p in n2probe])
+            start = (self._monitor_probe_starts.get(cx_probe, 0)
+                     + self._chip2host_sent_steps)
+            x = np.column_stack([p.timeSeries.data[start:] for p in n2probe])
             assert x.ndim == 2
 
             if len(x) > 0:
@@ -638,29 +691,64 @@ class LoihiSimulator(object):
         if increment is not None:
             self._chip2host_sent_steps += increment
 
+    @staticmethod
+    def _sampled_by_snip(cx_probe):
+        """Whether the snip only sends ``cx_probe`` on its sampled steps.
+
+        Probes with a synapse are sent on every step, so that they can be
+        filtered before they are sampled.
+        """
+        return (cx_probe.use_snip and cx_probe.synapse is None
+                and cx_probe.sample_every is not None)
+
+    def _snip_sampled(self, step):
+        """Whether each group of probes sampled by the snip (see
+        `.create_io_snip`) is sampled on ``step``."""
+        return [bool(loihi_cx.sampled_steps(period, step - 1, step)[0])
+                for period, _, _ in self.nengo_io_sample_groups]
+
+    @staticmethod
+    def _snip_probe_output(cx_probe, x):
+        """The output of ``cx_probe`` from the values ``x`` sent by the
+        snip."""
+        assert x.ndim == 1
+        if cx_probe.key == 's':
+            if isinstance(cx_probe.target, CxGroup):
+                refract_delays = cx_probe.target.refractDelay
+            else:
+                refract_delays = 1
+
+            # Loihi uses the voltage value to indicate where we
+            # are in the refractory period. We want to find neurons
+            # starting their refractory period.
+            x = (x == refract_delays * 128)
+
+        if cx_probe.weights is not None:
+            x = np.dot(x, cx_probe.weights)
+        return x
+
+    def _record_snip_probe(self, cx_probe, x):
+        """Keep the output ``x`` of ``cx_probe`` on one step."""
+        data = self._snip_probe_data[cx_probe]
+        if data is None:
+            data = self._snip_probe_data[cx_probe] = loihi_cx.DiskProbeBuffer(
+                x.shape, self._probe_path(cx_probe), dtype=x.dtype)
+        data.append(x)
+
     def _chip2host_snips(self, probes_receivers):
-        count = self.nengo_io_c2h_count
+        sampled = self._snip_sampled(self._chip2host_sent_steps + 1)
+        count = self.nengo_io_c2h_count + sum(
+            size for (_, _, size), is_sampled in zip(
+                self.nengo_io_sample_groups, sampled) if is_sampled)
         data = self.nengo_io_c2h.read(count)
         time_step, data = data[0], np.array(data[1:])
         snip_range = self.nengo_io_snip_range
 
         for cx_probe in self._snip_probe_data:
             assert cx_probe.use_snip
-            x = data[snip_range[cx_probe]]
-            assert x.ndim == 1
-            if cx_probe.key == 's':
-                if isinstance(cx_probe.target, CxGroup):
-                    refract_delays = cx_probe.target.refractDelay
-                else:
-                    refract_delays = 1
-
-                # Loihi uses the voltage value to indicate where we
-                # are in the refractory period. We want to find neurons
-                # starting their refractory period.
-                x = (x == refract_delays * 128)
-
-            if cx_probe.weights is not None:
-                x = np.dot(x, cx_probe.weights)
+            if self._sampled_by_snip(cx_probe):
+                continue
+            x = self._snip_probe_output(cx_probe, data[snip_range[cx_probe]])
 
             receiver = probes_receivers.get(cx_probe, None)
             if receiver is not None:
@@ -668,7 +756,19 @@ class LoihiSimulator(object):
                 receiver.receive(self.model.dt * time_step, x)
             else:
                 # onchip probes
-                self._snip_probe_data[cx_probe].append(x)
+                self._record_snip_probe(cx_probe, x)
+
+        # sampled probes follow, for each group sampled on this step
+        i = self.nengo_io_c2h_count - 1
+        for (_, cx_probes, size), is_sampled in zip(
+                self.nengo_io_sample_groups, sampled):
+            if is_sampled:
+                for cx_probe in cx_probes:
+                    assert cx_probe not in probes_receivers
+                    x = data[i:i + size][snip_range[cx_probe]]
+                    self._record_snip_probe(
+                        cx_probe, self._snip_probe_output(cx_probe, x))
+                i += size
 
         self._chip2host_sent_steps += 1
 
@@ -706,6 +806,9 @@ class LoihiSimulator(object):
         assert len(loihi_errors) == self.nengo_io_h2c_errors
         for error in loihi_errors:
             msg.extend(error)
+        self._host2chip_sent_steps += 1
+        msg.extend(int(is_sampled) for is_sampled in self._snip_sampled(
+            self._host2chip_sent_steps))
         assert len(msg) <= self.nengo_io_h2c.numElements
         self.nengo_io_h2c.write(len(msg), msg)
 
@@ -774,44 +877,39 @@ class LoihiSimulator(object):
             os.chdir(self.cwd)
             self.cwd = None
 
+        self.probe_files.close()
         self.closed = True
 
-    def _filter_probe(self, cx_probe, data):
-        dt = self.model.dt
-        i = self._probe_filter_pos.get(cx_probe, 0)
-        if i == 0:
-            shape = data[0].shape
-            synapse = cx_probe.synapse
-            rng = None
-            step = (synapse.make_step(shape, shape, dt, rng, dtype=data.dtype)
-                    if synapse is not None else None)
-            self._probe_filters[cx_probe] = step
-        else:
-            step = self._probe_filters[cx_probe]
-
-        if step is None:
-            self._probe_filter_pos[cx_probe] = i + len(data)
-            return data
-        else:
-            filt_data = np.zeros_like(data)
-            for k, x in enumerate(data):
-                filt_data[k] = step((i + k) * dt, x)
+    def _probe_path(self, cx_probe, kind='data'):
+        """The file in which ``cx_probe`` keeps its ``kind`` of data, or None
+        if it is kept in memory."""
+        return (self.probe_files.path((cx_probe, kind)) if cx_probe.on_disk
+                else None)
 
-            self._probe_filter_pos[cx_probe] = i + k
-            return filt_data
-
-    def get_probe_output(self, cx_probe):
-        assert isinstance(cx_probe, loihi_cx.CxProbe)
+    def _probe_output(self, cx_probe, start=None):
+        """The unfiltered output of ``cx_probe`` (see `.get_probe_output`)."""
+        start = 0 if start is None else start
         if cx_probe.use_snip:
             data = self._snip_probe_data[cx_probe]
-            if cx_probe.synapse is not None:
-                return cx_probe.synapse.filt(data, dt=self.model.dt, y0=0)
-            else:
-                return data
+            if isinstance(data, loihi_cx.ProbeBuffer):
+                return data.view(start)
+            return np.asarray([] if data is None else data[start:])
         n2probe = self.board.probe_map[cx_probe]
-        x = np.column_stack([p.timeSeries.data for p in n2probe])
-        x = x if cx_probe.weights is None else np.dot(x, cx_probe.weights)
-        return self._filter_probe(cx_probe, x)
+        start += self._monitor_probe_starts.get(cx_probe, 0)
+        x = np.column_stack([p.timeSeries.data[start:] for p in n2probe])
+        return x if cx_probe.weights is None else np.dot(x, cx_probe.weights)
+
+    def get_probe_output(self, cx_probe, start=None):
+        """The output of ``cx_probe``, filtered by its synapse (if any).
+
+        See `.CxSimulator.get_probe_output`.
+        """
+        assert isinstance(cx_probe, loihi_cx.CxProbe)
+        if self._sampled_by_snip(cx_probe):
+            return self._probe_output(cx_probe, start)
+        return loihi_cx.filtered_probe_output(
+            self._probe_filters, cx_probe, self._probe_output, self.model.dt,
+            start=start, path=self._probe_path(cx_probe, 'filtered'))
 
     def create_io_snip(self):
         # snips must be created before connecting
@@ -842,6 +940,8 @@ class LoihiSimulator(object):
         cores = set()
         # TODO: should snip_range be stored on the probe?
         snip_range = {}
+        # probes sampled by the snip are grouped by their sample_every
+        sampled_probes = collections.OrderedDict()
         for group in self.model.cx_groups.keys():
             for probe in group.probes:
                 if probe.use_snip:
@@ -850,6 +950,10 @@ class LoihiSimulator(object):
                     # For spike probes, we record V and determine if the neuron
                     # spiked in Simulator.
                     cores.add(info["coreid"])
+                    if self._sampled_by_snip(probe):
+                        sampled_probes.setdefault(
+                            probe.sample_every, []).append(probe)
+                        continue
                     snip_range[probe] = slice(n_outputs - 1,
                                               n_outputs + len(info["cxs"]) - 1)
                     for cx in info["cxs"]:
@@ -857,17 +961,38 @@ class LoihiSimulator(object):
                             (n_outputs, info["coreid"], cx, info['key']))
                         n_outputs += 1
 
+        # the outputs of each group of sampled probes follow the others on
+        # the steps the group is sampled, with each probe's range relative
+        # to the start of the group
+        sample_groups = []
+        sample_outputs = []
+        for sample_every, group_probes in sampled_probes.items():
+            outputs = []
+            for probe in group_probes:
+                info = probe.snip_info
+                snip_range[probe] = slice(
+                    len(outputs), len(outputs) + len(info["cxs"]))
+                outputs.extend(
+                    (info["coreid"], cx, info['key']) for cx in info["cxs"])
+            sample_groups.append(
+                (sample_every / self.model.dt, group_probes, len(outputs)))
+            sample_outputs.append(outputs)
+        max_outputs = n_outputs + sum(size for _, _, size in sample_groups)
+
         # --- write c file using template
         c_path = os.path.join(snips_dir, "nengo_io.c")
         logger.debug(
-            "Creating %s with %d outputs, %d error, %d cores, %d probes",
-            c_path, n_outputs, n_errors, len(cores), len(probes))
+            "Creating %s with %d outputs, %d error, %d cores, %d probes, "
+            "%d sampled outputs", c_path, n_outputs, n_errors, len(cores),
+            len(probes), max_outputs - n_outputs)
         code = template.render(
             n_outputs=n_outputs,
+            max_outputs=max_outputs,
             n_errors=n_errors,
             max_error_len=max_error_len,
             cores=cores,
             probes=probes,
+            sample_groups=sample_outputs,
         )
         with open(c_path, 'w') as f:
             f.write(code)
@@ -892,15 +1017,17 @@ class LoihiSimulator(object):
             phase="preLearnMgmt",
         )
 
-        size = self.snip_max_spikes_per_step * 2 + 1 + total_error_len
+        size = (self.snip_max_spikes_per_step * 2 + 1 + total_error_len
+                + len(sample_groups))
         logger.debug("Creating nengo_io_h2c channel")
         self.nengo_io_h2c = self.n2board.createChannel(b'nengo_io_h2c',
                                                        "int", size)
         logger.debug("Creating nengo_io_c2h channel")
         self.nengo_io_c2h = self.n2board.createChannel(b'nengo_io_c2h',
-                                                       "int", n_outputs)
+                                                       "int", max_outputs)
         self.nengo_io_h2c.connect(None, nengo_io)
         self.nengo_io_c2h.connect(nengo_io, None)
         self.nengo_io_h2c_errors = n_errors
         self.nengo_io_c2h_count = n_outputs
         self.nengo_io_snip_range = snip_range
+        self.nengo_io_sample_groups = sample_groups
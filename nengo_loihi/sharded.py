@@ -0,0 +1,449 @@
+"""Emulator that splits a model across several worker processes.
+
+Each worker process simulates the groups on a cluster of the cores chosen
+by an allocator, using its own `.CxSimulator`. On every timestep, the
+workers publish the indices of the compartments that spiked in their groups
+to shared memory and wait at a barrier; on the next timestep, each worker
+delivers the spikes of the groups with axons into its synapses.
+"""
+
+import logging
+import multiprocessing
+import threading
+import warnings
+
+import numpy as np
+from nengo.exceptions import SimulationError, ValidationError
+
+from nengo_loihi.allocators import one_to_one_allocator
+from nengo_loihi.loihi_cx import CxModel, CxSimulator
+
+logger = logging.getLogger(__name__)
+
+
+def partition_cores(board, n_shards):
+    """Split the cores of ``board`` into at most ``n_shards`` clusters.
+
+    Cores are assigned greedily, largest first, to the cluster with the
+    least work so far, where the work of a core is its number of
+    compartments plus its number of synapse weights.
+
+    Returns
+    -------
+    shards : list of lists of CxGroup
+        The groups in each (non-empty) cluster.
+    """
+    def core_load(core):
+        return sum(group.n + sum(w.size for synapses in group.synapses
+                                 for w in synapses.weights)
+                   for group in core.groups)
+
+    cores = [core for chip in board.chips for core in chip.cores
+             if len(core.groups) > 0]
+    cores.sort(key=core_load, reverse=True)
+
+    shards = [[] for _ in range(min(n_shards, len(cores)))]
+    loads = np.zeros(len(shards))
+    for core in cores:
+        i = np.argmin(loads)
+        shards[i].extend(core.groups)
+        loads[i] += core_load(core)
+    return shards
+
+
+class SpikeExchange(object):
+    """Shared memory for passing spike indices between worker processes.
+
+    For each group, there is room for the indices of all its compartments
+    and a spike count, twice over: spikes from timestep ``t`` are written
+    to the buffer ``t % 2`` and read on timestep ``t + 1``, so one barrier
+    per timestep keeps readers and writers apart.
+    """
+
+    def __init__(self, groups, context):
+        self.offsets = {}
+        n = 0
+        for k, group in enumerate(groups):
+            self.offsets[group] = (k, n)
+            n += group.n
+
+        self._counts = context.RawArray('i', 2 * len(groups))
+        self._idxs = context.RawArray('i', 2 * n)
+        self.counts = np.frombuffer(self._counts, dtype=np.int32).reshape(
+            2, len(groups))
+        self.idxs = np.frombuffer(self._idxs, dtype=np.int32).reshape(2, n)
+
+    def write(self, group, t, cx_idxs):
+        k, i = self.offsets[group]
+        self.counts[t % 2, k] = len(cx_idxs)
+        self.idxs[t % 2, i:i + len(cx_idxs)] = cx_idxs
+
+    def read(self, group, t):
+        k, i = self.offsets[group]
+        return self.idxs[t % 2, i:i + self.counts[t % 2, k]]
+
+
+class ShardSimulator(CxSimulator):
+    """The `.CxSimulator` run by one worker of a `.ShardedCxSimulator`.
+
+    Parameters
+    ----------
+    model : CxModel
+        The full model.
+    groups : list of CxGroup
+        The groups simulated by this worker.
+    exchange : SpikeExchange
+        Shared memory for spikes from all groups.
+    seed : int
+        The seed of the full simulation.
+    check_overflow : bool, optional (Default: True)
+        See `.CxSimulator`.
+    """
+
+    def __init__(self, model, groups, exchange, seed, check_overflow=True):
+        self.full_model = model
+        self.exchange = exchange
+
+        shard_model = CxModel(dt=model.dt, label=model.label)
+        for input in model.cx_inputs:
+            shard_model.add_input(input)
+        for group in groups:
+            shard_model.add_group(group)
+
+        super(ShardSimulator, self).__init__(
+            shard_model, seed=seed, check_overflow=check_overflow,
+            engine='numpy')
+
+        # groups in other shards whose axons target synapses in this shard,
+        # in the order of the full simulation (on-core groups first)
+        full_groups = sorted(
+            model.cx_groups, key=lambda g: g.location == 'cpu')
+        self.remote_groups = [
+            group for group in full_groups if group not in self.group_cxs
+            and any(axons.target in self.axons_in for axons in group.axons)]
+        for group in self.remote_groups:
+            self._axons_out[group] = [axons for axons in group.axons
+                                      if axons.target in self.axons_in]
+
+    def _probe_buffer(self, probe, obj, n_trials, raw=False):
+        # every step is sent to the main process, which samples and stores
+        # them
+        return super(ShardSimulator, self)._probe_buffer(
+            probe, obj, n_trials, raw=True)
+
+    def _noise_key(self, group):
+        # key the noise of each group by its index in the full model, so it
+        # is the same as in a `.CxSimulator` of the full model
+        return self.full_model.cx_groups[group]
+
+    def _group_spikes(self):
+        for item in super(ShardSimulator, self)._group_spikes():
+            yield item
+        for group in self.remote_groups:
+            cx_idxs = self.exchange.read(group, self.t - 1)
+            yield group, (np.zeros(len(cx_idxs), dtype=np.int32), cx_idxs)
+
+    def step(self):
+        super(ShardSimulator, self).step()
+        for group in self.groups:
+            self.exchange.write(
+                group, self.t, self.s[0, self.group_cxs[group]].nonzero()[0])
+
+    def run_shard_steps(self, steps, barrier):
+        """Run ``steps`` steps in lockstep with the other workers.
+
+        Returns
+        -------
+        status : str
+            'ok', 'error' if this worker failed, or 'broken' if another did.
+        value : list or Exception
+            The messages and categories of warnings raised while running,
+            or the exception if the run failed.
+        """
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            try:
+                for _ in range(steps):
+                    self.step()
+                    barrier.wait()
+            except threading.BrokenBarrierError as e:
+                return 'broken', e
+            except Exception as e:
+                barrier.abort()
+                return 'error', e
+        return 'ok', [(str(w.message), w.category) for w in caught]
+
+    def collect_probe_outputs(self):
+        """Return and discard the probe data recorded so far."""
+        outputs = {}
+        for probe, buffer in self.probe_outputs.items():
+            outputs[probe] = buffer.view().copy()
+            buffer.clear()
+        return outputs
+
+
+def _shard_report(sim, model, command):
+    """The overflow or delivery report of ``sim``, referring to groups or
+    synapses by their index in ``model``."""
+    if command == 'overflow_report':
+        group_idxs = {group: i for i, group in enumerate(model.cx_groups)}
+        return [(group_idxs[group],) + tuple(item)
+                for group, *item in sim.overflow_report()]
+
+    synapse_idxs = {synapses: i for i, synapses in enumerate(
+        synapses for group in model.cx_groups
+        for synapses in group.synapses)}
+    return [(synapse_idxs[synapses],) + tuple(item)
+            for _, synapses, *item in sim.delivery_report()]
+
+
+def _run_shard(conn, barrier, model, groups, exchange, seed, check_overflow):
+    """Main loop of a worker process."""
+    try:
+        sim = ShardSimulator(model, groups, exchange, seed,
+                             check_overflow=check_overflow)
+    except Exception as e:
+        conn.send(('error', e))
+        return
+    conn.send(('ok', None))
+
+    inputs = list(model.cx_inputs)
+    all_synapses = [synapses for group in model.cx_groups
+                    for synapses in group.synapses]
+    probe_idxs = {probe: i for i, probe in enumerate(model.cx_probes)}
+    while True:
+        command, args = conn.recv()
+        if command == 'close':
+            break
+        elif command == 'host2chip':
+            spikes, errors = args
+            spikes = [(inputs[i], t, idxs) for i, t, idxs in spikes]
+            errors = [(all_synapses[i], t, e) for i, t, e in errors
+                      if all_synapses[i] in sim.z]
+            sim.host2chip(spikes, errors)
+            conn.send(('ok', None))
+        elif command == 'reset':
+            sim.reset(seed=args)
+            conn.send(('ok', None))
+        elif command in ('overflow_report', 'delivery_report'):
+            conn.send(('ok', _shard_report(sim, model, command)))
+        elif command == 'run':
+            status, caught = sim.run_shard_steps(args, barrier)
+            if status != 'ok':
+                conn.send((status, caught))
+                continue
+            outputs = sim.collect_probe_outputs()
+            conn.send(('ok', (
+                caught,
+                {probe_idxs[probe]: x for probe, x in outputs.items()})))
+    sim.close()
+
+
+class ShardedCxSimulator(CxSimulator):
+    """Emulator running a model in several worker processes.
+
+    The cores chosen by ``allocator`` are divided into ``n_shards``
+    clusters balanced by their compartment and synapse counts, and each
+    cluster is simulated by a `.CxSimulator` in its own worker process.
+    Workers only exchange the indices of spiking compartments, through
+    shared memory, and wait at a barrier once per timestep. Results are
+    identical to those of a `.CxSimulator` with the same seed.
+
+    Worker processes are started with ``fork``, so this is not available
+    on Windows. Multiple trials (``n_trials``) are not supported.
+
+    Parameters
+    ----------
+    model : Model
+        Model specification that will be simulated.
+    seed : int, optional (Default: None)
+        A seed for all stochastic operations done in this simulator.
+    n_shards : int, optional (Default: None)
+        The number of worker processes. Fewer are used if there are fewer
+        cores. If None, use the number of CPUs.
+    allocator : callable, optional (Default: ``one_to_one_allocator``)
+        Function mapping the model to a `.Board` of cores.
+    max_probe_steps : int, optional (Default: None)
+        See `.CxSimulator`.
+    packed_spikes : bool, optional (Default: False)
+        See `.CxSimulator`.
+    check_overflow : bool, optional (Default: True)
+        See `.CxSimulator`.
+    probe_dir : str, optional (Default: None)
+        See `.CxSimulator`.
+    """
+
+    def __init__(self, model, seed=None, n_shards=None,
+                 allocator=one_to_one_allocator, max_probe_steps=None,
+                 packed_spikes=False, check_overflow=True, probe_dir=None):
+        if n_shards is None:
+            n_shards = multiprocessing.cpu_count()
+        if n_shards < 1:
+            raise ValidationError("Must be positive (got %s)" % n_shards,
+                                  attr="n_shards")
+        self.n_shards = n_shards
+        self.allocator = allocator
+        self.workers = []
+        super(ShardedCxSimulator, self).__init__(
+            model, seed=seed, max_probe_steps=max_probe_steps,
+            packed_spikes=packed_spikes, check_overflow=check_overflow,
+            probe_dir=probe_dir)
+
+    def build(self, model, seed=None):
+        """Partition the model and start the worker processes."""
+        model.validate()
+
+        if seed is None:
+            seed = np.random.randint(2**31 - 1)
+
+        logger.debug("ShardedCxSimulator seed: %d", seed)
+        self.seed = seed
+        self.t = 0
+        self.model = model
+        self.inputs = list(model.cx_inputs)
+        self.groups = list(model.cx_groups)
+        self.synapses = [synapses for group in self.groups
+                         for synapses in group.synapses]
+
+        self.probe_outputs = {}
+        for obj in self.inputs + self.groups:
+            for probe in obj.probes:
+                self.probe_outputs[probe] = self._probe_buffer(probe, obj, 1)
+
+        shards = partition_cores(self.allocator(model), self.n_shards)
+        logger.debug("ShardedCxSimulator shard sizes: %s",
+                     [sum(group.n for group in shard) for shard in shards])
+
+        context = multiprocessing.get_context('fork')
+        self.barrier = context.Barrier(len(shards))
+        self.exchange = SpikeExchange(self.groups, context)
+        for groups in shards:
+            conn, worker_conn = context.Pipe()
+            process = context.Process(
+                target=_run_shard,
+                args=(worker_conn, self.barrier, model, groups, self.exchange,
+                      seed, self.check_overflow),
+                daemon=True)
+            process.start()
+            self.workers.append((process, conn))
+
+        # workers refer to probes by index; input probes are recorded by
+        # all workers, so we take them from the first
+        self.all_probes = model.cx_probes
+        self.worker_probes = [
+            set(probe for obj in (self.inputs if k == 0 else []) + groups
+                for probe in obj.probes)
+            for k, groups in enumerate(shards)]
+
+        self._receive_all()
+
+    def _receive_all(self):
+        """Receive a reply from each worker, raising any error."""
+        replies = [conn.recv() for _, conn in self.workers]
+        errors = [value for status, value in replies if status == 'error']
+        if any(status != 'ok' for status, _ in replies):
+            self.close()
+            if len(errors) > 0:
+                raise errors[0]
+            raise SimulationError("Worker processes stopped unexpectedly")
+        return [value for _, value in replies]
+
+    def clear(self):
+        """Stop the worker processes."""
+        for process, conn in self.workers:
+            if process.is_alive():
+                conn.send(('close', None))
+                process.join()
+        self.workers = []
+
+    def reset(self, seed=None):
+        """Reset the simulator state in all workers, without rebuilding.
+
+        See `.CxSimulator.reset`.
+        """
+        if seed is not None:
+            self.seed = seed
+        self.t = 0
+
+        # workers are idle, so no spikes are being exchanged
+        self.exchange.counts[...] = 0
+        for _, conn in self.workers:
+            conn.send(('reset', seed))
+        self._receive_all()
+
+        for input in self.inputs:
+            input.clear_spikes()
+        for probe_output in self.probe_outputs.values():
+            probe_output.clear()
+
+        self._chip2host_sent_steps = 0
+        self._probe_filters.clear()
+
+    def get_state(self):
+        raise SimulationError("Cannot get the state of multiple shards")
+
+    def set_state(self, state):
+        raise SimulationError("Cannot set the state of multiple shards")
+
+    def overflow_report(self):
+        """The overflow that has occurred in all workers.
+
+        See `.CxSimulator.overflow_report`.
+        """
+        for _, conn in self.workers:
+            conn.send(('overflow_report', None))
+        return [(self.groups[i],) + tuple(item)
+                for report in self._receive_all() for i, *item in report]
+
+    def delivery_report(self):
+        """How spikes have been delivered in all workers.
+
+        See `.CxSimulator.delivery_report`.
+        """
+        for _, conn in self.workers:
+            conn.send(('delivery_report', None))
+        reports = {}
+        for report in self._receive_all():
+            for i, *item in report:
+                reports[i] = item
+        return [(synapses.group, synapses) + tuple(reports[i])
+                for i, synapses in enumerate(self.synapses)]
+
+    def host2chip(self, spikes, errors):
+        input_idxs = {input: i for i, input in enumerate(self.inputs)}
+        synapse_idxs = {syn: i for i, syn in enumerate(self.synapses)}
+        spikes = [(input_idxs[input], t, np.asarray(idxs))
+                  for input, t, idxs in spikes]
+        errors = [(synapse_idxs[synapses], t, e)
+                  for synapses, t, e in errors]
+        for _, conn in self.workers:
+            conn.send(('host2chip', (spikes, errors)))
+        self._receive_all()
+
+    def step(self):
+        """Advance the simulation by 1 step (``dt`` seconds)."""
+        self.run_steps(1)
+
+    def run_steps(self, steps):
+        """Simulate for the given number of ``dt`` steps.
+
+        Parameters
+        ----------
+        steps : int
+            Number of steps to run the simulation for.
+        """
+        if self.closed:
+            raise SimulationError("Cannot run closed simulator")
+
+        for _, conn in self.workers:
+            conn.send(('run', steps))
+
+        for k, (caught, outputs) in enumerate(self._receive_all()):
+            for message, category in caught:
+                warnings.warn(message, category)
+            for i, x in outputs.items():
+                probe = self.all_probes[i]
+                if probe not in self.worker_probes[k]:
+                    continue
+                self.probe_outputs[probe].extend(x)
+        self.t += steps
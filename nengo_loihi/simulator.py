@@ -8,12 +8,27 @@ import numpy as np
 import nengo
 import nengo.utils.numpy as npext
 from nengo.exceptions import (
-    BuildError, ReadonlyError, SimulatorClosed, ValidationError)
+    BuildError,
+    ReadonlyError,
+    SimulationError,
+    SimulatorClosed,
+    ValidationError,
+)
+from nengo.builder.processes import SimProcess
 from nengo.simulator import ProbeDict as NengoProbeDict
+from nengo.synapses import LinearFilter
 
 from nengo_loihi.builder import Model
-from nengo_loihi.loihi_cx import CxSimulator
+from nengo_loihi.checkpoint import load_state, save_state
+from nengo_loihi.loihi_cx import (
+    CxSimulator,
+    DiskProbeBuffer,
+    ProbeBuffer,
+    ProbeFiles,
+    sampled_steps,
+)
 from nengo_loihi.loihi_interface import LoihiSimulator
+from nengo_loihi.sharded import ShardedCxSimulator
 from nengo_loihi.splitter import split
 import nengo_loihi.config as config
 
@@ -24,9 +39,10 @@ class ProbeDict(NengoProbeDict):
     """Map from Probe -> ndarray
 
     This is more like a view on the dict that the simulator manipulates.
-    However, for speed reasons, the simulator uses Python lists,
-    and we want to return NumPy arrays. Additionally, this mapping
-    is readonly, which is more appropriate for its purpose.
+    However, for speed reasons, the simulator collects the data of chip
+    probes in growable buffers (see `.ProbeBuffer`), and other simulators
+    use Python lists, and we want to return NumPy arrays. Additionally,
+    this mapping is readonly, which is more appropriate for its purpose.
     """
 
     def __init__(self, raw):
@@ -46,10 +62,15 @@ class ProbeDict(NengoProbeDict):
                     break
         assert key in target, "probed object not found"
 
+        if not isinstance(target[key], (list, ProbeBuffer)):
+            # e.g. the built parameters of an object, or trial-batched data
+            return target[key]
         if (key not in self._cache
                 or len(self._cache[key]) != len(target[key])):
             rval = target[key]
-            if isinstance(rval, list):
+            if isinstance(rval, ProbeBuffer):
+                rval = rval.view()  # a view of the steps so far, not a copy
+            else:
                 rval = np.asarray(rval)
                 rval.setflags(write=False)
             self._cache[key] = rval
@@ -68,6 +89,30 @@ class ProbeDict(NengoProbeDict):
     # TODO: Should we override __repr__ and __str__?
 
 
+def _synapse_step(op, step):
+    """The synapse step of the host operator ``op``, whose step function
+    is ``step``, to save the state of the synapse in a checkpoint.
+
+    Nengo keeps the state of a process in the step function made by the
+    process, which its operator's step function refers to as ``step_f``
+    (in its closure). This is checked, so that a checkpoint fails rather
+    than silently missing state if Nengo stores it differently, or if the
+    process is not a synapse (e.g. it has a random number generator).
+
+    Raises
+    ------
+    SimulationError
+        If the state of the process cannot be saved.
+    """
+    cells = dict(zip(step.__code__.co_freevars, step.__closure__ or ()))
+    step_f = cells['step_f'].cell_contents if 'step_f' in cells else None
+    if not isinstance(step_f, LinearFilter.Step):
+        raise SimulationError(
+            "Cannot save the state of %s on the host; only the state of "
+            "linear synapses can be saved" % (op.process,))
+    return step_f
+
+
 class Simulator(object):
     """Nengo Loihi simulator for Loihi hardware and emulator.
 
@@ -113,6 +158,40 @@ class Simulator(object):
         Whether the simulator should target the emulator (``'sim'``) or
         Loihi hardware (``'loihi'``). If None, *target* will default to
         ``'loihi'`` if NxSDK is installed, and the emulator if it is not.
+    n_trials : int, optional (Default: None)
+        The number of independent trials of the network to run at once in
+        the emulator. Trial ``k`` uses the seed ``seed + k``, both for its
+        noise on the chip and for a host simulator of its own that computes
+        its input to the chip (e.g. from noise processes on the host). Probe
+        data has a leading trial axis, i.e. shape ``(n_trials, n_steps,
+        ...)``; the data of probes on the host are those of the first
+        trial. Only supported by the emulator, for networks with no host
+        part after the chip (i.e. nothing on the host receives chip output)
+        and no learning. If None, a single trial is run and probe data has
+        no trial axis.
+    n_shards : int, optional (Default: None)
+        If given, the emulator is split across this many worker processes
+        (see `.ShardedCxSimulator`), giving the same results as a single
+        process. Not supported together with ``n_trials``.
+    engine : str, optional (Default: None)
+        The engine used by the emulator: ``'numpy'``, or ``'numba'`` to run
+        many steps in one compiled loop (see `.CxSimulator`). If None,
+        ``'numba'`` is used if Numba is installed and supports the model.
+        Not supported together with ``n_shards``.
+    hardware_limits : bool, optional (Default: True)
+        Whether to check that the network fits on Loihi, e.g. that each
+        ensemble fits on one core. If False, networks of any size can be
+        run in the emulator, with the same discretization as on the chip.
+        Only supported by the emulator, without ``n_shards``.
+    probe_dir : str, optional (Default: None)
+        A directory in which all probes of objects on the chip keep their
+        data in files, rather than in memory (see `.DiskProbeBuffer`), so
+        that memory use does not grow with the length of the run. ``data``
+        then returns read-only memory-mapped views of the files. Single
+        probes can be kept on disk (or in memory) with the ``on_disk``
+        config option (see `.add_params`); if ``probe_dir`` is None, their
+        files are kept in a temporary directory, which is removed by
+        `.close`.
 
     Attributes
     ----------
@@ -216,6 +295,10 @@ class Simulator(object):
         ('test_synapses.py:test_decoders', "inaccurate"),
         ('test_actionselection.py:test_basic', "inaccurate"),
         ('test_actionselection.py:test_thalamus', "inaccurate"),
+        # these run with probe.sample_every, but fail their accuracy checks
+        ('test_integrator.py:test_integrator', "inaccurate"),
+        ('test_ensemble.py:test_product*', "inaccurate"),
+        ('test_neurons.py:test_dt_dependence*', "inaccurate"),
 
         # builder inconsistencies
         ('test_connection.py:test_neurons_to_ensemble*',
@@ -266,18 +349,6 @@ class Simulator(object):
         ('test_probe.py:test_defaults', "probe type not implemented"),
         ('test_probe.py:test_ensemble_encoders', "probe type not implemented"),
 
-        # probe.sample_every
-        ('test_integrator.py:test_integrator',
-         "probe.sample_every not implemented"),
-        ('test_oscillator.py:test_oscillator',
-         "probe.sample_every not implemented"),
-        ('test_ensemble.py:test_product*',
-         "probe.sample_every not implemented"),
-        ('test_neurons.py:test_dt_dependence*',
-         "probe.sample_every not implemented"),
-        ('test_probe.py:test_multiple_probes',
-         "probe.sample_every not implemented"),
-
         # needs better place and route
         ('test_ensemble.py:test_eval_points_heuristic*',
          "max number of compartments exceeded"),
@@ -324,9 +395,15 @@ class Simulator(object):
             precompute=False,
             target=None,
             progress_bar=None,
-            remove_passthrough=True
+            remove_passthrough=True,
+            n_trials=None,
+            n_shards=None,
+            engine=None,
+            hardware_limits=True,
+            probe_dir=None,
     ):
         self.closed = True  # Start closed in case constructor raises exception
+        self.probe_files = ProbeFiles(probe_dir, prefix='probe')
         if progress_bar is not None:
             raise NotImplementedError("progress bars not implemented")
 
@@ -348,6 +425,13 @@ class Simulator(object):
         self.networks = None
         self.sims = OrderedDict()
         self._run_steps = None
+        self._trial_host_pres = []
+
+        if seed is None:
+            if network is not None and network.seed is not None:
+                seed = network.seed + 1
+            else:
+                seed = np.random.randint(npext.maxint)
 
         if network is not None:
             nengo.rc.set("decoder_cache", "enabled", "False")
@@ -369,7 +453,16 @@ class Simulator(object):
             self.host = self.networks.host
             self.host_pre = self.networks.host_pre
 
-            if len(self.host_pre.all_objects) > 0:
+            if len(self.host_pre.all_objects) > 0 and n_trials is not None:
+                # each trial computes its own input to the chip, seeded
+                # like the noise of the trial
+                for k in range(n_trials):
+                    name = "host_pre" if k == 0 else "host_pre_trial%d" % k
+                    self.sims[name] = nengo.Simulator(
+                        self.host_pre, dt=self.dt, seed=seed + k,
+                        progress_bar=False, optimize=False)
+                    self._trial_host_pres.append(self.sims[name])
+            elif len(self.host_pre.all_objects) > 0:
                 self.sims["host_pre"] = nengo.Simulator(self.host_pre,
                                                         dt=self.dt,
                                                         progress_bar=False,
@@ -388,18 +481,13 @@ class Simulator(object):
 
             # Build the network into the model
             self.model.build(network)
+            self._set_probes_on_disk(self.networks.original.config, probe_dir)
 
         self._probe_outputs = self.model.params
         self.data = ProbeDict(self._probe_outputs)
         for sim in self.sims.values():
             self.data.add_fallback(sim.data)
 
-        if seed is None:
-            if network is not None and network.seed is not None:
-                seed = network.seed + 1
-            else:
-                seed = np.random.randint(npext.maxint)
-
         if target is None:
             try:
                 import nxsdk
@@ -408,17 +496,56 @@ class Simulator(object):
                 target = 'sim'
         self.target = target
 
+        if n_trials is not None:
+            if n_trials < 1:
+                raise ValidationError("Must be positive (got %s)" % n_trials,
+                                      attr="n_trials")
+            if target not in ("simreal", "sim"):
+                raise ValidationError(
+                    "Multiple trials are only supported by the emulator",
+                    attr="n_trials")
+            if "host" in self.sims:
+                raise ValidationError(
+                    "Multiple trials are not supported when the host "
+                    "receives output from the chip", attr="n_trials")
+        self.n_trials = n_trials
+
+        if n_shards is not None:
+            if target not in ("simreal", "sim"):
+                raise ValidationError(
+                    "Multiple shards are only supported by the emulator",
+                    attr="n_shards")
+            if n_trials is not None:
+                raise ValidationError(
+                    "Cannot use multiple shards with multiple trials",
+                    attr="n_shards")
+            if engine is not None:
+                raise ValidationError(
+                    "Cannot choose the engine of multiple shards",
+                    attr="engine")
+        if not hardware_limits and (
+                target not in ("simreal", "sim") or n_shards is not None):
+            raise ValidationError(
+                "Hardware limits can only be ignored by the emulator, "
+                "without multiple shards", attr="hardware_limits")
+
         logger.info("Simulator target is %r", target)
         logger.info("Simulator precompute is %r", self.precompute)
 
         if target != "simreal":
             self.model.discretize()
 
-        if target in ("simreal", "sim"):
-            self.sims["emulator"] = CxSimulator(self.model, seed=seed)
+        if target in ("simreal", "sim") and n_shards is not None:
+            self.sims["emulator"] = ShardedCxSimulator(
+                self.model, seed=seed, n_shards=n_shards, probe_dir=probe_dir)
+        elif target in ("simreal", "sim"):
+            self.sims["emulator"] = CxSimulator(
+                self.model, seed=seed, n_trials=n_trials, engine=engine,
+                hardware_limits=hardware_limits, probe_dir=probe_dir)
         elif target == 'loihi':
             self.sims["loihi"] = LoihiSimulator(
-                self.model, use_snips=not self.precompute, seed=seed)
+                self.model, use_snips=not self.precompute, seed=seed,
+                probe_dir=probe_dir)
         else:
             raise ValidationError("Must be 'simreal', 'sim', or 'loihi'",
                                   attr="target")
@@ -426,7 +553,8 @@ class Simulator(object):
         assert "emulator" in self.sims or "loihi" in self.sims
 
         self.closed = False
-        self.reset(seed=seed)
+        self.seed = seed
+        self.reset()
 
     def __del__(self):
         """Raise a ResourceWarning if we are deallocated while open."""
@@ -476,29 +604,72 @@ class Simulator(object):
         for sim in self.sims.values():
             if not sim.closed:
                 sim.close()
+        self.probe_files.close()
         self.closed = True
 
+    def _set_probes_on_disk(self, config, probe_dir):
+        """Choose which chip probes keep their data on disk, from their
+        ``on_disk`` option in ``config``, or else whether ``probe_dir`` is
+        given."""
+        for probe in self.model.probes:
+            if probe in self.networks.chip2host_params:
+                continue  # sent to the host rather than recorded
+            on_disk = config[probe].on_disk
+            self.model.objs[probe]['out'].on_disk = (
+                probe_dir is not None if on_disk is None else on_disk)
+
+    def _probe_buffer(self, probe, shape, dtype):
+        """An empty buffer for the data of the chip probe ``probe``, which
+        is kept in a file if the probe is kept on disk."""
+        if self.model.objs[probe]['out'].on_disk:
+            return DiskProbeBuffer(
+                shape, self.probe_files.path(probe), dtype=dtype)
+        return ProbeBuffer(shape, dtype=dtype)
+
+    def _restored_probe_data(self, probe, data):
+        """The probe data of ``probe`` to keep for the saved ``data``.
+
+        ``data`` is used without copying as the memory of a `.ProbeBuffer`,
+        or written to the file of a `.DiskProbeBuffer`.
+        """
+        if self.n_trials is not None:
+            return data  # trial-batched data is kept as an array
+        if len(data) == 0:
+            return []
+        outputs = self._probe_buffer(probe, data.shape[1:], data.dtype)
+        outputs.set_state(data, len(data))
+        return outputs
+
     def _probe(self):
-        """Copy all probed signals to buffers."""
+        """Copy the probed signals of the steps run since the last call
+        to buffers."""
         self._probe_step_time()
 
         for probe in self.model.probes:
             if probe in self.networks.chip2host_params:
                 continue
-            assert probe.sample_every is None, (
-                "probe.sample_every not implemented")
             assert ("loihi" not in self.sims
                     or "emulator" not in self.sims)
             cx_probe = self.model.objs[probe]['out']
-            if "loihi" in self.sims:
-                data = self.sims["loihi"].get_probe_output(cx_probe)
-            elif "emulator" in self.sims:
-                data = self.sims["emulator"].get_probe_output(cx_probe)
-            # TODO: stop recomputing this all the time
-            del self._probe_outputs[probe][:]
-            self._probe_outputs[probe].extend(data)
-            assert len(self._probe_outputs[probe]) == self.n_steps, (
-                len(self._probe_outputs[probe]), self.n_steps)
+            sim = self.sims["loihi" if "loihi" in self.sims else "emulator"]
+            sampled = probe.sample_every is not None
+            if self.n_trials is not None:
+                data = sim.get_probe_output(cx_probe)
+                assert sampled or data.shape[1] == self.n_steps
+                self._probe_outputs[probe] = data
+                continue
+
+            # only collect the (sampled) steps that are new since the last
+            # call
+            outputs = self._probe_outputs[probe]
+            data = sim.get_probe_output(cx_probe, start=len(outputs))
+            if not isinstance(outputs, ProbeBuffer):
+                outputs = self._probe_buffer(
+                    probe, data.shape[1:], data.dtype)
+                self._probe_outputs[probe] = outputs
+            outputs.extend(data)
+            assert sampled or len(outputs) == self.n_steps, (
+                len(outputs), self.n_steps)
 
     def _probe_step_time(self):
         self._time = self._n_steps * self.dt
@@ -523,11 +694,174 @@ class Simulator(object):
         self._n_steps = 0
         self._time = 0
 
+        # reset the chip and host simulators, and any messages in transit;
+        # the host simulator of each trial is seeded like its noise
+        for sim in self.sims.values():
+            if seed is not None and sim in self._trial_host_pres:
+                sim.reset(seed=seed + self._trial_host_pres.index(sim))
+            else:
+                sim.reset(seed=seed)
+        if self.networks is not None:
+            for sender, receiver in self.networks.host2chip_senders.items():
+                del sender.queue[:]
+                receiver.clear()
+            for receiver in self.networks.chip2host_receivers.values():
+                receiver.clear()
+
         # clear probe data
         for probe in self.model.probes:
             self._probe_outputs[probe] = []
         self.data.reset()
 
+    def _host_state(self, name):
+        """The state of the host simulator ``name``.
+
+        Returns the writeable signals and the synapse filters (in the order
+        of the operators that use them), and the state to save, which also
+        includes the probe data.
+        """
+        sim = self.sims[name]
+        steps = dict(zip(sim._step_order, sim._steps))
+        signals = []
+        filters = []
+        seen = set()
+        for op in sim.model.operators:
+            for sig in op.all_signals:
+                if sig.base not in seen and sig.base in sim.signals:
+                    seen.add(sig.base)
+                    if sim.signals[sig.base].flags.writeable:
+                        signals.append(sig.base)
+
+            # processes keep their state in their step function, rather
+            # than in signals
+            if isinstance(op, SimProcess):
+                filters.append(_synapse_step(op, steps[op]))
+
+        state = {'signal%d' % k: sim.signals[sig]
+                 for k, sig in enumerate(signals)}
+        state['n_signals'] = len(signals)
+        state['filters'] = [dict(vars(step_f)) for step_f in filters]
+        for k, probe in enumerate(sim.model.probes):
+            state['probe%d' % k] = np.asarray(sim._probe_outputs[probe])
+        return signals, filters, state
+
+    def _set_host_state(self, name, state):
+        """Restore the state of the host simulator ``name``."""
+        sim = self.sims[name]
+        signals, filters, _ = self._host_state(name)
+        if (state.get('n_signals') != len(signals)
+                or len(state['filters']) != len(filters)):
+            raise SimulationError("The checkpoint is from a different network")
+
+        for k, sig in enumerate(signals):
+            sim.signals[sig][...] = state['signal%d' % k]
+        for step_f, step_state in zip(filters, state['filters']):
+            for attr, value in step_state.items():
+                if isinstance(getattr(step_f, attr), np.ndarray):
+                    getattr(step_f, attr)[...] = value
+                else:
+                    setattr(step_f, attr, value)
+        for k, probe in enumerate(sim.model.probes):
+            sim._probe_outputs[probe] = list(state['probe%d' % k])
+        sim._probe_step_time()
+        sim.data.reset()
+
+    def save_checkpoint(self, path):
+        """Save the simulation state to the directory ``path``.
+
+        The state of the emulator (see `.CxSimulator.get_state`), the host
+        simulators, the messages between them and all probe data are
+        saved, so that the simulation can be resumed with
+        `.load_checkpoint`. Arrays are saved as ``.npy`` files, which are
+        memory-mapped when loaded (see `.save_state`).
+
+        Only the emulator is supported, without multiple shards. The host
+        state saved is that of its signals and linear synapses; a
+        `~nengo.exceptions.SimulationError` is raised if the host has any
+        other process (e.g. a noise process, whose random number generator
+        cannot be saved). The state of Python functions is not saved.
+
+        Parameters
+        ----------
+        path : str
+            The directory to save the checkpoint in. Any existing checkpoint
+            in it is replaced.
+        """
+        if self.closed:
+            raise SimulatorClosed("Cannot save a closed Simulator.")
+        if "emulator" not in self.sims:
+            raise SimulationError(
+                "Checkpoints are only supported by the emulator")
+
+        state = {'n_steps': self._n_steps, 'time': self._time}
+        for k, probe in enumerate(self.model.probes):
+            outputs = self._probe_outputs[probe]
+            state['probe%d' % k] = (outputs.view()
+                                    if isinstance(outputs, ProbeBuffer)
+                                    else np.asarray(outputs))
+        for name in self.sims:
+            if name == "emulator":
+                sim_state = self.sims[name].get_state()
+            else:
+                _, _, sim_state = self._host_state(name)
+            state.update(('%s.%s' % (name, key), value)
+                         for key, value in sim_state.items())
+
+        if self.networks is not None:
+            state['chip2host_queues'] = [
+                receiver.queue[receiver.queue_index:]
+                for receiver in self.networks.chip2host_receivers.values()]
+        save_state(path, state)
+
+    def load_checkpoint(self, path):
+        """Resume the simulation from a checkpoint saved with
+        `.save_checkpoint`.
+
+        The simulator must be built from the same network, with the same
+        arguments (other than ``seed``, which is restored); the state is
+        loaded into its built model. Probe data is memory-mapped from the
+        checkpoint and only read as needed, and is copied to memory when
+        written to (the checkpoint itself is never modified).
+
+        Parameters
+        ----------
+        path : str
+            The directory containing the checkpoint.
+        """
+        if self.closed:
+            raise SimulatorClosed("Cannot load into a closed Simulator.")
+        if "emulator" not in self.sims:
+            raise SimulationError(
+                "Checkpoints are only supported by the emulator")
+
+        state = load_state(path)
+        sim_states = {name: {} for name in self.sims}
+        for key, value in state.items():
+            name, _, sim_key = key.partition('.')
+            if name in sim_states:
+                sim_states[name][sim_key] = value
+
+        for name, sim_state in sim_states.items():
+            if name == "emulator":
+                self.sims[name].set_state(sim_state)
+                self.seed = self.sims[name].seed
+            else:
+                self._set_host_state(name, sim_state)
+
+        if self.networks is not None:
+            for receiver, queue in zip(
+                    self.networks.chip2host_receivers.values(),
+                    state['chip2host_queues']):
+                receiver.queue[:] = queue
+                receiver.queue_index = 0
+
+        self._n_steps = state['n_steps']
+        self._time = state['time']
+        for k, probe in enumerate(self.model.probes):
+            self._probe_outputs[probe] = self._restored_probe_data(
+                probe, state['probe%d' % k])
+        self.data.reset()
+
     def run(self, time_in_seconds):
         """Simulate for the given length of time.
 
@@ -596,6 +930,15 @@ class Simulator(object):
         spikes, errors = self._collect_receiver_info()
         sim.host2chip(spikes, errors)
 
+    def _trials_host2chip(self, sim, steps):
+        """Run the host simulator of each trial, sending its input to the
+        same trial of the chip simulator ``sim``."""
+        for trial, host_pre in enumerate(self._trial_host_pres):
+            host_pre.run_steps(steps)
+            spikes, errors = self._collect_receiver_info()
+            assert len(errors) == 0, "Learning is not supported with trials"
+            sim.host2chip(spikes, errors, trial=trial)
+
     def _chip2host(self, sim):
         probes_receivers = {  # map cx_probes to receivers
             self.model.objs[probe]['out']: receiver
@@ -611,13 +954,21 @@ class Simulator(object):
         else:
             self._make_loihi_run_steps()
 
-    def _make_emu_run_steps(self):
+    def _make_emu_run_steps(self):  # noqa: C901
         host_pre = self.sims.get("host_pre", None)
         emulator = self.sims["emulator"]
         host = self.sims.get("host", None)
 
         if self.precompute:
-            if host_pre is not None and host is not None:
+            if host_pre is not None and self.n_trials is not None:
+                assert host is None, "Trials cannot send output to the host"
+
+                def emu_precomputed_host_pre_trials(steps):
+                    self._trials_host2chip(emulator, steps)
+                    emulator.run_steps(steps)
+                self._run_steps = emu_precomputed_host_pre_trials
+
+            elif host_pre is not None and host is not None:
 
                 def emu_precomputed_host_pre_and_host(steps):
                     host_pre.run_steps(steps)
@@ -725,13 +1076,15 @@ class Simulator(object):
                 # Need to write to board, otherwise it will wait indefinitely
                 h2c = self.sims["loihi"].nengo_io_h2c
                 c2h = self.sims["loihi"].nengo_io_c2h
+                # no probes are sampled, so only the unsampled are sent
+                c2h_count = self.sims["loihi"].nengo_io_c2h_count
 
                 print(traceback.format_exc())
                 print("\nAttempting to end simulation...")
 
                 for _ in range(steps):
                     h2c.write(h2c.numElements, [0] * h2c.numElements)
-                    c2h.read(c2h.numElements)
+                    c2h.read(c2h_count)
                 self.sims["loihi"].wait_for_completion()
                 self.sims["loihi"].n2board.nxDriver.stopExecution()
                 self.sims["loihi"].n2board.nxDriver.stopDriver()
@@ -752,7 +1105,10 @@ class Simulator(object):
         sample_every : float, optional (Default: None)
             The sampling period of the probe to create a range for.
             If None, a time value for every ``dt`` will be produced.
+        dt : float, optional (Default: None)
+            The same as ``sample_every``, as named by ``nengo.Simulator``.
         """
+        sample_every = dt if sample_every is None else sample_every
         period = 1 if sample_every is None else sample_every / self.dt
         steps = np.arange(1, self.n_steps + 1)
-        return self.dt * steps[steps % period < 1]
+        return self.dt * steps[sampled_steps(period, 0, self.n_steps)]
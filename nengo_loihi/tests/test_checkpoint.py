@@ -0,0 +1,187 @@
+import os
+
+import nengo
+from nengo.exceptions import SimulationError
+import numpy as np
+import pytest
+
+import nengo_loihi
+from nengo_loihi.checkpoint import load_state, save_state
+from nengo_loihi.loihi_cx import (
+    CxAxons,
+    CxGroup,
+    CxModel,
+    CxProbe,
+    CxSimulator,
+    CxSpikeInput,
+    CxSynapses,
+)
+
+
+def test_save_load_state(tmpdir):
+    path = str(tmpdir.join("checkpoint"))
+    with pytest.raises(SimulationError, match="No checkpoint"):
+        load_state(path)
+
+    x = np.arange(10, dtype=np.int32)
+    save_state(path, dict(x=x, n=3, values=[(1, 'a')]))
+    save_state(path, dict(x=x + 1, n=4, values=[(2, 'b')]))
+    state = load_state(path)
+    assert set(os.listdir(path)) == {'x.npy', 'values.pkl'}
+    assert isinstance(state['x'], np.memmap)
+    assert np.array_equal(state['x'], x + 1)
+    assert state['n'] == 4
+    assert state['values'] == [(2, 'b')]
+
+    # loaded arrays are copy-on-write
+    state['x'][:] = 0
+    assert np.array_equal(load_state(path)['x'], x + 1)
+
+
+def test_save_state_interrupted(tmpdir, monkeypatch):
+    path = str(tmpdir.join("checkpoint"))
+    x = np.arange(10, dtype=np.int32)
+    save_state(path, dict(x=x))
+
+    # the process dies after moving the old checkpoint aside, but before
+    # moving the new one to its place
+    rename = os.rename
+
+    def interrupted_rename(src, dst):
+        if src.endswith('.tmp'):
+            raise KeyboardInterrupt()
+        rename(src, dst)
+
+    monkeypatch.setattr(os, 'rename', interrupted_rename)
+    with pytest.raises(KeyboardInterrupt):
+        save_state(path, dict(x=x + 1))
+    monkeypatch.undo()
+    assert not os.path.exists(path)
+    assert np.array_equal(load_state(path)['x'], x)
+
+    # the next save cleans up
+    save_state(path, dict(x=x + 2))
+    assert os.listdir(str(tmpdir)) == ['checkpoint']
+    assert np.array_equal(load_state(path)['x'], x + 2)
+
+
+def make_model(rng, n=20):
+    model = CxModel()
+    input = CxSpikeInput(n)
+    for t in range(1, 80, 3):
+        input.add_spikes(t, rng.choice(n, size=5, replace=False))
+    input.add_spikes(7, np.arange(n), trial=1)
+    model.add_input(input)
+
+    group = CxGroup(n)
+    group.configure_lif(tau_rc=0.02, tau_ref=0.002)
+    group.configure_filter(0.005)
+    group.enableNoise[:] = 1
+    group.noiseExp0 = -2
+    group.noiseMantOffset0 = 0
+    synapses = CxSynapses(n)
+    synapses.set_full_weights(rng.uniform(-5, 20, size=(n, n)))
+    synapses.set_delays(rng.randint(0, 3, size=(n, n)))
+    group.add_synapses(synapses)
+    axons = CxAxons(n)
+    axons.target = synapses
+    input.add_axons(axons)
+
+    probes = [CxProbe(target=group, key=key) for key in ('v', 's')]
+    for probe in probes:
+        group.add_probe(probe)
+    model.add_group(group)
+    model.discretize()
+    return model, probes
+
+
+@pytest.mark.parametrize("max_probe_steps", [None, 30])
+def test_cx_simulator_state(max_probe_steps, tmpdir, rng, seed):
+    model, probes = make_model(rng)
+    path = str(tmpdir.join("checkpoint"))
+    kwargs = dict(seed=seed, n_trials=2, max_probe_steps=max_probe_steps,
+                  packed_spikes=True)
+
+    with CxSimulator(model, **kwargs) as sim:
+        sim.run_steps(100)
+        ref = [sim.get_probe_output(probe).copy() for probe in probes]
+
+    with CxSimulator(model, **kwargs) as sim:
+        sim.run_steps(40)
+        save_state(path, sim.get_state())
+
+    with CxSimulator(model, **kwargs) as sim:
+        sim.set_state(load_state(path))
+        assert sim.t == 40
+        sim.run_steps(60)
+        out = [sim.get_probe_output(probe) for probe in probes]
+
+    for x, y in zip(ref, out):
+        assert np.any(x != 0)
+        assert np.array_equal(x, y)
+
+    with CxSimulator(model, seed=seed) as sim:
+        with pytest.raises(SimulationError, match="different model"):
+            sim.set_state(load_state(path))
+
+
+@pytest.mark.parametrize("precompute", [True, False])
+def test_simulator_checkpoint(precompute, tmpdir, seed):
+    def make_net():
+        with nengo.Network(seed=seed) as net:
+            stim = nengo.Node(lambda t: np.sin(10 * t))
+            a = nengo.Ensemble(100, 1)
+            b = nengo.Ensemble(50, 1)
+            nengo.Connection(stim, a)
+            nengo.Connection(a, b, function=lambda x: x**2)
+            probes = [nengo.Probe(b, synapse=0.01), nengo.Probe(a.neurons)]
+
+            if not precompute:
+                out = nengo.Node(size_in=1)
+                conn = nengo.Connection(
+                    a, out, function=lambda x: 0,
+                    learning_rule_type=nengo.PES(learning_rate=1e-3))
+                nengo.Connection(out, conn.learning_rule)
+                nengo.Connection(stim, conn.learning_rule, transform=-1)
+                probes.append(nengo.Probe(out, synapse=0.01))
+        return net, probes
+
+    path = str(tmpdir.join("checkpoint"))
+    net, probes = make_net()
+    with nengo_loihi.Simulator(
+            net, precompute=precompute, target='sim') as sim:
+        sim.run(0.1)
+        sim.run(0.1)
+    ref = [sim.data[probe] for probe in probes]
+
+    with nengo_loihi.Simulator(
+            net, precompute=precompute, target='sim') as sim:
+        sim.run(0.1)
+        sim.save_checkpoint(path)
+
+    # resuming in a new simulator of a new network
+    net, probes = make_net()
+    with nengo_loihi.Simulator(
+            net, precompute=precompute, target='sim') as sim:
+        sim.load_checkpoint(path)
+        assert sim.n_steps == 100
+        sim.run(0.1)
+    out = [sim.data[probe] for probe in probes]
+
+    for x, y in zip(ref, out):
+        assert np.any(x != 0)
+        assert np.array_equal(x, y)
+
+
+def test_checkpoint_host_process(tmpdir, seed):
+    with nengo.Network(seed=seed) as net:
+        stim = nengo.Node(nengo.processes.WhiteSignal(1, high=5))
+        a = nengo.Ensemble(50, 1)
+        nengo.Connection(stim, a)
+        nengo.Probe(a, synapse=0.01)
+
+    # the state of the random number generator cannot be saved
+    with nengo_loihi.Simulator(net, target='sim') as sim:
+        sim.run(0.01)
+        with pytest.raises(SimulationError, match="Cannot save the state"):
+            sim.save_checkpoint(str(tmpdir.join("checkpoint")))
@@ -0,0 +1,188 @@
+import nengo
+from nengo.exceptions import BuildError, SimulationError, ValidationError
+import numpy as np
+import pytest
+
+import nengo_loihi
+from nengo_loihi.jit import JitEngine, numba
+from nengo_loihi.loihi_cx import (
+    CxAxons,
+    CxGroup,
+    CxModel,
+    CxProbe,
+    CxSimulator,
+    CxSpikeInput,
+    CxSynapses,
+)
+
+
+def make_model(rng, n=20):
+    model = CxModel()
+
+    input = CxSpikeInput(n)
+    for t in range(1, 40):
+        input.add_spikes(t, rng.choice(n, size=5, replace=False))
+    input.add_spikes(5, np.arange(n), trial=1)
+    model.add_input(input)
+
+    groups = []
+    probes = [CxProbe(target=input, key='s', slice=slice(3, 12))]
+    input.add_probe(probes[0])
+    for k, location in enumerate(('core', 'core', 'cpu')):
+        group = CxGroup(n, location=location)
+        group.configure_lif(tau_rc=0.02, tau_ref=0.002)
+        group.configure_filter(0.005)
+        group.bias[:] = 0.5 * k
+        group.enableNoise[:] = k > 0
+        group.noiseExp0 = -2
+        group.noiseMantOffset0 = 0
+        group.noiseAtDendOrVm = max(k - 1, 0)
+
+        synapses = CxSynapses(n)
+        synapses.set_full_weights(
+            rng.uniform(-5, 20, size=(n, n)) * (rng.rand(n, n) < 0.5))
+        synapses.set_delays(rng.randint(0, 3, size=(n, n)))
+        group.add_synapses(synapses)
+        axons = CxAxons(n)
+        axons.target = synapses
+        (groups[-1] if groups else input).add_axons(axons)
+
+        for key in ('u', 'v', 's'):
+            probes.append(CxProbe(target=group, key=key, slice=slice(2, 15)))
+            group.add_probe(probes[-1])
+        model.add_group(group)
+        groups.append(group)
+
+    # an input with enough axons to overflow
+    n_axons = 1000
+    input = CxSpikeInput(n_axons)
+    for t in range(10, 15):
+        input.add_spikes(t, np.arange(n_axons))
+    model.add_input(input)
+    synapses = CxSynapses(n_axons)
+    synapses.set_full_weights(np.full((n_axons, n), 5.))
+    groups[1].add_synapses(synapses)
+    axons = CxAxons(n_axons)
+    axons.target = synapses
+    input.add_axons(axons)
+
+    model.discretize()
+    return model, probes
+
+
+@pytest.mark.parametrize("max_probe_steps", [None, 20])
+def test_jit_engine(max_probe_steps, rng, seed, monkeypatch):
+    model, probes = make_model(rng)
+    kwargs = dict(seed=seed, n_trials=2, max_probe_steps=max_probe_steps,
+                  packed_spikes=True, engine='numpy')
+
+    assert CxSimulator.strict  # Tests should be run in strict mode
+    CxSimulator.strict = False
+    try:
+        with CxSimulator(model, **kwargs) as sim:
+            with pytest.warns(UserWarning) as ref_record:
+                for _ in range(60):
+                    sim.step()
+            ref = [sim.get_probe_output(p).copy() for p in probes]
+            ref_report = sim.overflow_report()
+            ref_state = [x.copy() for x in (sim.q, sim.u, sim.v, sim.w)]
+
+        # the compiled loop runs as Python if Numba is not installed
+        monkeypatch.setattr(JitEngine, 'max_steps', 16)
+        with CxSimulator(model, **kwargs) as sim:
+            engine = JitEngine(sim)
+            with pytest.warns(UserWarning) as record:
+                engine.run_steps(25)
+                engine.run_steps(35)
+            out = [sim.get_probe_output(p) for p in probes]
+            report = sim.overflow_report()
+            state = [sim.q, sim.u, sim.v, sim.w]
+    finally:
+        CxSimulator.strict = True  # change back to True for subsequent tests
+
+    assert len(ref_report) > 0
+    assert report == ref_report
+    assert [str(w.message) for w in record] == [
+        str(w.message) for w in ref_record]
+    for x, y in zip(ref + ref_state, out + state):
+        assert np.array_equal(x, y)
+    assert all(np.any(x != 0) for x in ref[3::3])
+    assert max_probe_steps is not None or np.any(ref[0])  # input spikes
+
+
+def test_jit_engine_strict_overflow(rng, seed):
+    model, probes = make_model(rng)
+    kwargs = dict(seed=seed, n_trials=2, engine='numpy')
+
+    assert CxSimulator.strict
+    with CxSimulator(model, **kwargs) as sim:
+        with pytest.raises(SimulationError) as ref_error:
+            for _ in range(60):
+                sim.step()
+        ref_t = sim.t
+
+    # the compiled loop stops at the step with the overflow
+    with CxSimulator(model, **kwargs) as sim:
+        engine = JitEngine(sim)
+        with pytest.raises(SimulationError) as error:
+            engine.run_steps(60)
+        assert sim.t == ref_t
+        assert str(error.value) == str(ref_error.value)
+        assert all(len(sim.get_probe_output(p)[0]) == ref_t for p in probes)
+
+
+def test_engine_selection():
+    model = CxModel()
+    group = CxGroup(5)
+    group.configure_relu()
+    group.add_probe(CxProbe(target=group, key='v'))
+    model.add_group(group)
+
+    with pytest.raises(BuildError, match="Unrecognized engine"):
+        CxSimulator(model, engine='fast')
+    with CxSimulator(model, engine='numpy') as sim:
+        assert sim._jit is None
+
+    if numba is None:
+        with pytest.raises(BuildError, match="requires Numba"):
+            CxSimulator(model, engine='numba')
+        return
+
+    # models that are not discretized are run with NumPy
+    with pytest.warns(UserWarning, match="only discretized models"):
+        with CxSimulator(model, engine='numba') as sim:
+            assert sim._jit is None
+
+    model.discretize()
+    with CxSimulator(model) as sim:
+        assert sim._jit is not None
+    with CxSimulator(model, event_driven=True) as sim:
+        assert sim._jit is None
+
+
+def test_simulator_engine(seed):
+    pytest.importorskip('numba')
+
+    with nengo.Network(seed=seed) as net:
+        stim = nengo.Node(lambda t: np.sin(10 * t))
+        a = nengo.Ensemble(100, 1)
+        b = nengo.Ensemble(50, 1)
+        nengo.Connection(stim, a)
+        nengo.Connection(a, b, function=lambda x: x**2)
+        b_p = nengo.Probe(b, synapse=0.01)
+        spikes_p = nengo.Probe(a.neurons)
+
+    data = {}
+    for engine in ('numpy', 'numba'):
+        with nengo_loihi.Simulator(
+                net, precompute=True, target='sim', engine=engine) as sim:
+            assert (sim.sims["emulator"]._jit is None) == (engine == 'numpy')
+            sim.run(0.1)
+            sim.run(0.1)
+        data[engine] = (sim.data[b_p], sim.data[spikes_p])
+
+    for x, y in zip(data['numpy'], data['numba']):
+        assert np.array_equal(x, y)
+
+    with pytest.raises(ValidationError, match="engine of multiple shards"):
+        nengo_loihi.Simulator(net, target='sim', n_shards=2, engine='numba')
@@ -0,0 +1,175 @@
+import gc
+import os
+
+import nengo
+from nengo.exceptions import BuildError
+import numpy as np
+import pytest
+
+import nengo_loihi
+from nengo_loihi.jobs import JobServer, load_model, save_model
+from nengo_loihi.loihi_cx import (
+    CxAxons,
+    CxGroup,
+    CxModel,
+    CxProbe,
+    CxSimulator,
+    CxSpikeInput,
+    CxSynapses,
+)
+
+
+def make_model(rng, n=20):
+    model = CxModel()
+    input = CxSpikeInput(n)
+    for t in range(1, 50, 2):
+        input.add_spikes(t, rng.choice(n, size=5, replace=False))
+    model.add_input(input)
+
+    probes = []
+    weights = rng.uniform(-5, 20, size=(n, n))
+    source = input
+    for k in range(2):
+        group = CxGroup(n)
+        group.configure_lif(tau_rc=0.02, tau_ref=0.002)
+        group.configure_filter(0.005)
+        group.enableNoise[:] = k > 0
+        group.noiseExp0 = -2
+        group.noiseMantOffset0 = 0
+
+        synapses = CxSynapses(n)
+        synapses.set_full_weights(weights)
+        group.add_synapses(synapses)
+        axons = CxAxons(n)
+        axons.target = synapses
+        source.add_axons(axons)
+
+        for key in ('v', 's'):
+            probes.append(CxProbe(target=group, key=key))
+            group.add_probe(probes[-1])
+        model.add_group(group)
+        source = group
+
+    model.discretize()
+    return model, input, probes
+
+
+def make_network(n_neurons):
+    with nengo.Network(seed=0) as net:
+        stim = nengo.Node(lambda t: np.sin(10 * t))
+        a = nengo.Ensemble(n_neurons, 1)
+        nengo.Connection(stim, a)
+        nengo.Probe(a, synapse=0.01)
+        nengo.Probe(a.neurons)
+    return net
+
+
+def test_save_load_model(rng, tmpdir):
+    model, _, probes = make_model(rng)
+    path = str(tmpdir.join("model"))
+    save_model(path, model)
+    loaded = load_model(path)
+
+    groups = list(model.cx_groups)
+    loaded_groups = list(loaded.cx_groups)
+    weights = [group.synapses[0].weights for group in loaded_groups]
+    for w, w_ref in zip(weights, [g.synapses[0].weights for g in groups]):
+        assert all(isinstance(x, np.memmap) for x in w)
+        assert all(not x.flags.writeable for x in w)
+        assert all(np.array_equal(x, y) for x, y in zip(w, w_ref))
+
+    # arrays shared by the model are shared by the loaded model
+    assert all(x is y for x, y in zip(*weights))
+    assert loaded_groups[0].probes[0].target is loaded_groups[0]
+
+
+def test_job_server(rng, seed):
+    model, input, probes = make_model(rng)
+    extra = [(input, 2, [0, 1, 2]), (input, 6, np.arange(10))]
+
+    def run(seed, spikes=()):
+        for i, t, idxs in spikes:
+            input.add_spikes(t, idxs)
+        with CxSimulator(model, seed=seed) as sim:
+            sim.run_steps(60)
+            out = [sim.get_probe_output(probe) for probe in probes]
+        for _, t, _ in spikes:
+            del input.spikes[t]
+        return out
+
+    seeds = [seed, seed + 1, seed]
+    with JobServer(n_workers=2) as server:
+        jobs = [server.submit(model, 60, seed=s) for s in seeds]
+        jobs.append(server.submit(model, 60, seed=seed, spikes=extra))
+        error_job = server.submit(model, 60, engine='fast')
+        outputs = [job.result() for job in jobs]
+        assert all(job.done() for job in jobs)
+        with pytest.raises(BuildError, match="Unrecognized engine"):
+            error_job.result()
+
+        # the same model is only written once
+        assert server.add_model(model) == 0
+
+    assert [job.seed for job in jobs[:3]] == seeds
+    for s, spikes, output in zip(seeds + [seed], [()] * 3 + [extra],
+                                 outputs):
+        assert list(output) == probes
+        for probe, x in zip(probes, run(s, spikes)):
+            assert np.array_equal(output[probe], x)
+    assert any(np.any(output[probes[-1]] != outputs[1][probes[-1]])
+               for output in outputs[::2])
+
+
+def test_job_server_releases_models(rng, seed):
+    with JobServer(n_workers=1, max_cached_sims=1) as server:
+        models = [make_model(rng) for _ in range(2)]
+        ref = [server.submit(model, 30, seed=seed).result()
+               for model, _, _ in models]
+        model_dirs = [server._model_path(i) for i in range(2)]
+        assert all(os.path.exists(path) for path in model_dirs)
+
+        # each model is loaded again after the other evicts it
+        for (model, _, probes), ref_output in zip(models, ref):
+            output = server.submit(model, 30, seed=seed).result()
+            for probe in probes:
+                assert np.array_equal(output[probe], ref_output[probe])
+
+        # the server does not keep models alive, and removes their files
+        # once they are collected and all their jobs have finished
+        job = server.submit(models[0][0], 30, seed=seed)
+        del models[0]
+        gc.collect()
+        assert len(server.models) == 1
+        assert os.path.exists(model_dirs[0])
+        job.result()
+        assert not os.path.exists(model_dirs[0])
+        assert os.path.exists(model_dirs[1])
+        assert server.add_model(models[0][0]) == 1
+
+
+def test_job_server_network(seed):
+    def run(n_neurons, seed):
+        net = make_network(n_neurons)
+        with nengo_loihi.Simulator(net, seed=seed, target='sim') as sim:
+            sim.run(0.1)
+        return [sim.data[probe] for probe in net.all_probes]
+
+    with JobServer(n_workers=1) as server:
+        jobs = [server.submit_network(make_network, 0.1, args=(n,), seed=seed)
+                for n in (50, 50)]
+        jobs.append(server.submit_network(
+            'nengo_loihi.tests.test_jobs:make_network', 0.1, args=(30,),
+            seed=seed))
+        # a random seed is chosen, and the cached simulator is reseeded
+        jobs.append(server.submit_network(make_network, 0.1, args=(50,)))
+        outputs = [job.result() for job in jobs]
+
+        # results are only kept by the job once retrieved
+        assert len(server._results) == 0
+        assert jobs[0].done()
+        assert jobs[0].result() is not None
+
+    for n, job, output in zip((50, 50, 30, 50), jobs, outputs):
+        for x, y in zip(output, run(n, job.seed)):
+            assert np.any(x != 0)
+            assert np.array_equal(x, y)
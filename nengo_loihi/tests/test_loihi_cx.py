@@ -1,11 +1,29 @@
+import os
+
 import nengo
-from nengo.exceptions import SimulationError
+from nengo.exceptions import BuildError, SimulationError
 import numpy as np
 import pytest
 
+from nengo_loihi.checkpoint import load_state, save_state
+from nengo_loihi.jit import JitEngine
 from nengo_loihi.loihi_api import VTH_MAX
 from nengo_loihi.loihi_cx import (
-    CxAxons, CxGroup, CxModel, CxProbe, CxSimulator, CxSpikeInput, CxSynapses)
+    CxAxons,
+    CxGroup,
+    CxModel,
+    CxProbe,
+    CxSimulator,
+    CxSpikeInput,
+    CxSynapses,
+    DiskProbeBuffer,
+    NoiseGenerator,
+    PackedProbeBuffer,
+    ProbeBuffer,
+    SampledProbeBuffer,
+    sampled_steps,
+    SynapseTable,
+)
 from nengo_loihi.loihi_interface import LoihiSimulator
 
 
@@ -162,3 +180,1044 @@ def test_uv_overflow(n_axons, Simulator, plt, allclose):
 
     assert allclose(emu_u, sim_u)
     assert allclose(emu_v, sim_v)
+
+
+def test_overflow_report():
+    n_axons = 1000
+    nt = 15
+
+    model = CxModel()
+    input = CxSpikeInput(n_axons)
+    for t in np.arange(1, nt+1):
+        input.add_spikes(t, np.arange(n_axons))
+    model.add_input(input)
+
+    groups = []
+    for k in range(2):
+        group = CxGroup(1 + k, label="g%d" % k)
+        group.configure_relu()
+        group.configure_filter(0.1)
+        group.vmin = -2**22
+
+        synapses = CxSynapses(n_axons)
+        synapses.set_full_weights(np.ones((n_axons, group.n)) / (k + 1))
+        group.add_synapses(synapses)
+        axons = CxAxons(n_axons)
+        axons.target = synapses
+        input.add_axons(axons)
+
+        probe = CxProbe(target=group, key='u')
+        group.add_probe(probe)
+        model.add_group(group)
+        groups.append(group)
+    model.discretize()
+    for group in groups:
+        group.vth[:] = VTH_MAX  # must set after `discretize`
+
+    assert CxSimulator.strict  # Tests should be run in strict mode
+    CxSimulator.strict = False
+    try:
+        with CxSimulator(model) as sim:
+            with pytest.warns(UserWarning) as record:
+                sim.run_steps(nt)
+            report = sim.overflow_report()
+            u = sim.get_probe_output(probe)
+    finally:
+        CxSimulator.strict = True  # change back to True for subsequent tests
+
+    # overflow is only reported once for each group and stage
+    assert len(report) > 0
+    assert len(record) == len(report)
+    assert len(set((group, stage) for group, stage, _, _ in report)) == len(
+        report)
+    for group, stage, count, first_step in report:
+        assert group in groups
+        assert stage in CxSimulator.overflow_stages
+        assert group.n <= count <= group.n * nt
+        assert 1 < first_step <= nt
+        assert "Overflow in %s of %s" % (stage, group) in "".join(
+            str(w.message) for w in record)
+
+    # without checks, values are not wrapped and no overflow is recorded
+    with CxSimulator(model, check_overflow=False) as sim:
+        sim.run_steps(nt)
+        assert sim.overflow_report() == []
+        assert not np.array_equal(sim.get_probe_output(probe), u)
+
+    with CxSimulator(model) as sim:
+        sim.run_steps(1)
+        assert sim.overflow_report() == []
+
+
+@pytest.mark.parametrize("delays", [False, True])
+def test_synapse_table_deliver(delays, rng):
+    n_axons = 6
+    weights = [rng.uniform(-1, 1, size=(2, 3)) for _ in range(3)]
+    indices = [rng.randint(0, 4, size=(2, 3)) for _ in range(3)]
+    indices[0][0, :] = 2  # repeated indices must all be accumulated
+    axon_to_weight_map = np.array([0, 1, 2, 2, 1, 0])
+    cx_bases = np.array([0, 4, 2, -2048, 6, 1])
+
+    synapses = CxSynapses(n_axons)
+    synapses.set_population_weights(
+        weights, indices, axon_to_weight_map, cx_bases, pop_type=32)
+    if delays:
+        synapses.set_delays([rng.randint(0, 3, size=(2, 3)) for _ in range(3)])
+        assert synapses.synapse_fmt.dlyBits == 2
+    table = SynapseTable(synapses)
+
+    axon_ids = np.array([0, 1, 3, 5, 0, 2, 4], dtype=np.int32)
+    atoms = np.array([0, 1, 0, 1, 0, 1, 0], dtype=np.int32)
+
+    t = 5
+    n_delays = synapses.max_delay() + 1
+    q = np.zeros((n_delays, 10), dtype=np.float32)
+    table.deliver(q, axon_ids, atoms, t=t)
+
+    # adding only to the entries that receive input gives the same result
+    table.touch_ratio = 0
+    q_touched = np.zeros_like(q)
+    table.deliver(q_touched, axon_ids, atoms, t=t)
+    assert np.array_equal(q_touched, q)
+
+    q_ref = np.zeros((n_delays, 10), dtype=np.float32)
+    for axon_id, atom in zip(axon_ids, atoms):
+        cx_base = synapses.axon_cx_base(axon_id)
+        if cx_base is None:
+            continue
+        w, i = synapses.axon_weights_indices(axon_id, atom=atom)
+        d = (0 if synapses.delays is None else
+             synapses.delays[synapses.axon_weight_idx(axon_id)][atom])
+        np.add.at(q_ref, ((t + d) % n_delays, cx_base + i), w)
+
+    assert np.allclose(q, q_ref)
+
+    # deliver the same spikes on several steps and trials at once
+    steps = np.array([0, 0, 1, 1, 2, 2, 2])
+    trials = np.array([0, 1, 1, 0, 0, 1, 1])
+    shape = (3 + n_delays - 1, 2, 10)
+    x_ref = np.zeros(shape)
+    for j, (k, trial) in enumerate(zip(steps, trials)):
+        q = np.zeros((n_delays, 10))
+        table.deliver(q, axon_ids[[j]], atoms[[j]], t=0)
+        x_ref[k:k + n_delays, trial] += q
+
+    table.dense_ratio = np.inf  # use dense weights whenever allowed
+    for allow_dense in (False, True):
+        x = table.deliver_steps(
+            shape, steps, axon_ids, atoms, trials, allow_dense=allow_dense)
+        assert np.allclose(x, x_ref)
+    assert table.dense_weights(10).shape == (n_delays, 12, 10)
+
+
+@pytest.mark.parametrize("discretize", [False, True])
+def test_delivery_report(discretize, rng, seed, monkeypatch):
+    n = 256
+    model = CxModel()
+    input = CxSpikeInput(n)
+    for t in range(1, 20):
+        # only one input spikes on the first steps, then most do
+        input.add_spikes(t, rng.choice(n, size=1 if t < 10 else 200,
+                                       replace=False))
+    model.add_input(input)
+
+    group = CxGroup(n)
+    group.configure_relu()
+    group.configure_filter(0.01)
+    synapses = CxSynapses(n)
+    synapses.set_full_weights(rng.uniform(-1, 1, size=(n, n)))
+    group.add_synapses(synapses)
+    axons = CxAxons(n)
+    axons.target = synapses
+    input.add_axons(axons)
+    probe = CxProbe(target=group, key='v')
+    group.add_probe(probe)
+    model.add_group(group)
+    if discretize:
+        model.discretize()
+
+    def run():
+        with CxSimulator(model, seed=seed) as sim:
+            for _ in range(20):
+                sim.step()
+            return sim.get_probe_output(probe), sim.delivery_report()
+
+    out, report = run()
+    assert report == [(group, synapses, 9 if discretize else 19,
+                       10 if discretize else 0)]
+
+    # summing all weights gives the same result
+    monkeypatch.setattr(SynapseTable, 'dense_ratio', 0)
+    ref, ref_report = run()
+    assert np.array_equal(out, ref) and np.any(ref != 0)
+    assert ref_report == [(group, synapses, 19, 0)]
+
+
+def test_hardware_limits(rng, seed):
+    n_axons, n = 100, 5000
+    model = CxModel()
+    input = CxSpikeInput(n_axons)
+    for t in range(1, 20, 4):
+        input.add_spikes(t, np.arange(n_axons))
+    model.add_input(input)
+
+    group = CxGroup(n)
+    group.configure_relu()
+    group.configure_filter(0.01)
+    synapses = CxSynapses(n_axons)
+    indices = [rng.choice(n, size=(1, 8), replace=False)
+               for _ in range(n_axons)]
+    synapses.set_population_weights(
+        [rng.uniform(1, 2, size=(1, 8)) for _ in range(n_axons)], indices,
+        np.arange(n_axons), np.zeros(n_axons, dtype=int), pop_type=32)
+    group.add_synapses(synapses)
+    axons = CxAxons(n_axons)
+    axons.target = synapses
+    input.add_axons(axons)
+    probe = CxProbe(target=group, key='v')
+    group.add_probe(probe)
+    model.add_group(group)
+    model.discretize()
+
+    with pytest.raises(AssertionError, match="idxBits out of range"):
+        synapses.validate()
+    with pytest.raises(BuildError, match="Number of compartments"):
+        CxSimulator(model)
+
+    with CxSimulator(model, seed=seed, hardware_limits=False) as sim:
+        sim.run_steps(20)
+        v = sim.get_probe_output(probe)
+    targets = np.unique(np.hstack(indices).ravel())
+    assert np.all(np.any(v[:, targets] > 0, axis=0))
+    assert np.all(np.delete(v, targets, axis=1) == 0)
+
+
+def test_axons_map_cx_spikes():
+    axons = CxAxons(4)
+    axons.set_axon_map([2, -1, 0, 3, -1], cx_atoms=[1, 0, 2, 0, 1])
+
+    axon_ids, atoms = axons.map_cx_spikes(np.array([0, 1, 3, 4]))
+    assert np.array_equal(axon_ids, [2, 3])
+    assert np.array_equal(atoms, [1, 0])
+
+    axons = CxAxons(4)
+    axon_ids, atoms = axons.map_cx_spikes(np.array([1, 3]))
+    assert np.array_equal(axon_ids, [1, 3])
+    assert np.array_equal(atoms, [0, 0])
+
+
+@pytest.mark.parametrize("max_steps", [None, 5])
+def test_probe_buffer(max_steps, rng):
+    data = rng.uniform(-1, 1, size=(13, 3)).astype(np.float32)
+
+    buffer = ProbeBuffer((3,), max_steps=max_steps)
+    buffer.reserve(4)
+    for x in data[:4]:
+        buffer.append(x)
+    buffer.extend(data[4:11])
+    buffer.extend(data[11:])
+
+    kept = data if max_steps is None else data[-max_steps:]
+    assert buffer.n_steps == len(data)
+    assert len(buffer) == len(kept)
+    assert np.array_equal(buffer.view(), kept)
+    assert np.array_equal(buffer.view(start=11), data[11:])
+    assert not buffer.view().flags.writeable
+
+    if max_steps is not None:
+        with pytest.raises(SimulationError):
+            buffer.view(start=0)
+
+
+@pytest.mark.parametrize("max_steps", [None, 5])
+def test_packed_probe_buffer(max_steps, rng):
+    data = rng.uniform(0, 1, size=(13, 2, 11)) > 0.5
+
+    buffer = PackedProbeBuffer((2, 11), max_steps=max_steps)
+    buffer.extend(data[:7])
+    for x in data[7:]:
+        buffer.append(x)
+
+    kept = data if max_steps is None else data[-max_steps:]
+    assert buffer._data.shape[-1] == 2
+    assert buffer.view().dtype == bool
+    assert np.array_equal(buffer.view(), kept)
+    assert np.array_equal(buffer.view(start=11), data[11:])
+
+
+def test_disk_probe_buffer(rng, tmpdir):
+    data = rng.uniform(-1, 1, size=(13, 2, 3)).astype(np.float32)
+    path = str(tmpdir.join("probe.dat"))
+
+    buffer = DiskProbeBuffer((2, 3), path, chunk_steps=4)
+    assert buffer.view().shape == (0, 2, 3)
+    buffer.reserve(20)
+    buffer.append(data[0])
+    buffer.append(data[1], steps=6)
+    # full chunks are written as they are collected, the rest when read
+    assert os.path.getsize(path) == 4 * data[0].nbytes
+    buffer.extend(data[7:9])
+    buffer.extend(data[9:])
+
+    kept = np.concatenate([data[:1], np.repeat(data[1:2], 6, axis=0),
+                           data[7:]])
+    assert buffer.n_steps == len(buffer) == len(kept)
+    x = buffer.view()
+    assert os.path.getsize(path) == kept.nbytes
+    assert isinstance(x, np.memmap)
+    assert not x.flags.writeable
+    assert np.array_equal(x, kept)
+    assert np.array_equal(buffer.view(start=11), kept[11:])
+
+    # views of discarded steps stay valid
+    buffer.clear()
+    buffer.extend(data[:2])
+    assert np.array_equal(buffer.view(), data[:2])
+    assert np.array_equal(x, kept)
+
+    buffer.set_state(buffer.get_state(), 2)
+    assert np.array_equal(buffer.view(), data[:2])
+    with pytest.raises(SimulationError, match="does not match"):
+        buffer.set_state(data[:2, 0], 2)
+
+    # no more than one chunk is kept in memory, however many steps are
+    # recorded at once
+    many = np.repeat(data, 10, axis=0)
+    buffer.extend(many[:1])
+    buffer.extend(many)
+    buffer.append(data[0], steps=50)
+    assert buffer._chunk._data.shape == (4, 2, 3)
+    assert np.array_equal(buffer.view(), np.concatenate(
+        [data[:2], many[:1], many, np.repeat(data[:1], 50, axis=0)]))
+
+
+def test_compact_state(seed):
+    model = CxModel()
+    input = CxSpikeInput(4)
+    for t in range(1, 30, 2):
+        input.add_spikes(t, [0, 2, 3])
+    input_probe = CxProbe(target=input, key='s')
+    input.add_probe(input_probe)
+    model.add_input(input)
+
+    probes = []
+    for vmin in (0, -2**10 + 1):
+        group = CxGroup(4)
+        group.configure_lif(tau_rc=0.02, tau_ref=0.002, dt=0.001)
+        group.configure_filter(0.005)
+        group.vmin = vmin
+
+        synapses = CxSynapses(4)
+        synapses.set_full_weights(np.diag([40., -40., 40., 5.]))
+        group.add_synapses(synapses)
+        axons = CxAxons(4)
+        axons.target = synapses
+        input.add_axons(axons)
+
+        probes.append(CxProbe(target=group, key='s'))
+        group.add_probe(probes[-1])
+        model.add_group(group)
+    model.discretize()
+
+    with CxSimulator(model, seed=seed) as sim:
+        assert sim.w.dtype == np.int8
+        assert sim.vmin.shape == (8,) and sim.vmax.shape == (1,)
+        sim.run_steps(40)
+        ref = [sim.get_probe_output(p) for p in [input_probe] + probes]
+
+    with CxSimulator(model, seed=seed, packed_spikes=True) as sim:
+        sim.run_steps(40)
+        out = [sim.get_probe_output(p) for p in [input_probe] + probes]
+
+    for x, y in zip(ref, out):
+        assert x.dtype == y.dtype == np.float32
+        assert np.any(x != 0)
+        assert np.array_equal(x, y)
+
+
+def test_decay_int(rng, seed):
+    model = CxModel()
+    group = CxGroup(100)
+    group.configure_filter(0.01)
+    group.configure_relu()
+    group.decayU[:] = rng.uniform(0, 1, size=group.n)
+    model.add_group(group)
+    model.discretize()
+
+    with CxSimulator(model, seed=seed) as sim:
+        x = rng.randint(-2**23, 2**23, size=(1, group.n)).astype(np.int32)
+        u = rng.randint(-2**21, 2**21, size=(1, group.n)).astype(np.int32)
+
+        # rounds toward zero, as on the chip
+        r = 2**12 - 1 - group.decayU.astype(np.int64)
+        ref = np.sign(x) * np.right_shift(np.abs(x) * r, 12) + u
+
+        sim._decay_int(x, u, slice(None), sim._retainU, sim.scaleU)
+        assert np.array_equal(x, ref)
+
+
+def test_simulator_trials(seed):
+    n_trials = 3
+    n_axons = 4
+
+    model = CxModel()
+
+    input = CxSpikeInput(n_axons)
+    for t in range(1, 20, 3):
+        input.add_spikes(t, [0, 1])
+    model.add_input(input)
+
+    group = CxGroup(n_axons)
+    group.configure_relu()
+    group.configure_filter(0.01)
+    group.bias[:] = 0.1
+    group.enableNoise[:] = 1
+    group.noiseExp0 = -2
+    group.noiseMantOffset0 = 0
+    group.noiseAtDendOrVm = 1
+
+    synapses = CxSynapses(n_axons)
+    synapses.set_full_weights(10 * np.eye(n_axons))
+    group.add_synapses(synapses)
+
+    axons = CxAxons(n_axons)
+    axons.target = synapses
+    input.add_axons(axons)
+
+    probe = CxProbe(target=group, key='v')
+    group.add_probe(probe)
+    model.add_group(group)
+    model.discretize()
+
+    with CxSimulator(model, seed=seed, n_trials=n_trials) as sim:
+        sim.run_steps(30)
+        y = sim.get_probe_output(probe)
+    assert y.shape == (n_trials, 30, n_axons)
+
+    with CxSimulator(model, seed=seed) as sim:
+        sim.run_steps(30)
+        y0 = sim.get_probe_output(probe)
+    assert np.array_equal(y[0], y0)
+
+    # trials have different noise
+    assert not np.array_equal(y[0], y[1])
+
+    # without noise, trials only differ in their trial-specific inputs
+    input.add_spikes(5, [2, 3], trial=2)
+    group.enableNoise[:] = 0
+    with CxSimulator(model, seed=seed, n_trials=n_trials) as sim:
+        sim.run_steps(30)
+        y = sim.get_probe_output(probe)
+    assert np.array_equal(y[0], y[1])
+    assert not np.array_equal(y[0], y[2])
+
+
+def test_simulator_reset(seed):
+    n = 4
+
+    def add_spikes(input):
+        for t in range(1, 20, 3):
+            input.add_spikes(t, [0, 1])
+
+    model = CxModel()
+    input = CxSpikeInput(n)
+    add_spikes(input)
+    model.add_input(input)
+
+    group = CxGroup(n)
+    group.configure_relu()
+    group.configure_filter(0.01)
+    group.bias[:] = 0.1
+    group.enableNoise[:] = 1
+    group.noiseExp0 = -2
+    group.noiseMantOffset0 = 0
+    group.noiseAtDendOrVm = 1
+
+    synapses = CxSynapses(n)
+    synapses.set_full_weights(10 * np.eye(n))
+    synapses.set_delays(2)
+    group.add_synapses(synapses)
+
+    axons = CxAxons(n)
+    axons.target = synapses
+    input.add_axons(axons)
+
+    probe = CxProbe(target=group, key='v')
+    group.add_probe(probe)
+    model.add_group(group)
+    model.discretize()
+
+    with CxSimulator(model, seed=seed) as sim:
+        sim.run_steps(30)
+        y0 = sim.get_probe_output(probe).copy()
+
+        sim.reset()
+        assert sim.t == 0
+        assert len(input.spikes) == 0
+        assert len(sim.probe_outputs[probe]) == 0
+        add_spikes(input)
+        sim.run_steps(30)
+        assert np.array_equal(sim.get_probe_output(probe), y0)
+
+        # a new seed changes the noise
+        sim.reset(seed=seed + 1)
+        add_spikes(input)
+        sim.run_steps(30)
+        assert not np.array_equal(sim.get_probe_output(probe), y0)
+
+
+@pytest.mark.parametrize("discretize", [False, True])
+def test_event_driven(discretize, seed, monkeypatch):
+    n = 5
+    model = CxModel()
+    input = CxSpikeInput(n)
+    for t in [3, 4, 5, 60, 61, 150]:
+        input.add_spikes(t, [0, 2, 4])
+    input_probe = CxProbe(target=input, key='s')
+    input.add_probe(input_probe)
+    model.add_input(input)
+
+    probes = []
+    source = input
+    for k in range(3):
+        group = CxGroup(n)
+        group.configure_lif(tau_rc=0.02, tau_ref=0.002, dt=0.001)
+        group.configure_filter(0.005)
+        group.vth[:] = 1.
+        if k == 2:
+            group.bias[:] = 0.5 * group.vth  # subthreshold, never at rest
+
+        synapses = CxSynapses(n)
+        synapses.set_full_weights(np.eye(n) * (200 if k < 2 else -0.1))
+        synapses.set_delays(k)
+        group.add_synapses(synapses)
+        axons = CxAxons(n)
+        axons.target = synapses
+        source.add_axons(axons)
+        source = group
+
+        for key in ('v', 's'):
+            probes.append(CxProbe(target=group, key=key))
+            group.add_probe(probes[-1])
+        model.add_group(group)
+    if discretize:
+        model.discretize()
+
+    def run(**kwargs):
+        with CxSimulator(model, seed=seed, **kwargs) as sim:
+            sim.run_steps(100)
+            sim.run_steps(100)
+            return [sim.get_probe_output(p).copy()
+                    for p in [input_probe] + probes], sim
+
+    ref, _ = run()
+    out, sim = run(event_driven=True, max_probe_steps=250)
+    for x, y in zip(ref, out):
+        assert np.array_equal(x, y)
+    assert np.any(ref[2] != 0) and np.any(ref[4] != 0)
+
+    # groups at rest are skipped, and idle steps are fast-forwarded
+    updated = []
+    monkeypatch.setattr(CxSimulator, '_update', lambda self, q0, noise, i0,
+                        i1: updated.append(self.t))
+    group = list(model.cx_groups)[2]
+    group.bias[:] = 0
+    with CxSimulator(model, seed=seed, event_driven=True) as sim:
+        sim.run_steps(200)
+        assert sim.t == 200
+        assert len(sim.probe_outputs[probes[0]]) == 200
+    assert 0 < len(updated) < 100
+
+
+@pytest.mark.parametrize("discretize", [False, True])
+def test_layer_schedule(discretize, rng, seed, monkeypatch):
+    n = 20
+    model = CxModel()
+    input = CxSpikeInput(n)
+    for t in range(1, 150, 3):
+        input.add_spikes(t, rng.choice(n, size=5, replace=False))
+        input.add_spikes(t + 1, rng.choice(n, size=5, replace=False),
+                         trial=1)
+    model.add_input(input)
+
+    def connect(sources, group):
+        synapses = CxSynapses(n)
+        synapses.set_full_weights(rng.uniform(-5, 20, size=(n, n)))
+        if discretize:
+            synapses.set_delays(rng.randint(0, 4, size=(n, n)))
+        group.add_synapses(synapses)
+        for source in sources:
+            axons = CxAxons(n)
+            axons.target = synapses
+            source.add_axons(axons)
+
+    groups = []
+    probes = []
+    for k in range(3):
+        group = CxGroup(n)
+        group.configure_lif(tau_rc=0.02, tau_ref=0.002)
+        group.configure_filter(0.005)
+        group.enableNoise[:] = k == 1
+        group.noiseExp0 = -2
+        group.noiseMantOffset0 = 0
+        group.noiseAtDendOrVm = 1
+        for key in ('v', 's'):
+            probes.append(CxProbe(target=group, key=key))
+            group.add_probe(probes[-1])
+        model.add_group(group)
+        groups.append(group)
+
+    # the last group has two sources, in different layers
+    connect([input], groups[0])
+    connect([groups[0]], groups[1])
+    connect([input, groups[1]], groups[2])
+    if discretize:
+        model.discretize()
+
+    with CxSimulator(model, seed=seed, n_trials=2) as sim:
+        assert sim._layers == [[0], [1], [2]]
+        for _ in range(200):
+            sim.step()
+        ref = [sim.get_probe_output(p).copy() for p in probes]
+
+    # use the layer-wise schedule, over several runs of a few steps each
+    monkeypatch.setattr(CxSimulator, 'max_layer_steps', 7)
+    with CxSimulator(model, seed=seed, n_trials=2, engine='numpy') as sim:
+        sim._step_times = [np.inf, None]
+        sim.run_steps(100)
+        sim.run_steps(100)
+        assert sim._step_times[1] is not None
+        out = [sim.get_probe_output(p) for p in probes]
+
+    for x, y in zip(ref, out):
+        assert np.array_equal(x, y)
+    assert all(np.any(x != 0) for x in ref[1::2])
+
+    # groups with a cycle are run one step at a time
+    connect([groups[2]], groups[0])
+    with CxSimulator(model, seed=seed) as sim:
+        assert sim._layers is None
+
+
+@pytest.mark.parametrize("schedule", ["step", "layered", "jit"])
+def test_reorder_cxs(schedule, rng, seed):
+    n_axons, n = 30, 60
+    model = CxModel()
+    input = CxSpikeInput(n_axons)
+    for t in range(1, 60):
+        input.add_spikes(t, rng.choice(n_axons, size=8, replace=False))
+    model.add_input(input)
+
+    # each axon targets a window of compartments, which are then shuffled
+    perm = rng.permutation(n)
+    weights = np.zeros((n_axons, n))
+    for i in range(n_axons):
+        weights[i, perm[(2 * i + np.arange(4)) % n]] = rng.uniform(1, 20, 4)
+
+    groups = []
+    probes = []
+    for k, location in enumerate(('core', 'core', 'cpu')):
+        group = CxGroup(n, location=location)
+        group.configure_lif(tau_rc=0.02, tau_ref=0.002)
+        group.configure_filter(0.005)
+        group.refractDelay[:] = rng.randint(1, 4, size=n)
+        group.bias[:] = rng.uniform(0, 0.2, size=n)
+        group.enableNoise[:] = rng.rand(n) < 0.5 * k
+        group.noiseExp0 = -2
+        group.noiseMantOffset0 = 0
+        group.noiseAtDendOrVm = max(k - 1, 0)
+
+        synapses = CxSynapses(n_axons)
+        synapses.set_full_weights(weights)
+        synapses.set_delays(rng.randint(0, 3, size=(n_axons, n)))
+        group.add_synapses(synapses)
+        source = groups[-1] if groups else input
+        axons = CxAxons(source.n)
+        axons.target = synapses
+        axons.set_axon_map(np.arange(source.n) % n_axons)
+        source.add_axons(axons)
+
+        probes.append(CxProbe(target=group, key='v', slice=slice(5, 50, 3)))
+        group.add_probe(probes[-1])
+        probes.append(CxProbe(target=group, key='s'))
+        group.add_probe(probes[-1])
+        model.add_group(group)
+        groups.append(group)
+    model.discretize()
+
+    def run(reorder):
+        with CxSimulator(model, seed=seed, n_trials=2, engine='numpy',
+                         reorder=reorder) as sim:
+            assert set(sim._cx_orders) == (set(groups) if reorder else set())
+            if schedule == 'step':
+                for _ in range(80):
+                    sim.step()
+            elif schedule == 'layered':
+                sim._step_times = [np.inf, None]
+                sim.run_steps(80)
+            else:
+                JitEngine(sim).run_steps(80)
+            table = sim.synapse_tables[groups[0].synapses[0]]
+            return [sim.get_probe_output(p) for p in probes], table
+
+    ref, _ = run(reorder=False)
+    out, table = run(reorder=True)
+    assert all(np.any(x != 0) for x in ref[1::2])
+    for x, y in zip(ref, out):
+        assert np.array_equal(x, y)
+
+    # the targets of each axon are closer together
+    axon_ids = np.arange(n_axons)
+    ptrs, _, targets = table.gather(axon_ids, np.zeros_like(axon_ids))
+    targets = targets[table.weights[ptrs] != 0].reshape(n_axons, 4)
+    shuffled = perm[(2 * axon_ids[:, None] + np.arange(4)) % n]
+    assert np.ptp(targets, axis=1).mean() < 0.5 * np.ptp(
+        shuffled, axis=1).mean()
+
+
+def test_synapse_delays(seed):
+    delays = [0, 1, 4]
+
+    model = CxModel()
+    input = CxSpikeInput(1)
+    input.add_spikes(2, [0])
+    model.add_input(input)
+
+    group = CxGroup(len(delays))
+    group.configure_relu()
+    group.configure_filter(0)
+    synapses = CxSynapses(1)
+    synapses.set_full_weights(np.ones((1, len(delays))))
+    synapses.set_delays([np.array(delays)])
+    group.add_synapses(synapses)
+
+    axons = CxAxons(1)
+    axons.target = synapses
+    input.add_axons(axons)
+
+    probe = CxProbe(target=group, key='u')
+    group.add_probe(probe)
+    model.add_group(group)
+    model.discretize()
+
+    with CxSimulator(model, seed=seed) as sim:
+        sim.run_steps(10)
+        u = sim.get_probe_output(probe)
+
+    # the spike at step 2 arrives on step 3, plus the synapse delay
+    assert np.array_equal(np.argmax(u != 0, axis=0), 2 + np.array(delays))
+
+
+@pytest.mark.parametrize("integer", [False, True])
+def test_noise_generator_blocks(integer, seed):
+    streams = [(4, 2), (1, 3)]
+    small = NoiseGenerator(seed, streams, integer, block_size=7)
+    large = NoiseGenerator(seed, streams, integer, block_size=1000)
+    x = np.array([small.next() for _ in range(30)])
+    y = np.array([large.next() for _ in range(30)])
+    assert np.array_equal(x, y)
+    steps = NoiseGenerator(seed, streams, integer, block_size=7)
+    assert np.array_equal(x, np.concatenate(
+        [steps.next_steps(4), [steps.next()], steps.next_steps(25)]))
+
+    # streams do not depend on each other
+    one = NoiseGenerator(seed, streams[1:], integer, block_size=7)
+    assert np.array_equal(x[:, 2:], [one.next() for _ in range(30)])
+    assert len(np.unique(x)) > 50
+    assert np.all(x >= -128 if integer else x >= -1)
+    assert np.all(x < 128 if integer else x < 1)
+
+
+def test_learning_updates(rng, seed):
+    n_axons, d = 5, 2
+
+    model = CxModel()
+    group = CxGroup(2 * d)
+    group.configure_relu()
+    synapses = CxSynapses(n_axons)
+    synapses.set_full_weights(np.zeros((n_axons, 2 * d)))
+    synapses.set_learning()
+    group.add_synapses(synapses)
+    model.add_group(group)
+    model.discretize()
+
+    with CxSimulator(model, seed=seed) as sim:
+        table = sim.synapse_tables[synapses]
+        assert table.weight_matrix.shape == (n_axons, 2 * d)
+        assert table.weight_matrix.dtype == np.int32
+
+        z = rng.uniform(0, 2, size=n_axons)
+        sim.z[synapses][:] = z
+        errors = [rng.uniform(-1, 1, size=d) for _ in range(3)]
+        sim.host2chip([], [(synapses, t, e) for t, e in enumerate(errors)])
+
+        w_ref = np.zeros((n_axons, 2 * d), dtype=np.int32)
+        for e in errors:
+            w_ref += (np.outer(z, np.hstack([-e, e])) * 50).astype(np.int32)
+        assert np.array_equal(table.weight_matrix, w_ref)
+        assert np.array_equal(
+            table.weights, w_ref.ravel())  # weights are updated in place
+
+        # reset restores the built weights and clears the traces
+        sim.reset()
+        assert np.all(table.weight_matrix == 0)
+        assert np.all(sim.z[synapses] == 0)
+
+
+def test_share_weights(rng, seed):
+    n_axons, n = 10, 6
+    weights = rng.uniform(-1, 1, size=(n_axons, n))
+
+    model = CxModel()
+    input = CxSpikeInput(n_axons)
+    input.add_spikes(1, np.arange(n_axons))
+    model.add_input(input)
+    synapses = []
+    for k, learning in enumerate((False, True, True)):
+        group = CxGroup(n)
+        group.configure_relu()
+        synapses.append(CxSynapses(n_axons))
+        synapses[k].set_full_weights(weights)
+        if learning:
+            synapses[k].set_learning()
+        group.add_synapses(synapses[k])
+        axons = CxAxons(n_axons)
+        axons.target = synapses[k]
+        input.add_axons(axons)
+        model.add_group(group)
+    model.discretize()
+
+    # all groups have the same scale, so their weights are identical
+    for s in synapses:
+        for i in range(n_axons):
+            assert s.weights[i] is synapses[0].weights[i]
+            assert s.indices[i] is synapses[0].indices[0]
+    assert not synapses[0].weights[0].flags.writeable
+    assert model.share_weights() == 0  # already shared
+
+    with CxSimulator(model, seed=seed) as sim:
+        tables = [sim.synapse_tables[s] for s in synapses]
+        assert all(t.weights is tables[0].weights for t in tables)
+        assert tables[0].dense_weights(n) is tables[1].dense_weights(n)
+        built = tables[0].weights.copy()
+
+        # learning copies the weights of the table that it changes
+        sim.z[synapses[1]][:] = 1
+        sim.host2chip([], [(synapses[1], 1, np.ones(n // 2))])
+        assert tables[1].weights is not tables[0].weights
+        assert np.all(tables[1].weights != built)
+        assert np.array_equal(tables[0].weights, built)
+        assert tables[2].weights is tables[0].weights
+
+        sim.reset()
+        assert tables[1].weights is tables[0].weights
+
+
+def test_fuse_synapses(rng, seed):
+    n_groups, n, n_axons = 40, 5, 10
+    model = CxModel()
+    input = CxSpikeInput(n_axons)
+    for t in range(1, 80, 2):
+        input.add_spikes(t, rng.choice(n_axons, size=4, replace=False))
+    model.add_input(input)
+
+    groups = []
+    probes = []
+    for k in range(n_groups):
+        group = CxGroup(n, location='cpu' if k >= n_groups - 5 else 'core')
+        group.configure_lif(tau_rc=0.02, tau_ref=0.002)
+        group.configure_filter(0.005)
+        group.bias[:] = rng.uniform(0, 1.5, size=n)
+        group.enableNoise[:] = k % 3 == 0
+        group.noiseExp0 = -2
+        group.noiseMantOffset0 = 0
+
+        source = groups[-1] if groups else input
+        synapses = CxSynapses(source.n)
+        synapses.set_full_weights(rng.uniform(-5, 20, size=(source.n, n)))
+        synapses.set_delays(rng.randint(0, 3, size=(source.n, n)))
+        group.add_synapses(synapses)
+        axons = CxAxons(source.n)
+        axons.target = synapses
+        source.add_axons(axons)
+
+        if k % 10 == 0:
+            probes.append(CxProbe(target=group, key='v'))
+            group.add_probe(probes[-1])
+            probes.append(CxProbe(target=group, key='s', slice=slice(1, 4)))
+            group.add_probe(probes[-1])
+        model.add_group(group)
+        groups.append(group)
+
+    # synapses with one weight row shared by many compartments, which would
+    # take much more memory stored for each compartment
+    many = CxSpikeInput(1000)
+    for t in range(5, 80, 5):
+        many.add_spikes(t, rng.choice(1000, size=50, replace=False))
+    model.add_input(many)
+    shared = CxSynapses(1)
+    shared.set_full_weights(np.full((1, n), 0.2))
+    groups[5].add_synapses(shared)
+    axons = CxAxons(1000)
+    axons.target = shared
+    axons.set_axon_map(np.zeros(1000))
+    many.add_axons(axons)
+
+    # learning synapses
+    learning = CxSynapses(n)
+    learning.set_full_weights(np.zeros((n, 2)))
+    learning.set_learning()
+    groups[6].add_synapses(learning)
+    axons = CxAxons(n)
+    axons.target = learning
+    groups[3].add_axons(axons)
+    model.discretize()
+
+    def run(fuse):
+        with CxSimulator(model, seed=seed, engine='numpy', fuse=fuse) as sim:
+            assert sim._step_synapses == ([shared, learning] if fuse else [
+                synapses for group in groups for synapses in group.synapses])
+            assert len(sim._axon_groups) == (1 if fuse else n_groups - 1)
+            for t in range(100):
+                if t == 50:
+                    sim.host2chip([], [(learning, t, np.ones(1))])
+                sim.step()
+            if fuse:
+                table = sim._fused_table
+                assert table.n_sparse + table.n_dense > 50
+            return [sim.get_probe_output(p) for p in probes] + [
+                sim.q, sim.u, sim.v, sim.z[learning]]
+
+    ref = run(fuse=False)
+    out = run(fuse=True)
+    assert all(np.any(x != 0) for x in ref)
+    for x, y in zip(ref, out):
+        assert np.array_equal(x, y)
+
+
+@pytest.mark.parametrize("max_probe_steps", [None, 20])
+def test_filtered_probe_output(max_probe_steps, rng, seed):
+    n = 10
+    model = CxModel()
+    input = CxSpikeInput(n)
+    for t in range(1, 60):
+        input.add_spikes(t, rng.choice(n, size=3, replace=False))
+    model.add_input(input)
+
+    group = CxGroup(n)
+    group.configure_lif(tau_rc=0.02, tau_ref=0.002)
+    group.configure_filter(0.005)
+    synapses = CxSynapses(n)
+    synapses.set_full_weights(rng.uniform(-5, 20, size=(n, n)))
+    group.add_synapses(synapses)
+    axons = CxAxons(n)
+    axons.target = synapses
+    input.add_axons(axons)
+
+    weights = rng.uniform(-1, 1, size=(n, 2))
+    synapse = nengo.Lowpass(0.005)
+    raw_probe = CxProbe(target=group, key='u', weights=weights)
+    probe = CxProbe(target=group, key='u', weights=weights, synapse=synapse)
+    group.add_probe(raw_probe)
+    group.add_probe(probe)
+    model.add_group(group)
+    model.discretize()
+
+    with CxSimulator(model, seed=seed, max_probe_steps=max_probe_steps) as sim:
+        # output can be read before any steps are run
+        assert sim.get_probe_output(probe).shape == (0, 2)
+        outputs = []
+        raw = []
+        for _ in range(5):
+            sim.run_steps(10)
+            # outputs are views of the recorded data, so we copy them
+            outputs.append(
+                sim.get_probe_output(probe, start=sim.t - 10).copy())
+            raw.append(sim.get_probe_output(raw_probe, start=sim.t - 10))
+            assert np.array_equal(sim.get_probe_output(probe)[-10:],
+                                  outputs[-1])
+        filtered = sim.get_probe_output(probe)
+
+    # each step is filtered once, in order
+    raw = np.concatenate(raw)
+    step = synapse.make_step((2,), (2,), model.dt, None, dtype=raw.dtype)
+    ref = np.array([step(0, x).copy() for x in raw])
+    assert np.array_equal(np.concatenate(outputs), ref)
+    assert np.array_equal(filtered, ref[-len(filtered):])
+    assert np.any(ref != 0)
+
+    if max_probe_steps is not None:
+        with CxSimulator(model, seed=seed, max_probe_steps=20) as sim:
+            sim.run_steps(30)
+            with pytest.raises(SimulationError, match="discarded"):
+                sim.get_probe_output(probe)
+
+
+@pytest.mark.parametrize("schedule", ["step", "event", "layered", "jit"])
+def test_sample_every(schedule, rng, seed, tmpdir):
+    n = 10
+    model = CxModel()
+    input = CxSpikeInput(n)
+    for t in range(1, 90, 7):
+        input.add_spikes(t, rng.choice(n, size=5, replace=False))
+    model.add_input(input)
+
+    group = CxGroup(n)
+    group.configure_lif(tau_rc=0.02, tau_ref=0.002)
+    group.configure_filter(0.005)
+    synapses = CxSynapses(n)
+    synapses.set_full_weights(rng.uniform(0, 30, size=(n, n)))
+    group.add_synapses(synapses)
+    axons = CxAxons(n)
+    axons.target = synapses
+    input.add_axons(axons)
+
+    # pairs of probes recording every step, and only sampled steps
+    weights = rng.uniform(-1, 1, size=(n, 2))
+    kwargs = [dict(target=input, key='s'),
+              dict(target=group, key='v', slice=slice(2, 8)),
+              dict(target=group, key='s', weights=weights,
+                   synapse=nengo.Lowpass(0.005))]
+    periods = [4, 2.5, 3]
+    probes = []
+    for kw, period in zip(kwargs, periods):
+        probes.append((CxProbe(**kw),
+                       CxProbe(sample_every=period * model.dt, **kw)))
+        for probe in probes[-1]:
+            kw['target'].add_probe(probe)
+    model.add_group(group)
+    model.discretize()
+
+    def run(sim, steps):
+        if schedule == 'layered':
+            sim._step_times = [np.inf, None]
+        if schedule == 'jit':
+            JitEngine(sim).run_steps(steps)
+        else:
+            sim.run_steps(steps)
+
+    event_driven = schedule == 'event'
+    with CxSimulator(model, seed=seed, engine='numpy',
+                     event_driven=event_driven) as sim:
+        run(sim, 37)
+        path = str(tmpdir.join("checkpoint"))
+        save_state(path, sim.get_state())
+        run(sim, 53)
+        outputs = [(sim.get_probe_output(p), sim.get_probe_output(q))
+                   for p, q in probes]
+        assert all(isinstance(sim.probe_outputs[q], SampledProbeBuffer)
+                   for _, q in probes)
+
+    # the sampled probes record the filtered output of each sampled step
+    # (up to rounding, since weights are applied to fewer steps at once)
+    for (x, y), period in zip(outputs, periods):
+        assert np.any(x != 0)
+        assert np.allclose(x[sampled_steps(period, 0, 90)], y)
+
+    # sampling (and filtering) continues from a saved state
+    with CxSimulator(model, seed=seed, engine='numpy',
+                     event_driven=event_driven) as sim:
+        sim.set_state(load_state(path))
+        run(sim, 53)
+        for (_, y), (_, q) in zip(outputs, probes):
+            assert np.array_equal(sim.get_probe_output(q), y)
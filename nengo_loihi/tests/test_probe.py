@@ -1,7 +1,11 @@
+import os
+
 import pytest
 import nengo
 import numpy as np
 
+import nengo_loihi
+
 
 def test_spike_units(Simulator, seed):
     with nengo.Network(seed=seed) as model:
@@ -47,3 +51,97 @@ def test_repeated_probes(Simulator):
     for _ in range(5):
         with Simulator(net) as sim:
             sim.run(0.1)
+
+
+@pytest.mark.parametrize('precompute', [True, False])
+def test_multiple_runs(Simulator, seed, precompute):
+    with nengo.Network(seed=seed) as model:
+        stim = nengo.Node(lambda t: np.sin(10 * t))
+        a = nengo.Ensemble(100, 1)
+        nengo.Connection(stim, a)
+        probes = [nengo.Probe(a, synapse=0.01), nengo.Probe(a.neurons)]
+
+    with Simulator(model, precompute=precompute) as sim:
+        sim.run(0.2)
+        ref = [sim.data[p] for p in probes]
+
+    # data is collected incrementally, and filtered once per step
+    with Simulator(model, precompute=precompute) as sim:
+        for _ in range(4):
+            sim.run(0.05)
+            assert all(len(sim.data[p]) == sim.n_steps for p in probes)
+        assert sim.data[probes[0]] is sim.data[probes[0]]
+        out = [sim.data[p] for p in probes]
+
+    for x, y in zip(ref, out):
+        assert np.any(x != 0)
+        assert np.array_equal(x, y)
+
+
+@pytest.mark.parametrize('precompute', [True, False])
+def test_sample_every(Simulator, seed, precompute):
+    with nengo.Network(seed=seed) as model:
+        stim = nengo.Node(lambda t: np.sin(10 * t))
+        a = nengo.Ensemble(100, 1)
+        nengo.Connection(stim, a)
+        probes = [nengo.Probe(a, synapse=0.01), nengo.Probe(a.neurons)]
+        sampled = [nengo.Probe(a, synapse=0.01, sample_every=0.005),
+                   nengo.Probe(a.neurons, sample_every=0.0025)]
+
+    with Simulator(model, precompute=precompute) as sim:
+        sim.run(0.1)
+        sim.run(0.05)
+
+    # samples are taken after filtering, on the steps given by trange
+    for p, q in zip(probes, sampled):
+        t = sim.trange(sample_every=q.sample_every)
+        steps = np.round(t / sim.dt).astype(int) - 1
+        assert sim.data[q].shape == (len(t),) + sim.data[p].shape[1:]
+        assert np.any(sim.data[q] != 0)
+        assert np.allclose(sim.data[q], sim.data[p][steps])
+
+
+@pytest.mark.parametrize('precompute', [True, False])
+def test_probe_dir(Simulator, seed, precompute, tmpdir):
+    with nengo.Network(seed=seed) as model:
+        stim = nengo.Node(lambda t: np.sin(10 * t))
+        a = nengo.Ensemble(100, 1)
+        nengo.Connection(stim, a)
+        probes = [nengo.Probe(a, synapse=0.01), nengo.Probe(a.neurons),
+                  nengo.Probe(a, synapse=0.01, sample_every=0.005)]
+
+    with Simulator(model, precompute=precompute) as sim:
+        sim.run(0.1)
+        sim.run(0.05)
+        ref = [sim.data[p] for p in probes]
+
+    nengo_loihi.add_params(model)
+    model.config[probes[1]].on_disk = False
+    probe_dir = str(tmpdir.join("probes"))
+    with Simulator(model, precompute=precompute, probe_dir=probe_dir) as sim:
+        sim.run(0.1)
+        sim.run(0.05)
+        out = [sim.data[p] for p in probes]
+    assert len(os.listdir(probe_dir)) > 0
+    assert [isinstance(x, np.memmap) for x in out] == [True, False, True]
+
+    # a single probe can be kept in a temporary directory
+    model.config[probes[1]].on_disk = True
+    with Simulator(model, precompute=precompute) as sim:
+        sim.run(0.15)
+        probe_files = sim.probe_files
+        assert isinstance(sim.data[probes[1]], np.memmap)
+        assert not isinstance(sim.data[probes[0]], np.memmap)
+        out[1] = sim.data[probes[1]]
+    assert probe_files.directory is None
+
+    for x, y in zip(ref, out):
+        assert np.any(x != 0)
+        assert np.array_equal(x, y)
+
+    # memory use does not grow with the length of the run
+    with Simulator(model, precompute=precompute, probe_dir=probe_dir) as sim:
+        sim.run(2.5)
+        buffers = [sim._probe_outputs[p] for p in probes]
+        assert all(len(b._chunk._data) <= b.chunk_steps for b in buffers)
+        assert all(len(b) > b.chunk_steps for b in buffers[:2])
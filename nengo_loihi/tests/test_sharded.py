@@ -0,0 +1,157 @@
+import nengo
+import numpy as np
+import pytest
+
+import nengo_loihi
+from nengo_loihi.loihi_cx import (
+    CxAxons,
+    CxGroup,
+    CxModel,
+    CxProbe,
+    CxSimulator,
+    CxSpikeInput,
+    CxSynapses,
+)
+from nengo_loihi.sharded import ShardedCxSimulator
+
+
+def test_sharded_noise(rng, seed):
+    n = 20
+    model = CxModel()
+
+    input = CxSpikeInput(n)
+    spike_times = range(1, 50, 2)
+    for t in spike_times:
+        input.add_spikes(t, rng.choice(n, size=5, replace=False))
+    ref_spikes = dict(input.spikes)
+    model.add_input(input)
+
+    groups = []
+    probes = []
+    for k in range(3):
+        group = CxGroup(n)
+        group.configure_relu()
+        group.configure_filter(0.01)
+        group.bias[:] = 0.05 * k
+        group.enableNoise[:] = k > 0
+        group.noiseExp0 = -2
+        group.noiseMantOffset0 = 0
+        group.noiseAtDendOrVm = 1
+
+        synapses = CxSynapses(n)
+        synapses.set_full_weights(rng.uniform(-5, 20, size=(n, n)))
+        group.add_synapses(synapses)
+
+        axons = CxAxons(n)
+        axons.target = synapses
+        (groups[-1] if groups else input).add_axons(axons)
+
+        probe = CxProbe(target=group, key='v')
+        group.add_probe(probe)
+        probes.append(probe)
+
+        model.add_group(group)
+        groups.append(group)
+
+    model.discretize()
+
+    with CxSimulator(model, seed=seed, engine='numpy') as sim:
+        sim.run_steps(100)
+        ref = [sim.get_probe_output(probe) for probe in probes]
+        ref_delivery = sim.delivery_report()
+
+    with ShardedCxSimulator(model, seed=seed, n_shards=3) as sim:
+        assert len(sim.workers) == 3
+        sim.run_steps(60)
+        sim.run_steps(40)
+        out = [sim.get_probe_output(probe).copy() for probe in probes]
+
+        # workers only receive new input spikes through host2chip
+        sim.reset()
+        sim.host2chip([(input, t, ref_spikes[t]) for t in spike_times], [])
+        sim.run_steps(100)
+        out_reset = [sim.get_probe_output(probe) for probe in probes]
+        # spikes may be delivered in other ways, but on the same steps
+        assert [(syn, a + b) for _, syn, a, b in sim.delivery_report()] == [
+            (syn, a + b) for _, syn, a, b in ref_delivery]
+
+    for x, y, z in zip(ref, out, out_reset):
+        assert np.any(x != 0)
+        assert np.array_equal(x, y)
+        assert np.array_equal(x, z)
+
+
+@pytest.mark.parametrize("precompute", [True, False])
+def test_sharded_simulator(precompute, seed):
+    with nengo.Network(seed=seed) as net:
+        stim = nengo.Node(lambda t: np.sin(10 * t))
+        a = nengo.Ensemble(100, 1)
+        b = nengo.Ensemble(100, 2)
+        nengo.Connection(stim, a)
+        nengo.Connection(a, b[0])
+        nengo.Connection(a, b[1], function=lambda x: x**2)
+        nengo.Connection(b, b, transform=0.5, synapse=0.1)
+        b_p = nengo.Probe(b, synapse=0.01)
+        spikes_p = nengo.Probe(a.neurons)
+
+        if not precompute:
+            out = nengo.Node(size_in=1)
+            conn = nengo.Connection(
+                a, out, function=lambda x: 0,
+                learning_rule_type=nengo.PES(learning_rate=1e-3))
+            nengo.Connection(out, conn.learning_rule)
+            nengo.Connection(stim, conn.learning_rule, transform=-1)
+            out_p = nengo.Probe(out)
+
+    with nengo_loihi.Simulator(
+            net, precompute=precompute, target='sim') as sim:
+        sim.run(0.2)
+
+    with nengo_loihi.Simulator(net, precompute=precompute, target='sim',
+                               n_shards=2) as sharded_sim:
+        sharded_sim.run(0.2)
+
+    assert np.array_equal(sharded_sim.data[b_p], sim.data[b_p])
+    assert np.array_equal(sharded_sim.data[spikes_p], sim.data[spikes_p])
+    if not precompute:
+        assert np.array_equal(sharded_sim.data[out_p], sim.data[out_p])
+
+
+def test_sharded_overflow_report():
+    n_axons = 1000
+    model = CxModel()
+    input = CxSpikeInput(n_axons)
+    for t in range(1, 10):
+        input.add_spikes(t, np.arange(n_axons))
+    model.add_input(input)
+
+    for k in range(3):
+        group = CxGroup(2)
+        group.configure_relu()
+        group.configure_filter(0.1)
+        synapses = CxSynapses(n_axons)
+        synapses.set_full_weights(np.ones((n_axons, 2)) * (k > 0))
+        group.add_synapses(synapses)
+        axons = CxAxons(n_axons)
+        axons.target = synapses
+        input.add_axons(axons)
+        model.add_group(group)
+    model.discretize()
+
+    assert CxSimulator.strict  # Tests should be run in strict mode
+    CxSimulator.strict = False
+    try:
+        with CxSimulator(model) as sim:
+            with pytest.warns(UserWarning):
+                sim.run_steps(10)
+            ref = sim.overflow_report()
+
+        with ShardedCxSimulator(model, n_shards=3) as sim:
+            with pytest.warns(UserWarning):
+                sim.run_steps(10)
+            report = sim.overflow_report()
+    finally:
+        CxSimulator.strict = True  # change back to True for subsequent tests
+
+    assert len(ref) == 2
+    assert set(report) == set(ref)
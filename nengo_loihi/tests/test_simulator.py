@@ -259,3 +259,122 @@ def test_all_onchip(Simulator):
     assert sim._run_steps.__name__ == "run_steps"
     assert sim.data[out_p].shape[0] == sim.trange().shape[0]
     assert np.all(sim.data[out_p][-1] > 100)
+
+
+def test_n_trials(seed, allclose):
+    with nengo.Network(seed=seed) as net:
+        stim = nengo.Node(nengo.processes.WhiteNoise(
+            dist=nengo.dists.Gaussian(0, 0.5)), size_out=1)
+        ens = nengo.Ensemble(20, 1)
+        nengo.Connection(stim, ens)
+        ens_p = nengo.Probe(ens, synapse=0.01)
+
+    with nengo_loihi.Simulator(
+            net, precompute=True, target='sim', n_trials=3) as trials_sim:
+        trials_sim.run(0.05)
+
+    # trial k matches a single run with the seed seed + k
+    with nengo_loihi.Simulator(net, precompute=True, target='sim') as sim:
+        for k, trial_data in enumerate(trials_sim.data[ens_p]):
+            sim.reset(seed=trials_sim.seed + k)
+            sim.run(0.05)
+            assert trial_data.shape == sim.data[ens_p].shape
+            assert allclose(trial_data, sim.data[ens_p])
+
+    # each trial gets its own input from the host
+    data = trials_sim.data[ens_p]
+    assert not np.allclose(data[0], data[1])
+    assert not np.allclose(data[1], data[2])
+
+    with pytest.raises(nengo.exceptions.ValidationError):
+        nengo_loihi.Simulator(net, precompute=False, target='sim', n_trials=3)
+
+
+@pytest.mark.parametrize("precompute", [True, False])
+def test_reset(precompute, seed):
+    with nengo.Network(seed=seed) as net:
+        stim = nengo.Node(lambda t: np.sin(10 * t))
+        a = nengo.Ensemble(50, 1)
+        nengo.Connection(stim, a)
+        a_p = nengo.Probe(a, synapse=0.01)
+
+        if not precompute:
+            out = nengo.Node(size_in=1)
+            conn = nengo.Connection(
+                a, out, function=lambda x: 0,
+                learning_rule_type=nengo.PES(learning_rate=1e-3))
+            nengo.Connection(out, conn.learning_rule)
+            nengo.Connection(stim, conn.learning_rule, transform=-1)
+            out_p = nengo.Probe(out)
+
+    with nengo_loihi.Simulator(
+            net, precompute=precompute, target='sim') as sim:
+        sim.run(0.1)
+        a_data = sim.data[a_p].copy()
+        if not precompute:
+            out_data = sim.data[out_p].copy()
+            assert np.any(out_data != 0)
+
+        sim.reset()
+        assert sim.n_steps == 0
+        sim.run(0.1)
+        assert np.array_equal(sim.data[a_p], a_data)
+        if not precompute:
+            assert np.array_equal(sim.data[out_p], out_data)
+
+
+@pytest.mark.skipif(pytest.config.getoption("--target") != "loihi",
+                    reason="reset reconnects to the Loihi board")
+@pytest.mark.parametrize("precompute", [True, False])
+def test_reset_loihi(precompute, seed, allclose):
+    with nengo.Network(seed=seed) as net:
+        stim = nengo.Node(lambda t: np.sin(10 * t))
+        a = nengo.Ensemble(50, 1)
+        nengo.Connection(stim, a)
+        a_p = nengo.Probe(a, synapse=0.01)
+
+        if not precompute:
+            out = nengo.Node(size_in=1)
+            conn = nengo.Connection(
+                a, out, function=lambda x: 0,
+                learning_rule_type=nengo.PES(learning_rate=1e-3))
+            nengo.Connection(out, conn.learning_rule)
+            nengo.Connection(stim, conn.learning_rule, transform=-1)
+            out_p = nengo.Probe(out)
+
+    # a run after a reset (i.e. after reconnecting to the board, with the
+    # same IO snips) matches a run of a freshly built simulator
+    with nengo_loihi.Simulator(
+            net, precompute=precompute, target='loihi') as sim:
+        sim.run(0.1)
+        sim.reset()
+        sim.run(0.1)
+
+    with nengo_loihi.Simulator(
+            net, precompute=precompute, target='loihi') as fresh_sim:
+        fresh_sim.run(0.1)
+
+    assert allclose(sim.data[a_p], fresh_sim.data[a_p])
+    if not precompute:
+        assert np.any(fresh_sim.data[out_p] != 0)
+        assert allclose(sim.data[out_p], fresh_sim.data[out_p])
+
+
+def test_hardware_limits(seed):
+    with nengo.Network(seed=seed) as net:
+        stim = nengo.Node(lambda t: np.sin(10 * t))
+        ens = nengo.Ensemble(1500, 1)
+        nengo.Connection(stim, ens)
+        ens_p = nengo.Probe(ens, synapse=0.01)
+
+    with pytest.raises(nengo.exceptions.BuildError):
+        nengo_loihi.Simulator(net, precompute=True, target='sim')
+
+    with nengo_loihi.Simulator(net, precompute=True, target='sim',
+                               hardware_limits=False) as sim:
+        sim.run(0.1)
+    assert np.all(sim.data[ens_p][-10:] > 0.5)
+
+    with pytest.raises(nengo.exceptions.ValidationError):
+        nengo_loihi.Simulator(net, target='sim', n_shards=2,
+                              hardware_limits=False)
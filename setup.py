@@ -60,6 +60,9 @@ setup(
             "numpydoc>=0.6",
             "sphinx>=1.8",
         ],
+        "numba": [
+            "numba>=0.38",
+        ],
     },
     entry_points={
         'nengo.backends': [